@@ -1,12 +1,44 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, render_template, request, jsonify, redirect, url_for, Response
 # Replaced mysql.connector with psycopg2 for PostgreSQL
 import psycopg2 
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 import json
 import time
 import os # Import OS for reading environment variables
 from urllib.parse import urlparse # Import for parsing the complex DB URL
 import psycopg2.extras # Needed for DictCursor
+import threading # Guards the shared connection pool
+import queue # Per-client buffers for the live event stream
+import collections
+import io
+import atexit
+import re
+import sys
+import select # Waits on the LISTEN connection
+import bisect
+import csv # Bulk registration uploads
+import itertools
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+import numpy as np # Batched fill-rate regression
+import math
+import uuid # Server-side cursor names
+import gzip # Response compression
+import decimal
+try:
+    import pyarrow as pa # Parquet exports (optional)
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+try:
+    import orjson # Fast encoder for columnar responses (optional)
+except ImportError:
+    orjson = None
+try:
+    import brotli # br response compression (optional; gzip is always available)
+except ImportError:
+    brotli = None
 
 # --- FIREBASE ADMIN SDK IMPORTS (REMOVED FOR SIMULATION) ---
 # Removed all Firebase dependencies as requested.
@@ -19,6 +51,315 @@ USER_LOGGED_IN = False
 # Removed Firebase initialization block
 FIREBASE_DB = None # Placeholder to satisfy API functions
 
+# --- 1a. REQUEST PROFILING & METRICS ---
+# Every request records its wall time, SQL statements (count/duration, timed by InstrumentedCursor), pool
+# checkout wait and JSON serialization time. The totals go back in a Server-Timing header and are aggregated
+# per endpoint for GET /metrics (Prometheus text format). A request sent with "X-Profile: <PROFILING_TOKEN>"
+# is also stack-sampled; its folded stacks (flame graph input) are served by /api/v1/debug/profiles/<id>.
+
+DB_QUERY_INSTRUMENTATION = os.environ.get('DB_QUERY_INSTRUMENTATION', '1') == '1' # Time every SQL statement
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN') # Unset disables the on-demand profiler
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', '0.005')) # Seconds between stack samples
+PROFILE_HISTORY = int(os.environ.get('PROFILE_HISTORY', '20')) # Profiles kept in memory per worker
+PROFILE_DIR = os.environ.get('PROFILE_DIR') # Optional: also write <id>.folded files here (shared by all workers)
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # Seconds
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms, rendered in the Prometheus text exposition format."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {} # (name, labels) -> value
+        self._histograms = {} # (name, labels) -> [per-bucket counts..., +Inf count], sum, count
+        self._help = {}
+        self._collectors = [] # Callables returning [(name, type, help, labels, value)] at scrape time
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, tuple(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        key = (name, tuple(labels))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            hist[0][bisect.bisect_left(self.buckets, value)] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+    def render(self):
+        lines = []
+        seen = set()
+
+        def header(name, metric_type, help_text=None):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {help_text or self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h[0]), h[1], h[2])) for key, h in self._histograms.items())
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), (bucket_counts, total, count) in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{self._labels(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(labels)} {total}")
+            lines.append(f"{name}_count{self._labels(labels)} {count}")
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                print(f"Metrics collector {collector.__name__} failed: {e}")
+                continue
+            for name, metric_type, help_text, labels, value in samples:
+                header(name, metric_type, help_text)
+                lines.append(f"{name}{self._labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = MetricsRegistry(METRICS_BUCKETS)
+METRICS.describe('smartbin_http_requests_total', 'HTTP requests by method, endpoint and status.')
+METRICS.describe('smartbin_http_request_duration_seconds', 'Time spent handling a request (until the response is built).')
+METRICS.describe('smartbin_http_request_db_queries_total', 'SQL statements run by requests, per endpoint.')
+METRICS.describe('smartbin_http_request_db_seconds_total', 'Time requests spent in SQL statements, per endpoint.')
+METRICS.describe('smartbin_http_request_pool_wait_seconds_total', 'Time requests waited for a pooled connection, per endpoint.')
+METRICS.describe('smartbin_http_request_json_seconds_total', 'Time requests spent serializing JSON, per endpoint.')
+METRICS.describe('smartbin_http_request_compress_seconds_total', 'Time requests spent compressing response bodies, per endpoint.')
+METRICS.describe('smartbin_http_response_bytes_total', 'Response body bytes sent, per endpoint and content encoding.')
+METRICS.describe('smartbin_db_query_duration_seconds', 'SQL statement duration by statement type (all threads).')
+METRICS.describe('smartbin_db_pool_wait_seconds', 'Time to check a connection out of the pool (including any connect).')
+METRICS.describe('smartbin_db_connect_seconds', 'Time to open a new PostgreSQL connection.')
+METRICS.describe('smartbin_export_rows_total', 'Rows streamed by data exports, per dataset.')
+
+_REQUEST_STATS = threading.local() # Stats of the request being handled by this thread (gthread: one at a time)
+_STATEMENT_TYPE = re.compile(r'\s*(\w+)')
+
+def _add_request_stat(key, value):
+    stats = getattr(_REQUEST_STATS, 'current', None)
+    if stats is not None:
+        stats[key] += value
+
+def record_query(query, duration):
+    """Records one SQL statement for /metrics and for the current request (if any)."""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    match = _STATEMENT_TYPE.match(query) if isinstance(query, str) else None
+    statement = match.group(1).upper() if match else 'OTHER'
+    METRICS.observe('smartbin_db_query_duration_seconds', duration, (('statement', statement),))
+    _add_request_stat('db_queries', 1)
+    _add_request_stat('db_seconds', duration)
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Default cursor of pooled connections: times every statement via record_query()."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, time.perf_counter() - start)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(query, time.perf_counter() - start)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            record_query(sql, time.perf_counter() - start)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, timing serialization for the current request."""
+
+    def dumps(self, obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            _add_request_stat('json_seconds', time.perf_counter() - start)
+
+app.json = TimedJSONProvider(app)
+
+
+class SamplingProfiler(threading.Thread):
+    """Samples one thread's Python stack every `interval` seconds into folded stacks ("a;b;c count" lines)."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name="request-profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return '\n'.join(f"{stack} {count}" for stack, count in self.samples.most_common()) + '\n'
+
+
+_PROFILES = collections.OrderedDict() # profile id -> folded stacks, newest last
+_PROFILES_LOCK = threading.Lock()
+_PROFILE_IDS = itertools.count(1)
+
+def _store_profile(endpoint, folded):
+    profile_id = f"{os.getpid()}-{next(_PROFILE_IDS)}"
+    with _PROFILES_LOCK:
+        _PROFILES[profile_id] = folded
+        while len(_PROFILES) > PROFILE_HISTORY:
+            _PROFILES.popitem(last=False)
+    if PROFILE_DIR:
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(os.path.join(PROFILE_DIR, f"{profile_id}.folded"), 'w') as f:
+                f.write(folded)
+        except OSError as e:
+            print(f"Could not write profile {profile_id} for {endpoint}: {e}")
+    return profile_id
+
+def _profiling_authorized():
+    return bool(PROFILING_TOKEN) and request.headers.get('X-Profile') == PROFILING_TOKEN
+
+@app.before_request
+def _start_request_instrumentation():
+    _REQUEST_STATS.current = {"start": time.perf_counter(), "db_queries": 0, "db_seconds": 0.0,
+                              "pool_wait_seconds": 0.0, "json_seconds": 0.0, "compress_seconds": 0.0, "profiler": None}
+    if _profiling_authorized():
+        profiler = SamplingProfiler(threading.get_ident(), PROFILE_SAMPLE_INTERVAL)
+        profiler.start()
+        _REQUEST_STATS.current["profiler"] = profiler
+
+@app.after_request
+def _finish_request_instrumentation(response):
+    stats = getattr(_REQUEST_STATS, 'current', None)
+    if stats is None:
+        return response
+    _REQUEST_STATS.current = None
+    duration = time.perf_counter() - stats["start"]
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = (('endpoint', endpoint),)
+
+    METRICS.inc('smartbin_http_requests_total', (('method', request.method), ('endpoint', endpoint), ('status', str(response.status_code))))
+    METRICS.observe('smartbin_http_request_duration_seconds', duration, labels)
+    METRICS.inc('smartbin_http_request_db_queries_total', labels, stats["db_queries"])
+    METRICS.inc('smartbin_http_request_db_seconds_total', labels, stats["db_seconds"])
+    METRICS.inc('smartbin_http_request_pool_wait_seconds_total', labels, stats["pool_wait_seconds"])
+    METRICS.inc('smartbin_http_request_json_seconds_total', labels, stats["json_seconds"])
+    METRICS.inc('smartbin_http_request_compress_seconds_total', labels, stats["compress_seconds"])
+    if not response.is_streamed and response.content_length is not None:
+        encoding = response.headers.get('Content-Encoding', 'identity')
+        METRICS.inc('smartbin_http_response_bytes_total', labels + (('encoding', encoding),), response.content_length)
+
+    response.headers['Server-Timing'] = (
+        f'db;desc="{stats["db_queries"]} queries";dur={stats["db_seconds"] * 1000:.2f}, '
+        f'pool;dur={stats["pool_wait_seconds"] * 1000:.2f}, '
+        f'json;dur={stats["json_seconds"] * 1000:.2f}, '
+        f'compress;dur={stats["compress_seconds"] * 1000:.2f}, '
+        f'total;dur={duration * 1000:.2f}'
+    )
+    if stats["profiler"] is not None:
+        response.headers['X-Profile-Id'] = _store_profile(endpoint, stats["profiler"].stop())
+    return response
+
+@app.teardown_request
+def _abandon_request_instrumentation(exc):
+    """Clears the stats of a request that failed before after_request ran."""
+    stats = getattr(_REQUEST_STATS, 'current', None)
+    if stats is not None:
+        _REQUEST_STATS.current = None
+        if stats["profiler"] is not None:
+            stats["profiler"].stop()
+
+# Counters/gauges of the per-worker subsystems, read at scrape time (only if already started in this worker)
+_METRIC_GAUGE_KEYS = {'min_size', 'max_size', 'in_use', 'idle', 'waiting', 'cached_bins', 'version', 'ttl', 'max_bins',
+                      'pending', 'flush_size', 'flush_interval', 'subscribers', 'history', 'bins', 'fetch_seconds', 'fit_seconds',
+                      'open_alerts', 'open_percent', 'clear_percent', 'debounce'}
+
+def _collect_subsystem_metrics():
+    subsystems = (
+        ('db_pool', _DB_POOL, _DB_POOL_PID, 'Connection pool'),
+        ('registry_cache', _BIN_REGISTRY, _BIN_REGISTRY_PID, 'Bin registry cache'),
+        ('ingest', _INGEST_BUFFER, _INGEST_PID, 'Telemetry ingest buffer'),
+        ('stream', _STREAM_BROKER, _STREAM_PID, 'Live event stream'),
+        ('forecast', _FORECASTER, _FORECASTER_PID, 'Fill forecaster'),
+        ('alerts', _ALERT_ENGINE, _ALERT_ENGINE_PID, 'Alert engine'),
+    )
+    samples = []
+    for prefix, instance, pid, description in subsystems:
+        if instance is None or pid != os.getpid():
+            continue
+        for key, value in instance.metrics().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            if key in _METRIC_GAUGE_KEYS:
+                samples.append((f"smartbin_{prefix}_{key}", 'gauge', f"{description}: {key}.", (), value))
+            else:
+                samples.append((f"smartbin_{prefix}_{key}_total", 'counter', f"{description}: {key}.", (), value))
+    return samples
+
+METRICS.add_collector(_collect_subsystem_metrics)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus scrape endpoint (per worker process)."""
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/v1/debug/profiles/<profile_id>', methods=['GET'])
+def get_request_profile(profile_id):
+    """Folded stacks of a profiled request (requires the X-Profile token); feed to flamegraph.pl or speedscope."""
+    if not _profiling_authorized():
+        return jsonify({"success": False, "message": "Profiling is disabled or the X-Profile token is wrong."}), 403
+    with _PROFILES_LOCK:
+        folded = _PROFILES.get(profile_id)
+    if folded is None and PROFILE_DIR and re.fullmatch(r'\d+-\d+', profile_id):
+        try:
+            with open(os.path.join(PROFILE_DIR, f"{profile_id}.folded")) as f:
+                folded = f.read()
+        except OSError:
+            pass
+    if folded is None:
+        return jsonify({"success": False, "message": f"Profile {profile_id} not found (profiles are kept per worker)."}), 404
+    return Response(folded, mimetype='text/plain')
+
 # --- 2. DATABASE CONFIGURATION (PostgreSQL Cloud Settings - Individual Params) ---
 # CRITICAL: Read individual connection parameters from Render environment variables
 DB_HOST = os.environ.get('DB_HOST')
@@ -26,13 +367,48 @@ DB_USER = os.environ.get('DB_USER')
 DB_PASSWORD = os.environ.get('DB_PASSWORD')
 DB_PORT = os.environ.get('DB_PORT', '5432') # Default PostgreSQL port
 DB_NAME = os.environ.get('DB_NAME')
+PG_INTEGER_MAX = 2147483647 # Largest value an INTEGER column holds (validation bound for COPY-bound values)
+
+# --- 2a. VERSIONED SCHEMA MIGRATIONS ---
+# The schema is built by an ordered list of migration steps. Applied versions are recorded in schema_version,
+# so run_migrations() is idempotent and never drops data: only pending steps run.
+# A step is either SQL (run in one transaction) or a function taking an autocommit connection, used for work
+# that must not hold long locks on the live tables (CREATE INDEX CONCURRENTLY, attaching partitions).
+
+MIGRATION_LOCK_ID = 4815162342 # pg_advisory_lock key: only one worker migrates at a time
+MIGRATION_BACKFILL_CHUNK = int(os.environ.get('MIGRATION_BACKFILL_CHUNK', '50000')) # record_ids per backfill transaction
+
+SCHEMA_VERSION_SQL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+  version INTEGER PRIMARY KEY,
+  description VARCHAR(255) NOT NULL,
+  applied_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now()
+);
+"""
+
+# The alert threshold the SQL side counts with (bin_latest_state.last_alert_at, telemetry_rollups.alert_count and
+# the alert backfills). STORE_ALERT_SETTINGS_QUERY writes ALERT_OPEN_PERCENT into it from run_migrations() and from
+# each process's get_alert_engine(), i.e. before that process writes telemetry, so the triggers count with the
+# engine's threshold. Values already counted are not recomputed when it changes.
+ALERT_SETTINGS_SQL = """
+CREATE TABLE IF NOT EXISTS alert_settings (
+  singleton BOOLEAN PRIMARY KEY DEFAULT true CHECK (singleton), -- One row
+  open_percent INTEGER NOT NULL
+);
+CREATE OR REPLACE FUNCTION alert_open_percent() RETURNS integer LANGUAGE sql STABLE AS $$
+  SELECT open_percent FROM alert_settings
+$$;
+"""
 
-# --- 2a. EMBEDDED SQL SCHEMA FOR AUTO-CREATION ---
-# This SQL string contains all necessary CREATE TABLE statements.
-DB_INIT_SQL = """
+STORE_ALERT_SETTINGS_QUERY = """
+INSERT INTO alert_settings (open_percent) VALUES (%s)
+ON CONFLICT (singleton) DO UPDATE SET open_percent = excluded.open_percent
+WHERE alert_settings.open_percent <> excluded.open_percent;
+"""
+
+MIGRATION_0001_BASE_TABLES = """
 -- 1. Table structure for table dustbins
-DROP TABLE IF EXISTS dustbins CASCADE;
-CREATE TABLE dustbins (
+CREATE TABLE IF NOT EXISTS dustbins (
   bin_id VARCHAR(10) PRIMARY KEY,
   latitude DECIMAL(9, 6) NOT NULL,
   longitude DECIMAL(9, 6) NOT NULL,
@@ -44,9 +420,11 @@ CREATE TABLE dustbins (
 );
 
 -- 2. Table structure for table telemetry
-DROP TABLE IF EXISTS telemetry CASCADE;
-CREATE TABLE telemetry (
-  record_id SERIAL PRIMARY KEY,
+-- Range-partitioned on timestamp (one partition per day or month, created by ensure_telemetry_partitions()),
+-- so old history is removed by detaching/dropping partitions instead of DELETE.
+-- Databases created before partitioning keep their plain table here; migration 2 converts it.
+CREATE TABLE IF NOT EXISTS telemetry (
+  record_id BIGSERIAL,
   bin_id VARCHAR(10) NOT NULL,
   timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
   fill_level_cm INTEGER DEFAULT NULL,
@@ -56,15 +434,17 @@ CREATE TABLE telemetry (
   collection_time TIMESTAMP WITHOUT TIME ZONE DEFAULT NULL,
   delay_minutes INTEGER DEFAULT NULL,
   
+  -- The partition key must be part of the primary key
+  PRIMARY KEY (record_id, timestamp),
+
   -- Foreign Key Constraint (linking to dustbins)
   CONSTRAINT telemetry_fk_bin_id 
     FOREIGN KEY (bin_id) 
     REFERENCES dustbins (bin_id)
-);
+) PARTITION BY RANGE (timestamp);
 
 -- 3. Table structure for table collection_log (Required by your API endpoints)
-DROP TABLE IF EXISTS collection_log CASCADE;
-CREATE TABLE collection_log (
+CREATE TABLE IF NOT EXISTS collection_log (
   log_id SERIAL PRIMARY KEY,
   bin_id VARCHAR(10) NOT NULL,
   collection_time TIMESTAMP WITHOUT TIME ZONE NOT NULL,
@@ -81,32 +461,693 @@ CREATE TABLE collection_log (
 );
 """
 
+MIGRATION_0003_REGISTRY_CHANGE_SEQ = """
+-- Change counter used for ETags and ?since= cursors, stamped by trigger on every insert and update.
+-- Sequence values are drawn in one order but may commit in another: a reader could see change_seq 11 before 10
+-- commits, take 11 as the registry version and never be sent bin 10. The trigger draws each value under a
+-- transaction-scoped advisory lock held until commit, so registry writers commit in change_seq order and
+-- max(change_seq) in any snapshot covers every change below it. Registry writes are rare; this only makes
+-- concurrent registrations queue.
+CREATE SEQUENCE IF NOT EXISTS dustbins_change_seq;
+ALTER TABLE dustbins ADD COLUMN IF NOT EXISTS change_seq BIGINT;
+UPDATE dustbins SET change_seq = nextval('dustbins_change_seq') WHERE change_seq IS NULL;
+ALTER TABLE dustbins ALTER COLUMN change_seq SET NOT NULL;
+
+CREATE OR REPLACE FUNCTION dustbins_stamp_change_seq() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  PERFORM pg_advisory_xact_lock(hashtext('dustbins_change_seq'));
+  NEW.change_seq := nextval('dustbins_change_seq');
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS dustbins_change_seq ON dustbins;
+CREATE TRIGGER dustbins_change_seq
+  BEFORE INSERT OR UPDATE ON dustbins
+  FOR EACH ROW EXECUTE FUNCTION dustbins_stamp_change_seq();
+"""
+
+
+MIGRATION_0005_BIN_LATEST_STATE = """
+-- Current status per bin, so "what is the bin doing now" is one primary-key lookup instead of a history scan.
+-- Rows are stamped with the writing transaction's id rather than a sequence value: concurrent ingest transactions
+-- draw sequence values in one order and commit in another, so "everything after the largest value I saw" would
+-- skip updates that commit late with a lower one. A reader's cursor is its snapshot xmin (every transaction below
+-- it has committed or aborted), and a delta returns rows stamped at or above the cursor; rows from transactions
+-- in flight at the previous read are sent again, never missed.
+CREATE TABLE IF NOT EXISTS bin_latest_state (
+  bin_id VARCHAR(10) PRIMARY KEY REFERENCES dustbins (bin_id),
+  last_reading_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+  fill_level_cm INTEGER DEFAULT NULL,
+  fill_percentage INTEGER DEFAULT NULL,
+  is_lid_locked BOOLEAN DEFAULT NULL,
+  alert_triggered BOOLEAN DEFAULT NULL,
+  last_alert_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NULL, -- Latest reading at or above alert_open_percent()
+  change_xid BIGINT NOT NULL DEFAULT pg_current_xact_id()::text::bigint -- Restamped on every update (?since= cursors)
+);
+
+-- Maintained by one set-based upsert per INSERT/COPY statement on telemetry (whatever the writer),
+-- using the statement's transition table rather than a per-row trigger.
+CREATE OR REPLACE FUNCTION bin_latest_state_apply() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+  threshold INTEGER := alert_open_percent(); -- Read once per statement
+BEGIN
+  INSERT INTO bin_latest_state AS s
+    (bin_id, last_reading_at, fill_level_cm, fill_percentage, is_lid_locked, alert_triggered, last_alert_at)
+  SELECT latest.bin_id, latest.timestamp, latest.fill_level_cm, latest.fill_percentage,
+         latest.is_lid_locked, latest.alert_triggered, alerts.last_alert_at
+  FROM (
+    SELECT DISTINCT ON (bin_id) bin_id, timestamp, fill_level_cm, fill_percentage, is_lid_locked, alert_triggered
+    FROM new_rows ORDER BY bin_id, timestamp DESC
+  ) latest
+  LEFT JOIN (
+    SELECT bin_id, max(timestamp) AS last_alert_at FROM new_rows WHERE fill_percentage >= threshold GROUP BY bin_id
+  ) alerts ON alerts.bin_id = latest.bin_id
+  ORDER BY latest.bin_id -- Consistent lock order between concurrent writers
+  ON CONFLICT (bin_id) DO UPDATE SET
+    -- Late (out-of-order) readings may move last_alert_at but never overwrite a newer reading
+    fill_level_cm = CASE WHEN excluded.last_reading_at >= s.last_reading_at THEN excluded.fill_level_cm ELSE s.fill_level_cm END,
+    fill_percentage = CASE WHEN excluded.last_reading_at >= s.last_reading_at THEN excluded.fill_percentage ELSE s.fill_percentage END,
+    is_lid_locked = CASE WHEN excluded.last_reading_at >= s.last_reading_at THEN excluded.is_lid_locked ELSE s.is_lid_locked END,
+    alert_triggered = CASE WHEN excluded.last_reading_at >= s.last_reading_at THEN excluded.alert_triggered ELSE s.alert_triggered END,
+    last_reading_at = GREATEST(s.last_reading_at, excluded.last_reading_at),
+    last_alert_at = GREATEST(s.last_alert_at, excluded.last_alert_at),
+    change_xid = pg_current_xact_id()::text::bigint;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS telemetry_latest_state ON telemetry;
+CREATE TRIGGER telemetry_latest_state
+  AFTER INSERT ON telemetry
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION bin_latest_state_apply();
+
+-- Backfill from existing history: per bin, a walk down telemetry_bin_time_idx to its latest reading and to its
+-- latest one at or above the alert threshold
+INSERT INTO bin_latest_state (bin_id, last_reading_at, fill_level_cm, fill_percentage, is_lid_locked, alert_triggered, last_alert_at)
+SELECT d.bin_id, latest.timestamp, latest.fill_level_cm, latest.fill_percentage, latest.is_lid_locked, latest.alert_triggered,
+       (SELECT t.timestamp FROM telemetry t WHERE t.bin_id = d.bin_id AND t.fill_percentage >= (SELECT alert_open_percent())
+        ORDER BY t.timestamp DESC LIMIT 1)
+FROM dustbins d
+CROSS JOIN LATERAL (
+  SELECT timestamp, fill_level_cm, fill_percentage, is_lid_locked, alert_triggered
+  FROM telemetry t WHERE t.bin_id = d.bin_id ORDER BY t.timestamp DESC LIMIT 1
+) latest
+ON CONFLICT (bin_id) DO NOTHING;
+"""
+
+
+MIGRATION_0006_TELEMETRY_ROLLUPS = """
+-- Per-bin minute/hour/day aggregates for history charts, so long ranges never read raw telemetry.
+CREATE TABLE IF NOT EXISTS telemetry_rollups (
+  bin_id VARCHAR(10) NOT NULL REFERENCES dustbins (bin_id),
+  resolution VARCHAR(6) NOT NULL, -- 'minute', 'hour' or 'day' (a date_trunc unit)
+  bucket TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+  readings INTEGER NOT NULL,
+  fill_min INTEGER DEFAULT NULL,
+  fill_max INTEGER DEFAULT NULL,
+  fill_sum BIGINT DEFAULT NULL,
+  fill_count INTEGER NOT NULL DEFAULT 0, -- Readings with a fill_percentage (avg = fill_sum / fill_count)
+  alert_count INTEGER NOT NULL DEFAULT 0, -- Readings at or above alert_open_percent()
+  PRIMARY KEY (bin_id, resolution, bucket)
+);
+
+-- Same pattern as bin_latest_state_apply(): one set-based upsert per INSERT/COPY statement
+CREATE OR REPLACE FUNCTION telemetry_rollups_apply() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+  threshold INTEGER := alert_open_percent(); -- Read once per statement
+BEGIN
+  INSERT INTO telemetry_rollups AS r
+    (bin_id, resolution, bucket, readings, fill_min, fill_max, fill_sum, fill_count, alert_count)
+  SELECT n.bin_id, res.resolution, date_trunc(res.resolution, n.timestamp), count(*),
+         min(n.fill_percentage), max(n.fill_percentage), sum(n.fill_percentage), count(n.fill_percentage),
+         count(*) FILTER (WHERE n.fill_percentage >= threshold)
+  FROM new_rows n CROSS JOIN (VALUES ('minute'), ('hour'), ('day')) AS res (resolution)
+  GROUP BY 1, 2, 3
+  ORDER BY 1, 2, 3 -- Consistent lock order between concurrent writers
+  ON CONFLICT (bin_id, resolution, bucket) DO UPDATE SET
+    readings = r.readings + excluded.readings,
+    fill_min = LEAST(r.fill_min, excluded.fill_min),
+    fill_max = GREATEST(r.fill_max, excluded.fill_max),
+    fill_sum = COALESCE(r.fill_sum, 0) + COALESCE(excluded.fill_sum, 0),
+    fill_count = r.fill_count + excluded.fill_count,
+    alert_count = r.alert_count + excluded.alert_count;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS telemetry_rollups ON telemetry;
+CREATE TRIGGER telemetry_rollups
+  AFTER INSERT ON telemetry
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION telemetry_rollups_apply();
+"""
+
+MIGRATION_0007_ALERT_EVENTS = """
+-- One row per alert episode, written by AlertEngine: opened when a bin stays at or above the alert threshold,
+-- closed when it stays below the clear threshold ('recovered') or when log_collection resolves it ('collected').
+CREATE TABLE IF NOT EXISTS alert_events (
+  event_id BIGSERIAL PRIMARY KEY,
+  bin_id VARCHAR(10) NOT NULL REFERENCES dustbins (bin_id),
+  opened_at TIMESTAMP WITHOUT TIME ZONE NOT NULL, -- First reading of the debounced run over the threshold
+  open_fill_percentage INTEGER DEFAULT NULL,
+  peak_fill_percentage INTEGER DEFAULT NULL,
+  closed_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NULL,
+  close_reason VARCHAR(20) DEFAULT NULL -- 'recovered' or 'collected'
+);
+-- At most one open alert per bin; also the O(1) lookup log_collection uses to resolve it
+CREATE UNIQUE INDEX IF NOT EXISTS alert_events_open_idx ON alert_events (bin_id) WHERE closed_at IS NULL;
+CREATE INDEX IF NOT EXISTS alert_events_bin_opened_idx ON alert_events (bin_id, opened_at DESC);
+
+-- AlertEngine's state machine per bin. Each telemetry batch locks its bins' rows and updates them in its own
+-- transaction, so every worker and the bridge continue the same debounce run; log_collection resets a bin's row
+-- when it closes its alert.
+CREATE TABLE IF NOT EXISTS alert_state (
+  bin_id VARCHAR(10) PRIMARY KEY REFERENCES dustbins (bin_id),
+  alerting BOOLEAN NOT NULL DEFAULT false,
+  streak INTEGER NOT NULL DEFAULT 0, -- Consecutive readings across the threshold that would flip `alerting`
+  streak_started_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NULL,
+  streak_start_fill INTEGER DEFAULT NULL,
+  last_reading_at TIMESTAMP WITHOUT TIME ZONE DEFAULT NULL, -- Latest reading evaluated; older ones are ignored
+  peak_fill INTEGER NOT NULL DEFAULT 0
+);
+
+-- Bins at or above the alert threshold right now get an open alert, dated from the first reading after their
+-- last one below it
+INSERT INTO alert_events (bin_id, opened_at, open_fill_percentage, peak_fill_percentage)
+SELECT s.bin_id, COALESCE(onset.opened_at, s.last_reading_at), s.fill_percentage, s.fill_percentage
+FROM bin_latest_state s
+LEFT JOIN LATERAL (
+  SELECT min(t.timestamp) AS opened_at FROM telemetry t
+  WHERE t.bin_id = s.bin_id AND t.timestamp > COALESCE((
+    SELECT b.timestamp FROM telemetry b WHERE b.bin_id = s.bin_id AND b.fill_percentage < (SELECT alert_open_percent())
+    ORDER BY b.timestamp DESC LIMIT 1), '-infinity')
+) onset ON true
+WHERE s.fill_percentage >= (SELECT alert_open_percent())
+ON CONFLICT DO NOTHING;
+
+INSERT INTO alert_state (bin_id, alerting, last_reading_at, peak_fill)
+SELECT e.bin_id, true, s.last_reading_at, COALESCE(e.peak_fill_percentage, 0)
+FROM alert_events e JOIN bin_latest_state s ON s.bin_id = e.bin_id
+WHERE e.closed_at IS NULL
+ON CONFLICT DO NOTHING;
+"""
+
+# Delay histogram bucket bounds in minutes, for collection_stats (section 5e). Migration 8 writes them into
+# collection_delay_histogram(); changing them needs a migration that redefines it and rebuilds collection_stats.
+COLLECTION_DELAY_BOUNDS = (0, 5, 10, 15, 30, 45, 60, 90, 120, 180, 240, 360, 480, 720, 1440, 2880)
+
+MIGRATION_0008_COLLECTION_STATS = """
+-- Per-day collection performance per bin and per collector, so stats and leaderboards never read collection_log.
+CREATE TABLE IF NOT EXISTS collection_stats (
+  scope VARCHAR(9) NOT NULL, -- 'bin' or 'collector'
+  subject VARCHAR(10) NOT NULL, -- bin_id or collector_id
+  day DATE NOT NULL,
+  collections INTEGER NOT NULL,
+  on_time INTEGER NOT NULL,
+  rewards INTEGER NOT NULL,
+  alerted INTEGER NOT NULL, -- Collections answering an alert (the ones with a delay)
+  delay_sum BIGINT NOT NULL DEFAULT 0,
+  delay_max INTEGER DEFAULT NULL,
+  delay_buckets INTEGER[] NOT NULL, -- Histogram of time_to_collect_min over COLLECTION_DELAY_BOUNDS
+  last_collection_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+  PRIMARY KEY (scope, subject, day)
+);
+
+-- Bucket i counts delays in [bounds[i], bounds[i+1]) minutes; the last one is open-ended.
+-- The default bounds are COLLECTION_DELAY_BOUNDS.
+CREATE OR REPLACE FUNCTION collection_delay_histogram(delays INTEGER[],
+    bounds INTEGER[] DEFAULT '{%(delay_bounds)s}')
+RETURNS INTEGER[] LANGUAGE sql IMMUTABLE AS $$
+  SELECT array_agg(COALESCE(h.n, 0) ORDER BY b.i)
+  FROM generate_series(1, array_length(bounds, 1)) AS b (i)
+  LEFT JOIN (
+    SELECT width_bucket(GREATEST(d, 0), bounds) AS i, count(*)::INTEGER AS n FROM unnest(delays) AS d GROUP BY 1
+  ) h USING (i);
+$$;
+
+-- Same pattern as telemetry_rollups_apply(): one set-based upsert per INSERT statement, in its transaction
+CREATE OR REPLACE FUNCTION collection_stats_apply() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  INSERT INTO collection_stats AS s
+    (scope, subject, day, collections, on_time, rewards, alerted, delay_sum, delay_max, delay_buckets, last_collection_at)
+  SELECT k.scope, k.subject, n.collection_time::date, count(*),
+         count(*) FILTER (WHERE n.is_on_time), count(*) FILTER (WHERE n.reward_issued),
+         count(*) FILTER (WHERE n.alert_time IS NOT NULL),
+         COALESCE(sum(n.time_to_collect_min) FILTER (WHERE n.alert_time IS NOT NULL), 0),
+         max(n.time_to_collect_min) FILTER (WHERE n.alert_time IS NOT NULL),
+         collection_delay_histogram(array_agg(n.time_to_collect_min) FILTER (WHERE n.alert_time IS NOT NULL)),
+         max(n.collection_time)
+  FROM new_rows n CROSS JOIN LATERAL (VALUES ('bin', n.bin_id), ('collector', n.collector_id)) AS k (scope, subject)
+  WHERE k.subject IS NOT NULL
+  GROUP BY 1, 2, 3
+  ORDER BY 1, 2, 3 -- Consistent lock order between concurrent writers
+  ON CONFLICT (scope, subject, day) DO UPDATE SET
+    collections = s.collections + excluded.collections,
+    on_time = s.on_time + excluded.on_time,
+    rewards = s.rewards + excluded.rewards,
+    alerted = s.alerted + excluded.alerted,
+    delay_sum = s.delay_sum + excluded.delay_sum,
+    delay_max = GREATEST(s.delay_max, excluded.delay_max),
+    delay_buckets = ARRAY(SELECT a + b FROM unnest(s.delay_buckets, excluded.delay_buckets) WITH ORDINALITY AS u (a, b, i) ORDER BY i),
+    last_collection_at = GREATEST(s.last_collection_at, excluded.last_collection_at);
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS collection_stats ON collection_log;
+CREATE TRIGGER collection_stats
+  AFTER INSERT ON collection_log
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION collection_stats_apply();
+
+-- Backfill from the existing log (the trigger only sees new collections)
+INSERT INTO collection_stats
+  (scope, subject, day, collections, on_time, rewards, alerted, delay_sum, delay_max, delay_buckets, last_collection_at)
+SELECT k.scope, k.subject, c.collection_time::date, count(*),
+       count(*) FILTER (WHERE c.is_on_time), count(*) FILTER (WHERE c.reward_issued),
+       count(*) FILTER (WHERE c.alert_time IS NOT NULL),
+       COALESCE(sum(c.time_to_collect_min) FILTER (WHERE c.alert_time IS NOT NULL), 0),
+       max(c.time_to_collect_min) FILTER (WHERE c.alert_time IS NOT NULL),
+       collection_delay_histogram(array_agg(c.time_to_collect_min) FILTER (WHERE c.alert_time IS NOT NULL)),
+       max(c.collection_time)
+FROM collection_log c CROSS JOIN LATERAL (VALUES ('bin', c.bin_id), ('collector', c.collector_id)) AS k (scope, subject)
+WHERE k.subject IS NOT NULL
+GROUP BY 1, 2, 3
+ON CONFLICT DO NOTHING;
+""" % {"delay_bounds": ",".join(map(str, COLLECTION_DELAY_BOUNDS))}
+
+def _migration_0006_telemetry_rollups(conn):
+    """
+    Creates telemetry_rollups and its trigger, then backfills it from existing telemetry without holding up ingest.
+    The trigger goes live in a short transaction that also records the cutoff: CREATE TRIGGER waits for in-flight
+    inserts, so every reading with record_id <= cutoff predates the trigger and every later one is counted by it.
+    The backfill then adds the pre-cutoff readings in record_id chunks, one transaction each, merging into the
+    buckets the trigger has started; its progress is committed with each chunk so a rerun resumes, never recounts.
+    Minute and hour rollups are only backfilled for their retention windows.
+    """
+    cursor = conn.cursor()
+    cursor.execute("BEGIN;")
+    try:
+        cursor.execute(MIGRATION_0006_TELEMETRY_ROLLUPS)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS telemetry_rollups_backfill (next_record_id BIGINT NOT NULL, cutoff BIGINT NOT NULL);
+        INSERT INTO telemetry_rollups_backfill (next_record_id, cutoff)
+        SELECT COALESCE(min(record_id), 1), COALESCE(max(record_id), 0) FROM telemetry
+        WHERE NOT EXISTS (SELECT 1 FROM telemetry_rollups_backfill);
+        """)
+        cursor.execute("COMMIT;")
+    except Exception:
+        cursor.execute("ROLLBACK;")
+        raise
+
+    try:
+        cursor.execute("SELECT next_record_id, cutoff FROM telemetry_rollups_backfill;")
+        next_record_id, cutoff = cursor.fetchone()
+        windows = {resolution: datetime.now() - timedelta(days=days) if days > 0 else datetime.min
+                   for resolution, days in ROLLUP_RETENTION_DAYS.items()}
+        while next_record_id <= cutoff:
+            chunk_end = min(next_record_id + MIGRATION_BACKFILL_CHUNK - 1, cutoff)
+            cursor.execute("BEGIN;")
+            try:
+                cursor.execute("""
+                INSERT INTO telemetry_rollups AS r
+                  (bin_id, resolution, bucket, readings, fill_min, fill_max, fill_sum, fill_count, alert_count)
+                SELECT t.bin_id, res.resolution, date_trunc(res.resolution, t.timestamp), count(*),
+                       min(t.fill_percentage), max(t.fill_percentage), sum(t.fill_percentage), count(t.fill_percentage),
+                       count(*) FILTER (WHERE t.fill_percentage >= (SELECT alert_open_percent()))
+                FROM telemetry t
+                JOIN (VALUES ('minute', %(minute)s::timestamp), ('hour', %(hour)s::timestamp), ('day', %(day)s::timestamp))
+                  AS res (resolution, since) ON t.timestamp >= res.since
+                WHERE t.record_id BETWEEN %(first)s AND %(last)s
+                GROUP BY 1, 2, 3
+                ORDER BY 1, 2, 3 -- Same lock order as telemetry_rollups_apply()
+                ON CONFLICT (bin_id, resolution, bucket) DO UPDATE SET
+                  readings = r.readings + excluded.readings,
+                  fill_min = LEAST(r.fill_min, excluded.fill_min),
+                  fill_max = GREATEST(r.fill_max, excluded.fill_max),
+                  fill_sum = COALESCE(r.fill_sum, 0) + COALESCE(excluded.fill_sum, 0),
+                  fill_count = r.fill_count + excluded.fill_count,
+                  alert_count = r.alert_count + excluded.alert_count;
+                """, dict(windows, first=next_record_id, last=chunk_end))
+                cursor.execute("UPDATE telemetry_rollups_backfill SET next_record_id = %s;", (chunk_end + 1,))
+                cursor.execute("COMMIT;")
+            except Exception:
+                cursor.execute("ROLLBACK;")
+                raise
+            next_record_id = chunk_end + 1
+        cursor.execute("DROP TABLE telemetry_rollups_backfill;")
+    finally:
+        cursor.close()
+
+def _migration_0002_partition_telemetry(conn):
+    """
+    Turns a pre-partitioning telemetry table into a partitioned one without rewriting or scanning it under lock:
+    the old table is renamed to telemetry_legacy and attached as the partition for everything before the end
+    of the current period. Its range CHECK and (record_id, timestamp) index are built first, online, so the
+    ATTACH itself is a catalog-only change. Fresh databases already have the partitioned table.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = 'telemetry'::regclass;")
+    if cursor.fetchone()[0] == 'r':
+        _, boundary = telemetry_partition_bounds(datetime.now())
+        print(f"DEBUG: Converting legacy telemetry table; existing rows become partition telemetry_legacy (< {boundary}).")
+        create_index_concurrently(conn, 'telemetry_legacy_pk_idx', 'telemetry', '(record_id, timestamp)', unique=True)
+        cursor.execute("ALTER TABLE telemetry DROP CONSTRAINT IF EXISTS telemetry_legacy_range;")
+        cursor.execute("ALTER TABLE telemetry ADD CONSTRAINT telemetry_legacy_range CHECK (timestamp IS NOT NULL AND timestamp < %s) NOT VALID;", (boundary,))
+        cursor.execute("ALTER TABLE telemetry VALIDATE CONSTRAINT telemetry_legacy_range;") # Scans without blocking writers
+
+        try:
+            cursor.execute("BEGIN;")
+            cursor.execute("LOCK TABLE telemetry IN ACCESS EXCLUSIVE MODE;")
+            # The old single-column key cannot coexist with the partitioned (record_id, timestamp) key;
+            # telemetry_legacy_pk_idx takes its place when the partition is attached.
+            cursor.execute("ALTER TABLE telemetry DROP CONSTRAINT IF EXISTS telemetry_pkey;")
+            cursor.execute("ALTER TABLE telemetry RENAME TO telemetry_legacy;")
+            cursor.execute("""
+            CREATE TABLE telemetry (
+              LIKE telemetry_legacy INCLUDING DEFAULTS,
+              PRIMARY KEY (record_id, timestamp),
+              CONSTRAINT telemetry_fk_bin_id FOREIGN KEY (bin_id) REFERENCES dustbins (bin_id)
+            ) PARTITION BY RANGE (timestamp);
+            """)
+            cursor.execute("ALTER SEQUENCE IF EXISTS telemetry_record_id_seq OWNED BY telemetry.record_id;")
+            cursor.execute("ALTER TABLE telemetry ATTACH PARTITION telemetry_legacy FOR VALUES FROM (MINVALUE) TO (%s);", (boundary,))
+            cursor.execute("COMMIT;")
+        except Exception:
+            cursor.execute("ROLLBACK;")
+            # Don't leave the range CHECK behind: it would reject future-dated readings on the unconverted table
+            cursor.execute("ALTER TABLE telemetry DROP CONSTRAINT IF EXISTS telemetry_legacy_range;")
+            raise
+        reset_telemetry_partition_cache()
+
+    # Catches readings outside every dated partition (e.g. late backfills) so inserts never fail
+    cursor.execute("CREATE TABLE IF NOT EXISTS telemetry_default PARTITION OF telemetry DEFAULT;")
+    cursor.close()
+
+def _migration_0004_history_indexes(conn):
+    """Indexes for the per-bin history lookups, built without blocking ingest."""
+    # Registry version / delta lookups by change_seq
+    create_index_concurrently(conn, 'dustbins_change_seq_idx', 'dustbins', '(change_seq)')
+    # Per-bin collection history, newest first (get_collection_history)
+    create_index_concurrently(conn, 'collection_log_bin_time_idx', 'collection_log', '(bin_id, collection_time DESC)')
+    # Latest readings per bin, and latest alert-level reading per bin (bin_latest_state backfill)
+    create_partitioned_index_concurrently(conn, 'telemetry_bin_time_idx', 'telemetry', '(bin_id, timestamp DESC)')
+
+MIGRATIONS = [
+    (1, "Base tables: dustbins, telemetry (partitioned), collection_log", MIGRATION_0001_BASE_TABLES),
+    (2, "Partition a legacy telemetry table; default partition", _migration_0002_partition_telemetry),
+    (3, "Registry change counter dustbins.change_seq, stamped in commit order", MIGRATION_0003_REGISTRY_CHANGE_SEQ),
+    (4, "History lookup indexes (concurrent)", _migration_0004_history_indexes),
+    (5, "bin_latest_state maintained from telemetry inserts", MIGRATION_0005_BIN_LATEST_STATE),
+    (6, "telemetry_rollups (minute/hour/day) maintained from telemetry inserts", _migration_0006_telemetry_rollups),
+    (7, "alert_events (open/close episodes) and alert_state, written by the alert engine", MIGRATION_0007_ALERT_EVENTS),
+    (8, "collection_stats (per bin / per collector) maintained from collection_log inserts", MIGRATION_0008_COLLECTION_STATS),
+]
+
+
+def create_index_concurrently(conn, name, table, columns, where=None, unique=False):
+    """
+    CREATE INDEX CONCURRENTLY on an autocommit connection. An invalid leftover from an interrupted
+    build is dropped and rebuilt instead of being silently kept by IF NOT EXISTS.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+    SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid
+    WHERE c.relname = %s AND c.relnamespace = 'public'::regnamespace;
+    """, (name,))
+    existing = cursor.fetchone()
+    if existing and existing[0]:
+        cursor.close()
+        return
+    if existing:
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name};")
+    predicate = f" WHERE {where}" if where else ""
+    cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY {name} ON {table} {columns}{predicate};")
+    cursor.close()
+
+def create_partitioned_index_concurrently(conn, name, table, columns, where=None):
+    """
+    Postgres cannot CREATE INDEX CONCURRENTLY on a partitioned table, so: create the parent index ON ONLY
+    (instant, starts invalid), build each partition's index concurrently and attach it. The parent index
+    becomes valid once every partition is attached; partitions created later inherit it automatically.
+    """
+    predicate = f" WHERE {where}" if where else ""
+    cursor = conn.cursor()
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} {columns}{predicate};")
+    cursor.execute("""
+    SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE pg_inherits.inhparent = %s::regclass;
+    """, (table,))
+    partitions = [row[0] for row in cursor.fetchall()]
+    for partition in partitions:
+        partition_index = f"{partition}_{name[len(table) + 1:]}" if name.startswith(table + '_') else f"{partition}_{name}"
+        cursor.execute("""
+        SELECT 1 FROM pg_inherits JOIN pg_index ON pg_index.indexrelid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = %s::regclass AND pg_index.indrelid = %s::regclass;
+        """, (name, partition))
+        if cursor.fetchone():
+            continue # Partition already has its index attached (e.g. created after the parent index)
+        create_index_concurrently(conn, partition_index, partition, columns, where)
+        cursor.execute(f"ALTER INDEX {name} ATTACH PARTITION {partition_index};")
+    cursor.close()
+
+# --- 2b. CONNECTION POOL SETTINGS ---
+# One pool per worker process; sized so (workers x DB_POOL_MAX) stays below the Postgres connection limit.
+DB_SSLMODE = os.environ.get('DB_SSLMODE', 'require')
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '10'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5')) # Seconds to wait for a free connection
+DB_POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', '1800')) # Recycle connections older than this
+DB_POOL_HEALTHCHECK_IDLE = float(os.environ.get('DB_POOL_HEALTHCHECK_IDLE', '30')) # Ping connections idle longer than this
+
+
+def _open_raw_connection():
+    """Opens a brand-new PostgreSQL connection (one TLS handshake). Only the pool should call this."""
+    conn_params = {
+        'dbname': DB_NAME, 
+        'user': DB_USER,
+        'password': DB_PASSWORD,
+        'host': DB_HOST,
+        'port': DB_PORT,
+        'sslmode': DB_SSLMODE # 'require' in production; override with DB_SSLMODE for local databases
+    }
+    print(f"DEBUG: Opening pooled connection to {DB_HOST}:{DB_PORT} as user {DB_USER} with sslmode={DB_SSLMODE}...")
+    start = time.perf_counter()
+    conn = psycopg2.connect(**conn_params)
+    METRICS.observe('smartbin_db_connect_seconds', time.perf_counter() - start)
+    if DB_QUERY_INSTRUMENTATION:
+        conn.cursor_factory = InstrumentedCursor
+    return conn
+
+
+class DBConnectionPool:
+    """
+    Thread-safe PostgreSQL connection pool with checkout timeouts, health checks and metrics.
+    Connections are reused across requests so a request only pays for its queries, not for a new TLS session.
+    """
+
+    def __init__(self, min_size, max_size, timeout, max_lifetime, healthcheck_idle):
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.healthcheck_idle = healthcheck_idle
+        self._idle = [] # Stack of (conn, created_at, last_used_at); most recently used on top
+        self._created_at = {} # id(conn) -> creation time, for every connection owned by the pool
+        self._cond = threading.Condition()
+        self._in_use = 0 # Checked out, or reserved while being opened / health-checked
+        self._checked_out = set() # id(conn) of connections handed out by getconn()
+        self._waiting = 0
+        self.stats = {"created": 0, "recycled": 0, "checkouts": 0, "timeouts": 0, "failed_health_checks": 0}
+
+        for _ in range(self.min_size):
+            try:
+                conn = self._create()
+            except psycopg2.Error as err:
+                print(f"Error pre-filling connection pool: {err}")
+                break
+            self._idle.append((conn, self._created_at[id(conn)], time.monotonic()))
+
+    def _total(self):
+        return len(self._idle) + self._in_use
+
+    def _create(self):
+        conn = _open_raw_connection()
+        self._created_at[id(conn)] = time.monotonic()
+        self.stats["created"] += 1
+        return conn
+
+    def _discard(self, conn):
+        """Closes a connection the pool should no longer hand out (without holding the lock: close() can block)."""
+        with self._cond:
+            self._created_at.pop(id(conn), None)
+            self.stats["recycled"] += 1
+        try:
+            if not conn.closed:
+                conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, created_at, last_used_at):
+        """
+        Checks a connection before it is handed out; only pings connections that sat idle for a while.
+        Runs without the lock, on a connection already reserved by the caller, so a hung ping only stalls its caller.
+        """
+        now = time.monotonic()
+        if conn.closed or now - created_at > self.max_lifetime:
+            return False
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if now - last_used_at > self.healthcheck_idle:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1;")
+                conn.rollback()
+            except psycopg2.Error:
+                with self._cond:
+                    self.stats["failed_health_checks"] += 1
+                return False
+        return True
+
+    def getconn(self):
+        """Checks out a healthy connection, opening a new one if below max_size, or waits up to `timeout` seconds."""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                while True:
+                    if self._idle:
+                        # Reserve it; the health check runs after the lock is released
+                        conn, created_at, last_used_at = self._idle.pop()
+                        self._in_use += 1
+                        break
+
+                    if self._total() < self.max_size:
+                        # Reserve the slot before releasing the lock for the (slow) connect
+                        self._in_use += 1
+                        conn = None
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats["timeouts"] += 1
+                        raise PoolTimeoutError(f"No database connection available within {self.timeout}s (pool max {self.max_size}).")
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+            if conn is None:
+                break
+            if self._is_healthy(conn, created_at, last_used_at):
+                with self._cond:
+                    self._checked_out.add(id(conn))
+                    self.stats["checkouts"] += 1
+                return conn
+            self._discard(conn)
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+
+        try:
+            conn = _open_raw_connection()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created_at[id(conn)] = time.monotonic()
+            self._checked_out.add(id(conn))
+            self.stats["created"] += 1
+            self.stats["checkouts"] += 1
+        return conn
+
+    def putconn(self, conn):
+        """
+        Returns a checked-out connection to the pool, rolling back any transaction the caller left open.
+        Raises PoolReleaseError for a connection that is not checked out (e.g. released twice).
+        """
+        with self._cond:
+            if id(conn) not in self._checked_out:
+                raise PoolReleaseError("Connection is not checked out from this pool (released twice?).")
+            self._checked_out.discard(id(conn))
+            created_at = self._created_at.get(id(conn))
+
+        keep = False
+        if created_at is not None and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                keep = True
+            except psycopg2.Error:
+                pass
+        if not keep and created_at is not None:
+            self._discard(conn)
+
+        with self._cond:
+            self._in_use -= 1
+            if keep:
+                self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    def metrics(self):
+        with self._cond:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                **self.stats
+            }
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes free within DB_POOL_TIMEOUT."""
+
+class PoolReleaseError(Exception):
+    """Raised when a connection that is not checked out is returned to the pool."""
+
+
+_DB_POOL = None
+_DB_POOL_PID = None
+_DB_POOL_LOCK = threading.Lock()
+
+def get_db_pool():
+    """Returns the process-wide pool, creating it lazily (after gunicorn forks) on first use."""
+    global _DB_POOL, _DB_POOL_PID
+    if _DB_POOL is not None and _DB_POOL_PID == os.getpid():
+        return _DB_POOL
+    with _DB_POOL_LOCK:
+        if _DB_POOL is None or _DB_POOL_PID != os.getpid():
+            _DB_POOL = DBConnectionPool(DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_MAX_LIFETIME, DB_POOL_HEALTHCHECK_IDLE)
+            _DB_POOL_PID = os.getpid()
+    return _DB_POOL
 
 def get_db_connection():
     """
-    Establishes and returns a new PostgreSQL database connection using individual parameters.
+    Checks out a PostgreSQL connection from the process-wide pool.
+    Callers must hand it back with release_db_connection() instead of closing it.
     """
     if not all([DB_HOST, DB_USER, DB_PASSWORD, DB_NAME]):
         print("FATAL: One or more database environment variables (HOST, USER, PASSWORD, NAME) are missing.")
         return None
         
+    start = time.perf_counter()
     try:
-        # Build connection parameters explicitly
-        conn_params = {
-            'dbname': DB_NAME, 
-            'user': DB_USER,
-            'password': DB_PASSWORD,
-            'host': DB_HOST,
-            'port': DB_PORT,
-            'sslmode': 'require' # REVERTED TO REQUIRED for security/compatibility
-        }
-        
-        # Added debug print before connection attempt
-        print(f"DEBUG: Attempting connection to {DB_HOST}:{DB_PORT} as user {DB_USER} with sslmode=require...")
-
-        conn = psycopg2.connect(**conn_params)
-        print("DEBUG: Connection SUCCESS!")
-        return conn
+        return get_db_pool().getconn()
+    except PoolTimeoutError as e:
+        print(f"Error checking out pooled connection: {e}")
+        return None
     except psycopg2.Error as err:
         print(f"Error connecting to PostgreSQL: {err}")
         print(f"DEBUG Params: Host={DB_HOST}, Port={DB_PORT}, User={DB_USER}")
@@ -114,72 +1155,544 @@ def get_db_connection():
     except Exception as e:
         print(f"Error establishing connection: {e}")
         return None
+    finally:
+        wait = time.perf_counter() - start
+        METRICS.observe('smartbin_db_pool_wait_seconds', wait)
+        _add_request_stat('pool_wait_seconds', wait)
+
+def release_db_connection(conn):
+    """Returns a connection obtained from get_db_connection() to the pool."""
+    if conn is None:
+        return
+    get_db_pool().putconn(conn)
+
+def run_migrations(conn):
+    """Applies pending MIGRATIONS in order on `conn` and returns the versions applied."""
+    applied_now = []
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_ID,))
+    try:
+        cursor.execute(SCHEMA_VERSION_SQL)
+        cursor.execute(ALERT_SETTINGS_SQL)
+        cursor.execute(STORE_ALERT_SETTINGS_QUERY, (ALERT_OPEN_PERCENT,))
+        cursor.execute("SELECT version FROM schema_version;")
+        applied = {row[0] for row in cursor.fetchall()}
+
+        for version, description, step in MIGRATIONS:
+            if version in applied:
+                continue
+            print(f"DEBUG: Applying migration {version}: {description}")
+            if callable(step):
+                step(conn)
+                cursor.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s);", (version, description))
+            else:
+                cursor.execute("BEGIN;")
+                try:
+                    cursor.execute(step)
+                    cursor.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s);", (version, description))
+                    cursor.execute("COMMIT;")
+                except Exception:
+                    cursor.execute("ROLLBACK;")
+                    raise
+            applied_now.append(version)
+
+        ensure_telemetry_partitions(cursor)
+    finally:
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            cursor.execute("ROLLBACK;") # A callable step failed mid-transaction
+        cursor.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_ID,))
+        cursor.close()
+        conn.autocommit = False
+    return applied_now
 
 def initialize_database():
     """
-    Connects to the database and executes the full schema creation SQL.
-    This should only be run once for initialization.
+    Brings the database schema up to date by applying any pending migrations.
+    Safe to run repeatedly and against a live database: existing tables and data are never dropped.
     """
     conn = get_db_connection()
     if conn is None:
         return {"success": False, "message": "Database initialization connection failed."}, 500
     
     try:
-        cursor = conn.cursor()
-        # Execute the multi-statement SQL schema
-        cursor.execute(DB_INIT_SQL)
-        conn.commit()
-        
-        print("✅ Database Schema Created/Replaced Successfully.")
-        return {"success": True, "message": "Database schema created/replaced successfully."}, 200
+        applied = run_migrations(conn)
+        print(f"✅ Database Schema Up To Date (applied migrations: {applied or 'none'}).")
+        return {"success": True, "message": "Database schema is up to date.", "applied_migrations": applied,
+                "schema_version": MIGRATIONS[-1][0]}, 200
         
     except Exception as e:
-        conn.rollback()
-        print(f"❌ Error during schema creation: {e}")
-        return {"success": False, "message": f"Error during schema creation: {e}"}, 500
+        print(f"❌ Error during schema migration: {e}")
+        return {"success": False, "message": f"Error during schema migration: {e}"}, 500
     finally:
-        if conn and not conn.closed:
+        release_db_connection(conn)
+
+# --- 2c. TELEMETRY PARTITIONS ---
+TELEMETRY_PARTITION_INTERVAL = os.environ.get('TELEMETRY_PARTITION_INTERVAL', 'day') # 'day' or 'month'
+TELEMETRY_PARTITIONS_AHEAD = int(os.environ.get('TELEMETRY_PARTITIONS_AHEAD', '7')) # Future partitions kept ready
+TELEMETRY_RETENTION_DAYS = int(os.environ.get('TELEMETRY_RETENTION_DAYS', '0')) # 0 keeps history forever
+
+_TELEMETRY_PARTITIONS = set() # Partition start dates this process knows exist
+_TELEMETRY_PARTITIONS_LOADED = False
+_TELEMETRY_PARTITION_FLOOR = None # Upper bound of telemetry_legacy; no dated partitions are created below it
+_TELEMETRY_PARTITIONS_LOCK = threading.Lock() # Guards the three above, across threads sharing this process
+
+def reset_telemetry_partition_cache():
+    """Forgets what this process knows about partitions so the next ensure re-reads the catalog."""
+    global _TELEMETRY_PARTITIONS_LOADED
+    with _TELEMETRY_PARTITIONS_LOCK:
+        _TELEMETRY_PARTITIONS.clear()
+        _TELEMETRY_PARTITIONS_LOADED = False
+
+def _load_telemetry_partitions(cursor):
+    """Reads existing dated partitions (and the legacy partition's upper bound) from the catalog."""
+    global _TELEMETRY_PARTITIONS_LOADED, _TELEMETRY_PARTITION_FLOOR
+    cursor.execute("""
+    SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) FROM pg_inherits
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE pg_inherits.inhparent = 'telemetry'::regclass;
+    """)
+    _TELEMETRY_PARTITION_FLOOR = None
+    for name, bound in cursor.fetchall():
+        suffix = name[len('telemetry_p'):]
+        if name.startswith('telemetry_p') and suffix.isdigit():
+            _TELEMETRY_PARTITIONS.add(datetime.strptime(suffix, '%Y%m%d' if len(suffix) == 8 else '%Y%m').date())
+        elif name == 'telemetry_legacy':
+            upper = re.search(r"TO \('([^']+)'\)", bound or '')
+            if upper:
+                _TELEMETRY_PARTITION_FLOOR = datetime.fromisoformat(upper.group(1)).date()
+    _TELEMETRY_PARTITIONS_LOADED = True
+
+def telemetry_partition_bounds(moment):
+    """Returns (start, end) dates of the partition that holds `moment`."""
+    day = moment.date() if isinstance(moment, datetime) else moment
+    if TELEMETRY_PARTITION_INTERVAL == 'month':
+        start = day.replace(day=1)
+        return start, _next_month(start)
+    return day, day + timedelta(days=1)
+
+def _next_month(day):
+    return day.replace(year=day.year + 1, month=1, day=1) if day.month == 12 else day.replace(month=day.month + 1, day=1)
+
+def telemetry_partition_name(start):
+    return f"telemetry_p{start:%Y%m}" if TELEMETRY_PARTITION_INTERVAL == 'month' else f"telemetry_p{start:%Y%m%d}"
+
+def ensure_telemetry_partitions(cursor, moments=()):
+    """
+    Creates any missing partition for the given timestamps, plus the current one and TELEMETRY_PARTITIONS_AHEAD
+    upcoming ones. Cheap to call before every write: partitions already seen by this process are skipped.
+    When it creates any, it commits the cursor's connection and only then remembers them, so a CREATE that fails
+    or is rolled back is retried on the next call instead of leaving that range to telemetry_default.
+    """
+    starts = {telemetry_partition_bounds(moment)[0] for moment in moments}
+    start, end = telemetry_partition_bounds(datetime.now())
+    for _ in range(TELEMETRY_PARTITIONS_AHEAD + 1):
+        starts.add(start)
+        start, end = telemetry_partition_bounds(end)
+
+    with _TELEMETRY_PARTITIONS_LOCK:
+        if not _TELEMETRY_PARTITIONS_LOADED:
+            _load_telemetry_partitions(cursor)
+        created = []
+        for start in sorted(starts - _TELEMETRY_PARTITIONS):
+            if _TELEMETRY_PARTITION_FLOOR and start < _TELEMETRY_PARTITION_FLOOR:
+                continue # Covered by telemetry_legacy
+            _, end = telemetry_partition_bounds(start)
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {telemetry_partition_name(start)} PARTITION OF telemetry FOR VALUES FROM (%s) TO (%s);",
+                (start, end)
+            )
+            created.append(start)
+        if created:
+            cursor.connection.commit()
+            _TELEMETRY_PARTITIONS.update(created)
+
+def drop_expired_telemetry_partitions(cursor, retention_days=None):
+    """Detaches and drops dated partitions entirely older than the retention window. Returns the dropped names."""
+    retention_days = TELEMETRY_RETENTION_DAYS if retention_days is None else retention_days
+    if retention_days <= 0:
+        return []
+    cutoff = date.today() - timedelta(days=retention_days)
+    cursor.execute("""
+    SELECT child.relname FROM pg_inherits
+    JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE parent.relname = 'telemetry' AND child.relname LIKE 'telemetry\\_p%';
+    """)
+    dropped = []
+    for (name,) in cursor.fetchall():
+        suffix = name[len('telemetry_p'):]
+        if len(suffix) == 8: # Daily partition
+            start = datetime.strptime(suffix, '%Y%m%d').date()
+            end = start + timedelta(days=1)
+        else: # Monthly partition
+            start = datetime.strptime(suffix, '%Y%m').date()
+            end = _next_month(start)
+        if end <= cutoff:
+            cursor.execute(f"ALTER TABLE telemetry DETACH PARTITION {name};")
+            cursor.execute(f"DROP TABLE {name};")
+            with _TELEMETRY_PARTITIONS_LOCK:
+                _TELEMETRY_PARTITIONS.discard(start)
+            dropped.append(name)
+    return dropped
+
+# --- 2d. BIN REGISTRY CACHE ---
+# The registry (dustbins) only changes in register_bin, so each worker keeps it in memory. register_bin
+# invalidates the local copy and sends NOTIFY bin_registry_changed; every worker LISTENs on a dedicated
+# connection and drops its copy when notified. The TTL bounds staleness if notifications are ever missed.
+
+REGISTRY_CACHE_TTL = float(os.environ.get('REGISTRY_CACHE_TTL', '300')) # Seconds before a forced reload
+REGISTRY_CACHE_MAX_BINS = int(os.environ.get('REGISTRY_CACHE_MAX_BINS', '200000')) # Larger registries are not cached
+REGISTRY_CACHE_LISTEN = os.environ.get('REGISTRY_CACHE_LISTEN', '1') == '1' # Cross-worker invalidation via LISTEN/NOTIFY
+REGISTRY_CHANNEL = 'bin_registry_changed'
+REGISTRY_FORCED_RELOAD_INTERVAL = float(os.environ.get('REGISTRY_FORCED_RELOAD_INTERVAL', '5')) # Unknown IDs force a reload at most this often (seconds)
+
+REGISTRY_COLUMNS = ('bin_id', 'latitude', 'longitude', 'supervisor_name', 'location_name', 'bin_type',
+                    'max_capacity_cm', 'installation_date', 'change_seq')
+
+class BinRegistryCache:
+    """In-memory snapshot of the dustbins table with TTL, size limit, invalidation and hit/miss counters."""
+
+    def __init__(self, ttl, max_bins):
+        self.ttl = ttl
+        self.max_bins = max_bins
+        self._bins = None # bin_id -> row dict, in bin_id order
+        self._version = 0
+        self._loaded_at = 0.0
+        self._last_forced_reload = 0.0
+        self._derived = {} # name -> (bins dict it was built from, value); see derived()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "loads": 0, "invalidations": 0, "notifications": 0, "oversize": 0}
+
+    def invalidate(self):
+        with self._lock:
+            self._bins = None
+            self.stats["invalidations"] += 1
+
+    def snapshot(self, force_reload=False):
+        """Returns (version, {bin_id: row}) for the whole registry, reloading from PostgreSQL when stale."""
+        with self._lock:
+            if force_reload and time.monotonic() - self._last_forced_reload < REGISTRY_FORCED_RELOAD_INTERVAL:
+                force_reload = False
+            if self._bins is not None and not force_reload and time.monotonic() - self._loaded_at < self.ttl:
+                self.stats["hits"] += 1
+                return self._version, self._bins
+            self.stats["misses"] += 1
+            if force_reload:
+                self._last_forced_reload = time.monotonic()
+
+            version, bins = self._load()
+            if len(bins) <= self.max_bins:
+                self._bins, self._version, self._loaded_at = bins, version, time.monotonic()
+                self.stats["loads"] += 1
+            else:
+                self.stats["oversize"] += 1 # Too big to keep: serve this read and cache nothing
+                self._bins = None
+            return version, bins
+
+    def _load(self):
+        conn = get_db_connection()
+        if conn is None:
+            raise psycopg2.OperationalError("Database connection failed while loading the bin registry.")
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT {', '.join(REGISTRY_COLUMNS)} FROM dustbins ORDER BY bin_id;")
+            bins = {row[0]: dict(zip(REGISTRY_COLUMNS, row)) for row in cursor.fetchall()}
             cursor.close()
-            conn.close()
+        finally:
+            release_db_connection(conn)
+        # change_seq values commit in order (migration 3), so the largest visible one covers every change below it
+        version = max((b['change_seq'] for b in bins.values()), default=0)
+        return version, bins
+
+    def derived(self, name, build, force_reload=False):
+        """
+        build(bins) for the current snapshot, built once per snapshot and shared by every caller (do not modify it),
+        so lookup maps used on hot paths don't cost a pass over the registry per call.
+        """
+        _, bins = self.snapshot(force_reload)
+        with self._lock:
+            cached = self._derived.get(name)
+            if cached is not None and cached[0] is bins:
+                return cached[1]
+        value = build(bins)
+        with self._lock:
+            self._derived[name] = (bins, value)
+        return value
+
+    def capacities(self, force_reload=False):
+        """{bin_id: max_capacity_cm} for every registered bin (shared per snapshot; do not modify)."""
+        return self.derived('capacities', lambda bins: {bin_id: b['max_capacity_cm'] for bin_id, b in bins.items()}, force_reload)
+
+    def metrics(self):
+        with self._lock:
+            return {"cached_bins": len(self._bins) if self._bins is not None else 0, "version": self._version,
+                    "ttl": self.ttl, "max_bins": self.max_bins, **self.stats}
+
+
+class RegistryChangeListener(threading.Thread):
+    """LISTENs for registry changes made by any worker and invalidates this worker's cache."""
+
+    def __init__(self, cache):
+        super().__init__(name="registry-listener", daemon=True)
+        self.cache = cache
+
+    def run(self):
+        while True:
+            conn = None
+            try:
+                conn = _open_raw_connection() # Dedicated connection: a LISTENing session can't go back to the pool
+                conn.autocommit = True
+                cursor = conn.cursor()
+                cursor.execute(f"LISTEN {REGISTRY_CHANNEL};")
+                self.cache.invalidate() # Anything may have changed while we were not listening
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        self.cache.stats["notifications"] += len(conn.notifies)
+                        conn.notifies.clear()
+                        self.cache.invalidate()
+            except Exception as e:
+                print(f"Registry listener error (falling back to TTL until reconnected): {e}")
+                time.sleep(5)
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
+
+
+_BIN_REGISTRY = None
+_BIN_REGISTRY_PID = None
+_BIN_REGISTRY_LOCK = threading.Lock()
+
+def get_bin_registry():
+    """Returns this worker's registry cache, starting its LISTEN thread on first use (after gunicorn forks)."""
+    global _BIN_REGISTRY, _BIN_REGISTRY_PID
+    if _BIN_REGISTRY is not None and _BIN_REGISTRY_PID == os.getpid():
+        return _BIN_REGISTRY
+    with _BIN_REGISTRY_LOCK:
+        if _BIN_REGISTRY is None or _BIN_REGISTRY_PID != os.getpid():
+            _BIN_REGISTRY = BinRegistryCache(REGISTRY_CACHE_TTL, REGISTRY_CACHE_MAX_BINS)
+            _BIN_REGISTRY_PID = os.getpid()
+            if REGISTRY_CACHE_LISTEN:
+                RegistryChangeListener(_BIN_REGISTRY).start()
+    return _BIN_REGISTRY
+
+# --- 2e. SPATIAL INDEX ---
+# A uniform lat/lon grid over the cached registry answers viewport (bbox) and k-nearest queries by looking only
+# at nearby cells. It is rebuilt whenever the registry cache reloads, so register_bin keeps it in sync.
+
+SPATIAL_CELL_DEGREES = float(os.environ.get('SPATIAL_CELL_DEGREES', '0.01')) # ~1.1 km cells
+SPATIAL_MAX_RESULTS = 5000 # Upper bound on bins returned by one viewport query
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+def haversine_km(lat, lon, lats, lons):
+    """Great-circle distances (km) from one point to arrays of points."""
+    lat, lon = math.radians(lat), math.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+class SpatialGrid:
+    """Grid buckets of bin coordinates: cell (row, col) -> array of positions into bin_ids/lats/lons."""
+
+    def __init__(self, bins, cell_degrees):
+        self.cell = cell_degrees
+        self.bin_ids = list(bins)
+        self.lats = np.array([float(bins[b]['latitude']) for b in self.bin_ids], dtype=np.float64)
+        self.lons = np.array([float(bins[b]['longitude']) for b in self.bin_ids], dtype=np.float64)
+        rows = np.floor(self.lats / cell_degrees).astype(np.int64)
+        cols = np.floor(self.lons / cell_degrees).astype(np.int64)
+        self.cells = {}
+        if self.bin_ids:
+            order = np.lexsort((cols, rows))
+            keys = np.stack((rows[order], cols[order]), axis=1)
+            boundaries = np.flatnonzero(np.any(np.diff(keys, axis=0) != 0, axis=1)) + 1
+            for group in np.split(order, boundaries):
+                self.cells[(int(rows[group[0]]), int(cols[group[0]]))] = group
+            self.row_range = (int(rows.min()), int(rows.max()))
+            self.col_range = (int(cols.min()), int(cols.max()))
+
+    def _cell_of(self, lat, lon):
+        return math.floor(lat / self.cell), math.floor(lon / self.cell)
+
+    def within(self, min_lat, min_lon, max_lat, max_lon, limit=SPATIAL_MAX_RESULTS):
+        """Positions of bins inside the box (nearest the box centre first when over `limit`). Returns (positions, truncated)."""
+        (row_lo, col_lo), (row_hi, col_hi) = self._cell_of(min_lat, min_lon), self._cell_of(max_lat, max_lon)
+        if (row_hi - row_lo + 1) * (col_hi - col_lo + 1) <= len(self.cells):
+            groups = [self.cells[(r, c)] for r in range(row_lo, row_hi + 1) for c in range(col_lo, col_hi + 1) if (r, c) in self.cells]
+        else: # Box larger than the populated area: scan occupied cells instead of empty ones
+            groups = [g for (r, c), g in self.cells.items() if row_lo <= r <= row_hi and col_lo <= c <= col_hi]
+        if not groups:
+            return np.array([], dtype=np.int64), False
+        candidates = np.concatenate(groups)
+        lats, lons = self.lats[candidates], self.lons[candidates]
+        inside = candidates[(lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)]
+        if len(inside) <= limit:
+            return inside, False
+        distances = haversine_km((min_lat + max_lat) / 2, (min_lon + max_lon) / 2, self.lats[inside], self.lons[inside])
+        return inside[np.argsort(distances, kind='stable')[:limit]], True
+
+    def nearest(self, lat, lon, k, max_km=None):
+        """Positions and distances (km) of the k bins nearest to (lat, lon), searching rings of cells outwards."""
+        if not self.cells or k <= 0:
+            return np.array([], dtype=np.int64), np.array([])
+        row, col = self._cell_of(lat, lon)
+        # Rings closer than the populated extent are empty; rings beyond its far side add nothing
+        first_ring = max(self.row_range[0] - row, row - self.row_range[1], self.col_range[0] - col, col - self.col_range[1], 0)
+        max_ring = max(abs(row - self.row_range[0]), abs(row - self.row_range[1]),
+                       abs(col - self.col_range[0]), abs(col - self.col_range[1]))
+        found, found_dist = [], []
+        kth = math.inf
+        for ring in range(first_ring, max_ring + 1):
+            # Anything outside the rings searched so far is at least this far away
+            if ring > 0:
+                lower_bound = (ring - 1) * self.cell * KM_PER_DEGREE * math.cos(math.radians(min(abs(lat) + ring * self.cell, 89.9)))
+                if lower_bound > kth or (max_km is not None and lower_bound > max_km):
+                    break
+            if 8 * ring > len(self.cells): # Ring perimeter exceeds the occupied cells: a full scan is cheaper
+                found = [np.arange(len(self.bin_ids))]
+                found_dist = [haversine_km(lat, lon, self.lats, self.lons)]
+                break
+            if ring == 0:
+                ring_cells = [(row, col)]
+            else:
+                ring_cells = ([(row - ring, c) for c in range(col - ring, col + ring + 1)]
+                              + [(row + ring, c) for c in range(col - ring, col + ring + 1)]
+                              + [(r, col - ring) for r in range(row - ring + 1, row + ring)]
+                              + [(r, col + ring) for r in range(row - ring + 1, row + ring)])
+            groups = [self.cells[cell] for cell in ring_cells if cell in self.cells]
+            if groups:
+                candidates = np.concatenate(groups)
+                found.append(candidates)
+                found_dist.append(haversine_km(lat, lon, self.lats[candidates], self.lons[candidates]))
+                all_dist = np.concatenate(found_dist)
+                if len(all_dist) >= k:
+                    kth = float(np.partition(all_dist, k - 1)[k - 1])
+
+        if not found:
+            return np.array([], dtype=np.int64), np.array([])
+        positions, distances = np.concatenate(found), np.concatenate(found_dist)
+        if max_km is not None:
+            keep = distances <= max_km
+            positions, distances = positions[keep], distances[keep]
+        order = np.argsort(distances, kind='stable')[:k]
+        return positions[order], distances[order]
+
+
+_SPATIAL_INDEX = None # (registry snapshot it was built from, SpatialGrid)
+_SPATIAL_INDEX_LOCK = threading.Lock()
+
+def get_spatial_index():
+    """Returns (registry snapshot, grid), rebuilding the grid when the registry cache has reloaded."""
+    global _SPATIAL_INDEX
+    _, bins = get_bin_registry().snapshot()
+    with _SPATIAL_INDEX_LOCK:
+        if _SPATIAL_INDEX is None or _SPATIAL_INDEX[0] is not bins:
+            _SPATIAL_INDEX = (bins, SpatialGrid(bins, SPATIAL_CELL_DEGREES))
+        return _SPATIAL_INDEX
 
 # --- 3. CORE UTILITIES (PostgreSQL History & Logging) ---
 
-def get_latest_alert_time(conn, bin_id):
+RESOLVE_ALERT_QUERY = """
+WITH emptied AS ( -- The alert engine starts the bin over: not alerting, no debounce run in progress
+  UPDATE alert_state SET alerting = false, streak = 0, streak_started_at = NULL, streak_start_fill = NULL, peak_fill = 0
+  WHERE bin_id = %(bin_id)s
+)
+UPDATE alert_events SET closed_at = %(collection_time)s, close_reason = 'collected'
+WHERE bin_id = %(bin_id)s AND closed_at IS NULL
+RETURNING opened_at;
+"""
+
+def resolve_open_alert(cursor, bin_id, collection_time):
     """
-    Finds the time of the latest 'FULL' alert for a bin based on PostgreSQL Telemetry history.
+    Closes the bin's open alert as 'collected' (one lookup on alert_events_open_idx), resets its alert_state, and
+    returns when the alert opened, or None when the bin had no open alert. Runs in the caller's transaction.
     """
-    try:
-        cursor = conn.cursor()
-        query = """
-        SELECT timestamp FROM telemetry 
-        WHERE bin_id = %s AND fill_percentage >= 90
-        ORDER BY timestamp DESC
-        LIMIT 1;
-        """
-        cursor.execute(query, (bin_id,))
-        result = cursor.fetchone()
-        
-        if result:
-            return result[0] 
-        return None
-    except Exception as e:
-        print(f"Error fetching latest alert time: {e}")
-        return None
-    finally:
-        if 'cursor' in locals() and cursor:
-            cursor.close()
+    cursor.execute(RESOLVE_ALERT_QUERY, {"bin_id": bin_id, "collection_time": collection_time})
+    result = cursor.fetchone()
+    return result[0] if result else None
 
-def get_collection_history(conn, bin_id):
-    """Fetches the collection history and performance metrics for a bin."""
+STATE_CURSOR_QUERY = "SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint;"
+
+LATEST_STATE_QUERY = """
+SELECT bin_id, change_xid, last_reading_at, fill_level_cm, fill_percentage, is_lid_locked, alert_triggered, last_alert_at
+FROM bin_latest_state
+"""
+
+def fetch_fleet_status(cursor, current_time_ms, bin_ids=None):
+    """
+    Current status of every registered bin (or of `bin_ids`): the registry comes from the cache, the live
+    state from one bin_latest_state query. Returns [(bin_id, registry_seq, state_seq, record)] in bin_id order;
+    bins with ingested readings report bin_latest_state (state_seq is its change_xid, > 0), bins that have never
+    reported fall back to the simulator (state_seq == 0).
+    """
+    _, registry = get_bin_registry().snapshot()
+    bins, query, params = fleet_state_query(registry, bin_ids)
+    cursor.execute(query, params)
+    return build_fleet_status(bins, cursor.fetchall(), current_time_ms)
+
+def read_state_cursor(cursor):
+    """
+    State part of a /api/v1/telemetry/latest cursor: the current snapshot's xmin. Read it before the state rows;
+    any update the rows miss is then stamped at or above it and lands in the next delta.
+    """
+    cursor.execute(STATE_CURSOR_QUERY)
+    return cursor.fetchone()[0]
+
+def fleet_state_query(registry, bin_ids=None):
+    """The registry rows to report and the (query, params) reading their bin_latest_state rows."""
+    if bin_ids is None:
+        return list(registry.values()), LATEST_STATE_QUERY + ";", None
+    bins = [registry[bin_id] for bin_id in sorted(set(bin_ids)) if bin_id in registry]
+    return bins, LATEST_STATE_QUERY + " WHERE bin_id = ANY(%s);", ([b['bin_id'] for b in bins],)
+
+def build_fleet_status(bins, state_rows, current_time_ms):
+    """fetch_fleet_status() result from the registry rows and their LATEST_STATE_QUERY rows."""
+    states = {row[0]: row for row in state_rows}
+    fleet = []
+    for bin_info in bins:
+        bin_id = bin_info['bin_id']
+        state = states.get(bin_id)
+        if state is None:
+            fleet.append((bin_id, bin_info['change_seq'], 0, simulate_bin_telemetry(bin_id, current_time_ms)))
+            continue
+        _, state_seq, last_reading_at, fill_level_cm, fill_percentage, is_lid_locked, alert_triggered, last_alert_at = state
+        fleet.append((bin_id, bin_info['change_seq'], state_seq, {
+            "bin_id": bin_id,
+            "timestamp": last_reading_at.isoformat(),
+            "fill_level_cm": fill_level_cm,
+            "fill_percentage": fill_percentage,
+            "alert_triggered": int(bool(alert_triggered)),
+            "is_lid_locked": int(bool(is_lid_locked)),
+            "collection_time": None,
+            "delay_minutes": 0,
+            "last_alert_at": last_alert_at.isoformat() if last_alert_at else None,
+            "source": "device"
+        }))
+    return fleet
+
+COLLECTION_HISTORY_LIMIT = 100 # Most recent collections included in analysis reports
+
+COLLECTION_HISTORY_QUERY = """
+SELECT collection_time, time_to_collect_min, is_on_time, reward_issued 
+FROM collection_log 
+WHERE bin_id = %s
+ORDER BY collection_time DESC
+LIMIT %s;
+"""
+COLLECTION_TOTALS_QUERY = """
+SELECT subject, sum(collections), sum(on_time)
+FROM collection_stats WHERE scope = 'bin' AND subject = ANY(%s) GROUP BY subject;
+"""
+
+def get_collection_history(conn, bin_id, limit=COLLECTION_HISTORY_LIMIT):
+    """Fetches the most recent `limit` collections (newest first) and performance metrics for a bin."""
     try:
         cursor = conn.cursor()
-        query = """
-        SELECT collection_time, time_to_collect_min, is_on_time, reward_issued 
-        FROM collection_log 
-        WHERE bin_id = %s
-        ORDER BY collection_time DESC;
-        """
-        cursor.execute(query, (bin_id,))
+        cursor.execute(COLLECTION_HISTORY_QUERY, (bin_id, limit))
         columns = [desc[0] for desc in cursor.description]
         history_list = [dict(zip(columns, row)) for row in cursor.fetchall()]
         return history_list
@@ -190,16 +1703,347 @@ def get_collection_history(conn, bin_id):
         if 'cursor' in locals() and cursor:
             cursor.close()
 
-# --- 4. CORE ROUTES ---
+def get_collection_totals(cursor, bin_ids):
+    """{bin_id: (total collections, on-time collections)} over the whole collection_log (read from collection_stats)."""
+    cursor.execute(COLLECTION_TOTALS_QUERY, (list(bin_ids),))
+    return {bin_id: (total, on_time) for bin_id, total, on_time in cursor.fetchall()}
 
-@app.route('/')
-def index():
-    """Default route: Renders the login page."""
-    global USER_LOGGED_IN
-    if USER_LOGGED_IN:
-        return redirect(url_for('dashboard'))
-    # NOTE: You need a 'login.html' template in your templates folder
-    return render_template('login.html', title='Smart Waste Login')
+def parse_since_cursor(raw, parts=1):
+    """
+    Parses a ?since= cursor made of `parts` dot-separated non-negative integers.
+    Returns None when no cursor was sent, or raises ValueError on a malformed one.
+    """
+    if raw is None or raw == '':
+        return None
+    values = [int(v) for v in raw.split('.')]
+    if len(values) != parts or any(v < 0 for v in values):
+        raise ValueError(f"Invalid cursor '{raw}'.")
+    return values[0] if parts == 1 else tuple(values)
+
+def not_modified(etag):
+    """Empty 304 response for a client that already holds version `etag`."""
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def conditional_json(payload, etag):
+    """Returns a JSON response tagged with `etag`, or an empty 304 when the client's If-None-Match already holds it."""
+    held = held_etag(request.if_none_match, etag)
+    if held:
+        return not_modified(held)
+    response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache' # Always revalidate, never serve stale fleet data
+    return response
+
+# --- 3a. FILL-RATE FORECASTING ---
+# Fill rates of the whole fleet are fitted at once: the recent readings of every reporting bin form a
+# bins x FORECAST_MAX_POINTS matrix and a masked least-squares line is fitted per row with NumPy. Readings
+# before the bin was last emptied (a drop of FORECAST_RESET_DROP points or more) are ignored. The result is
+# cached per worker and refreshed at most every FORECAST_REFRESH_SECONDS.
+
+FORECAST_WINDOW_HOURS = float(os.environ.get('FORECAST_WINDOW_HOURS', '24')) # History considered per bin
+FORECAST_MAX_POINTS = int(os.environ.get('FORECAST_MAX_POINTS', '32')) # Most recent readings per bin
+FORECAST_MIN_POINTS = 3 # Fewer readings since the last emptying give no forecast
+FORECAST_RESET_DROP = 20 # A fill drop of this many points means the bin was emptied
+FORECAST_REFRESH_SECONDS = float(os.environ.get('FORECAST_REFRESH_SECONDS', '30'))
+FORECAST_URGENT_HOURS = 1.0 # Bins predicted to reach ALERT_OPEN_PERCENT (section 5d) this soon are escalated to HIGH
+FORECAST_HORIZON_HOURS = 24 * 30 # ETAs further out than this are reported as null
+
+FORECAST_READINGS_QUERY = """
+SELECT s.bin_id, r.times, r.fills
+FROM bin_latest_state s
+CROSS JOIN LATERAL (
+  SELECT array_agg(EXTRACT(EPOCH FROM (timestamp - %(now)s))::float8 ORDER BY timestamp) AS times,
+         array_agg(fill_percentage ORDER BY timestamp) AS fills
+  FROM (
+    SELECT timestamp, fill_percentage FROM telemetry
+    WHERE bin_id = s.bin_id AND timestamp >= %(since)s AND timestamp <= %(now)s AND fill_percentage IS NOT NULL
+    ORDER BY timestamp DESC
+    LIMIT %(points)s
+  ) recent
+) r
+WHERE s.last_reading_at >= %(since)s AND r.times IS NOT NULL;
+"""
+
+def fit_fill_rates(times, fills, mask):
+    """
+    Masked least-squares fit of fill% against time for every row of a bins x points matrix.
+    `times` are seconds relative to now (<= 0), ascending within a row; `mask` marks real readings.
+    Returns (slope in %/hour, points used, r_squared, latest fill) arrays; slope is NaN without enough points.
+    """
+    n_points = times.shape[1]
+    # Ignore everything before the last emptying: find the last index where the fill dropped sharply
+    drops = np.zeros_like(mask)
+    drops[:, 1:] = mask[:, 1:] & mask[:, :-1] & (fills[:, 1:] - fills[:, :-1] <= -FORECAST_RESET_DROP)
+    last_reset = np.maximum.accumulate(np.where(drops, np.arange(n_points), 0), axis=1)[:, -1:]
+    used = mask & (np.arange(n_points) >= last_reset)
+
+    w = used.astype(np.float64)
+    t = np.where(used, times, 0.0) / 3600.0 # Hours keep the normal equations well conditioned
+    y = np.where(used, fills, 0.0)
+    n = w.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_mean = t.sum(axis=1) / n
+        y_mean = y.sum(axis=1) / n
+        dt = np.where(used, t - t_mean[:, None], 0.0)
+        dy = np.where(used, y - y_mean[:, None], 0.0)
+        s_tt = (dt * dt).sum(axis=1)
+        s_ty = (dt * dy).sum(axis=1)
+        s_yy = (dy * dy).sum(axis=1)
+        slope = s_ty / s_tt
+        r_squared = np.where(s_yy > 0, s_ty * s_ty / (s_tt * s_yy), 1.0)
+    slope[(n < FORECAST_MIN_POINTS) | ~np.isfinite(slope)] = np.nan
+
+    # Latest reading per row (rows are left-aligned, so it sits at index count - 1)
+    counts = mask.sum(axis=1)
+    latest = fills[np.arange(len(fills)), np.maximum(counts - 1, 0)]
+    return slope, n.astype(np.int64), r_squared, latest
+
+def hours_until(target_percent, latest, slope):
+    """Hours until each bin reaches target_percent: 0 if already there, NaN if not filling (or beyond the horizon)."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        hours = (target_percent - latest) / slope
+    hours = np.where(latest >= target_percent, 0.0, hours)
+    return np.where((latest < target_percent) & ~((slope > 0) & (hours <= FORECAST_HORIZON_HOURS)), np.nan, hours)
+
+
+class FillForecaster:
+    """Per-worker cache of the fleet forecast, refreshed lazily from telemetry."""
+
+    def __init__(self, refresh_seconds):
+        self.refresh_seconds = refresh_seconds
+        self._forecasts = {}
+        self._refreshed_at = None
+        self._refreshed_monotonic = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"refreshes": 0, "bins": 0, "fetch_seconds": 0.0, "fit_seconds": 0.0}
+
+    def forecasts(self):
+        """Returns (refreshed_at, {bin_id: forecast}) for every bin with recent readings."""
+        with self._lock:
+            if self._refreshed_at is None or time.monotonic() - self._refreshed_monotonic >= self.refresh_seconds:
+                self._refresh()
+            return self._refreshed_at, self._forecasts
+
+    def _refresh(self):
+        now = datetime.now()
+        conn = get_db_connection()
+        if conn is None:
+            raise psycopg2.OperationalError("Database connection failed while refreshing forecasts.")
+        start = time.perf_counter()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(FORECAST_READINGS_QUERY, {
+                "now": now, "since": now - timedelta(hours=FORECAST_WINDOW_HOURS), "points": FORECAST_MAX_POINTS})
+            rows = cursor.fetchall()
+            cursor.close()
+        finally:
+            release_db_connection(conn)
+        fetched = time.perf_counter()
+
+        forecasts = {}
+        if rows:
+            # One row per bin with its readings (oldest first) as arrays; flatten them and left-align each bin's row
+            bin_ids = [row[0] for row in rows]
+            counts = np.fromiter((len(row[1]) for row in rows), dtype=np.int64, count=len(rows))
+            total = int(counts.sum())
+            row_index = np.repeat(np.arange(len(rows)), counts)
+            position = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+
+            shape = (len(rows), FORECAST_MAX_POINTS)
+            times, fills, mask = np.zeros(shape), np.zeros(shape), np.zeros(shape, dtype=bool)
+            times[row_index, position] = np.fromiter(itertools.chain.from_iterable(row[1] for row in rows), dtype=np.float64, count=total)
+            fills[row_index, position] = np.fromiter(itertools.chain.from_iterable(row[2] for row in rows), dtype=np.float64, count=total)
+            mask[row_index, position] = True
+
+            slope, points, r_squared, latest = fit_fill_rates(times, fills, mask)
+            to_alert = hours_until(ALERT_OPEN_PERCENT, latest, slope)
+            to_full = hours_until(100, latest, slope)
+
+            slope_values, point_values, r_squared_values = slope.tolist(), points.tolist(), r_squared.tolist()
+            to_alert_values, to_full_values = to_alert.tolist(), to_full.tolist()
+            for i, bin_id in enumerate(bin_ids):
+                rate, hours_alert, hours_full = slope_values[i], to_alert_values[i], to_full_values[i]
+                forecasts[bin_id] = {
+                    "fill_rate_per_hour": None if math.isnan(rate) else round(rate, 3),
+                    "readings_used": point_values[i],
+                    "r_squared": None if math.isnan(rate) else round(r_squared_values[i], 3),
+                    # The *_90 keys keep their names for existing clients; they count to ALERT_OPEN_PERCENT
+                    "hours_to_90": None if math.isnan(hours_alert) else round(hours_alert, 2),
+                    "hours_to_full": None if math.isnan(hours_full) else round(hours_full, 2),
+                    "predicted_90_at": None if math.isnan(hours_alert) else (now + timedelta(hours=hours_alert)).isoformat(),
+                    "predicted_full_at": None if math.isnan(hours_full) else (now + timedelta(hours=hours_full)).isoformat(),
+                }
+
+        self._forecasts = forecasts
+        self._refreshed_at = now
+        self._refreshed_monotonic = time.monotonic()
+        self.stats["refreshes"] += 1
+        self.stats["bins"] = len(forecasts)
+        self.stats["fetch_seconds"] = round(fetched - start, 4)
+        self.stats["fit_seconds"] = round(time.perf_counter() - fetched, 4)
+
+    def metrics(self):
+        return dict(self.stats)
+
+
+_FORECASTER = None
+_FORECASTER_PID = None
+_FORECASTER_LOCK = threading.Lock()
+
+def get_fill_forecaster():
+    """Returns this worker's forecaster, created lazily (after gunicorn forks)."""
+    global _FORECASTER, _FORECASTER_PID
+    if _FORECASTER is not None and _FORECASTER_PID == os.getpid():
+        return _FORECASTER
+    with _FORECASTER_LOCK:
+        if _FORECASTER is None or _FORECASTER_PID != os.getpid():
+            _FORECASTER = FillForecaster(FORECAST_REFRESH_SECONDS)
+            _FORECASTER_PID = os.getpid()
+    return _FORECASTER
+
+# --- 3b. RESPONSE ENCODING (Columnar Format & Compression) ---
+# Fleet-wide endpoints can answer in a columnar format (?format=columnar or Accept: COLUMNAR_MIMETYPE): one array
+# per field instead of one object per bin, encoded with orjson when installed. Full columnar bodies are cached
+# per ETag and content encoding, so repeated polls of an unchanged fleet skip building and compressing them.
+# Any other JSON response above RESPONSE_COMPRESS_MIN_BYTES is compressed (br or gzip) by compress_response().
+
+COLUMNAR_MIMETYPE = 'application/vnd.smartbin.columnar+json'
+RESPONSE_COMPRESS_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESS_MIN_BYTES', '1024')) # Smaller bodies go out as-is
+RESPONSE_GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', '5'))
+RESPONSE_BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', '4')) # 4-5 compress better than gzip at similar speed
+ENCODED_BODY_CACHE_SIZE = 16 # Full columnar bodies kept per worker
+
+_ENCODED_BODIES = collections.OrderedDict() # (etag, content encoding) -> body bytes
+_ENCODED_BODIES_LOCK = threading.Lock()
+
+def wants_columnar(format_arg, accept_header):
+    """True when the client asked for the columnar format (query flag or Accept header)."""
+    if format_arg is not None:
+        return format_arg == 'columnar'
+    accept = parse_accept_header(accept_header, MIMEAccept)
+    return accept.best_match(['application/json', COLUMNAR_MIMETYPE]) == COLUMNAR_MIMETYPE
+
+def negotiate_encoding(accept_encoding_header):
+    """Best content encoding the client accepts: 'br' (if brotli is installed), 'gzip' or None."""
+    accepted = parse_accept_header(accept_encoding_header)
+    for encoding in (('br', 'gzip') if brotli is not None else ('gzip',)):
+        if accepted[encoding] > 0:
+            return encoding
+    return None
+
+def representation_etag(etag, encoding):
+    """
+    ETag of version `etag` as sent with `encoding`. Identity, br and gzip bodies differ byte for byte, so each
+    content coding gets its own strong validator ('<etag>', '<etag>-br', '<etag>-gzip').
+    """
+    return etag if encoding is None else f"{etag}-{encoding}"
+
+def held_etag(if_none_match, etag):
+    """The representation of version `etag` named in a parsed If-None-Match header (in any content coding), or None."""
+    for encoding in (None, 'br', 'gzip'):
+        candidate = representation_etag(etag, encoding)
+        if if_none_match.contains(candidate):
+            return candidate
+    return None
+
+def _compact_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps_compact(payload):
+    """Compact JSON bytes (orjson when installed, which also encodes datetimes without a per-row isoformat() pass)."""
+    start = time.perf_counter()
+    try:
+        if orjson is not None:
+            return orjson.dumps(payload, default=_compact_default)
+        return json.dumps(payload, separators=(",", ":"), default=_compact_default).encode()
+    finally:
+        _add_request_stat('json_seconds', time.perf_counter() - start)
+
+def compress_body(body, encoding):
+    """Compresses `body` with `encoding` ('br', 'gzip' or None for as-is)."""
+    if encoding is None:
+        return body
+    start = time.perf_counter()
+    try:
+        if encoding == 'br':
+            return brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+        return gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL, mtime=0)
+    finally:
+        _add_request_stat('compress_seconds', time.perf_counter() - start)
+
+def encoded_body(etag, encoding, build):
+    """dumps_compact(build()) compressed with `encoding`, cached per (etag, encoding) when etag is not None."""
+    if etag is None:
+        return compress_body(dumps_compact(build()), encoding)
+    key = (etag, encoding)
+    with _ENCODED_BODIES_LOCK:
+        body = _ENCODED_BODIES.get(key)
+        if body is not None:
+            _ENCODED_BODIES.move_to_end(key)
+            return body
+    body = compress_body(dumps_compact(build()), encoding)
+    with _ENCODED_BODIES_LOCK:
+        _ENCODED_BODIES[key] = body
+        while len(_ENCODED_BODIES) > ENCODED_BODY_CACHE_SIZE:
+            _ENCODED_BODIES.popitem(last=False)
+    return body
+
+def columnar_response(etag, build, cache=True):
+    """
+    Columnar response tagged with `etag`, or an empty 304 when the client already holds it. build() returns the
+    body; with cache=True (full, non-delta bodies) it only runs once per ETag and encoding.
+    """
+    held = held_etag(request.if_none_match, etag)
+    if held:
+        return not_modified(held)
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    body = encoded_body(etag if cache else None, encoding, build)
+    response = app.response_class(body, mimetype=COLUMNAR_MIMETYPE)
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(representation_etag(etag, encoding))
+    response.headers['Cache-Control'] = 'no-cache' # Always revalidate, never serve stale fleet data
+    return response
+
+@app.after_request
+def compress_response(response):
+    """
+    Compresses JSON responses above RESPONSE_COMPRESS_MIN_BYTES for clients that accept br or gzip; the ETag
+    becomes the compressed representation's (see representation_etag()).
+    """
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.mimetype not in ('application/json', COLUMNAR_MIMETYPE)):
+        return response
+    if (response.content_length or 0) < RESPONSE_COMPRESS_MIN_BYTES:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is not None:
+        response.set_data(compress_body(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(representation_etag(etag, encoding), weak)
+    return response
+
+# --- 4. CORE ROUTES ---
+
+@app.route('/')
+def index():
+    """Default route: Renders the login page."""
+    global USER_LOGGED_IN
+    if USER_LOGGED_IN:
+        return redirect(url_for('dashboard'))
+    # NOTE: You need a 'login.html' template in your templates folder
+    return render_template('login.html', title='Smart Waste Login')
 
 @app.route('/login', methods=['POST'])
 def login():
@@ -245,9 +2089,41 @@ def register_form():
 @app.route('/api/v1/init_db', methods=['POST'])
 def init_db_endpoint():
     """API endpoint to manually trigger database schema creation."""
-    return jsonify(initialize_database())
+    result, status = initialize_database()
+    return jsonify(result), status
 # -----------------------------------------------
 
+@app.route('/api/v1/db/pool', methods=['GET'])
+def get_db_pool_metrics():
+    """Reports connection pool usage for this worker process (in use, waiting, created, recycled)."""
+    return jsonify({"success": True, "pid": os.getpid(), "pool": get_db_pool().metrics()}), 200
+
+@app.route('/api/v1/maintenance/telemetry_partitions', methods=['POST'])
+def maintain_telemetry_partitions():
+    """
+    Creates upcoming telemetry partitions, drops those past TELEMETRY_RETENTION_DAYS and purges minute/hour
+    rollups past ROLLUP_RETENTION_DAYS (run from a daily cron).
+    """
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({"success": False, "message": "Database connection failed. Check DB variables."}), 500
+
+    try:
+        cursor = conn.cursor()
+        reset_telemetry_partition_cache() # Re-check against the catalog, not this process's memory
+        ensure_telemetry_partitions(cursor)
+        dropped = drop_expired_telemetry_partitions(cursor)
+        purged = purge_expired_rollups(cursor)
+        conn.commit()
+        return jsonify({"success": True, "dropped_partitions": dropped, "purged_rollups": purged}), 200
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"success": False, "message": f"Error maintaining telemetry partitions: {e}"}), 500
+    finally:
+        if conn and not conn.closed and 'cursor' in locals():
+            cursor.close()
+        release_db_connection(conn)
+
 @app.route('/api/v1/register_bin', methods=['POST'])
 def register_bin():
     """Handles POST requests to register a new dustbin and stores it in the Dustbins table."""
@@ -282,7 +2158,9 @@ def register_bin():
         )
         
         cursor.execute(insert_query, bin_data)
+        cursor.execute(f"NOTIFY {REGISTRY_CHANNEL};") # Delivered to the other workers on commit
         conn.commit()
+        get_bin_registry().invalidate() # Write-through: this worker sees the new bin immediately
         
         return jsonify({
             "success": True, 
@@ -298,98 +2176,572 @@ def register_bin():
         conn.rollback()
         return jsonify({"success": False, "message": f"An unexpected error occurred: {e}"}), 500
     finally:
-        if conn and not conn.closed:
+        if conn and not conn.closed and 'cursor' in locals():
             cursor.close()
-            conn.close()
+        release_db_connection(conn)
+
+BULK_REGISTER_CHUNK_ROWS = 5000 # Validated rows buffered per COPY into the staging table
+BULK_REGISTER_MAX_ROWS = int(os.environ.get('BULK_REGISTER_MAX_ROWS', '100000'))
+BULK_REGISTER_MAX_ERRORS = 1000 # Errors listed in the report (all are counted)
+BULK_REGISTER_COLUMNS = ('bin_id', 'latitude', 'longitude', 'supervisor_name', 'location_name', 'bin_type',
+                         'max_capacity_cm', 'installation_date')
+
+def validate_bin_row(row):
+    """
+    Normalises one uploaded bin (dict of strings or JSON values) into a BULK_REGISTER_COLUMNS tuple,
+    with the same defaults as /api/v1/register_bin. Raises ValueError with a client-facing message.
+    """
+    if not isinstance(row, dict):
+        raise ValueError("Row must be an object.")
+    missing = [f for f in ('bin_id', 'latitude', 'longitude', 'supervisor_name', 'max_capacity_cm') if row.get(f) in (None, '')]
+    if missing:
+        raise ValueError(f"Missing {', '.join(missing)}.")
+
+    bin_id = str(row['bin_id']).strip()
+    if not bin_id or len(bin_id) > 10:
+        raise ValueError("bin_id must be 1-10 characters.")
+    try:
+        latitude, longitude = float(row['latitude']), float(row['longitude'])
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("latitude/longitude must be numbers.")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("latitude/longitude out of range.")
+    try:
+        max_capacity_cm = _finite_int(row['max_capacity_cm'], 'max_capacity_cm')
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("max_capacity_cm must be a finite number.")
+    if not 0 < max_capacity_cm <= PG_INTEGER_MAX: # Anything larger would fail the whole COPY
+        raise ValueError(f"max_capacity_cm must be between 1 and {PG_INTEGER_MAX}.")
+
+    installation_date = row.get('installation_date') or date.today()
+    if isinstance(installation_date, str):
+        try:
+            installation_date = date.fromisoformat(installation_date.strip())
+        except ValueError:
+            raise ValueError("installation_date must be YYYY-MM-DD.")
+    if not isinstance(installation_date, date):
+        raise ValueError("installation_date must be YYYY-MM-DD.")
+
+    texts = {}
+    for field, default, max_length in (('supervisor_name', None, 100), ('location_name', 'N/A', 255), ('bin_type', 'General', 50)):
+        value = row.get(field)
+        value = default if value in (None, '') else str(value).strip()
+        if value is not None and len(value) > max_length:
+            raise ValueError(f"{field} is longer than {max_length} characters.")
+        texts[field] = value
+
+    return (bin_id, round(latitude, 6), round(longitude, 6), texts['supervisor_name'], texts['location_name'],
+            texts['bin_type'], max_capacity_cm, installation_date)
+
+def _iter_upload_rows(stream, upload_format):
+    """Yields (row number, dict or parse error) from a CSV (with header) or NDJSON upload, one line at a time."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='' if upload_format == 'csv' else None)
+    if upload_format == 'csv':
+        for number, row in enumerate(csv.DictReader(text), start=1):
+            yield number, row
+    else:
+        number = 0
+        for line in text:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                yield number, json.loads(line)
+            except ValueError as e:
+                yield number, ValueError(f"Invalid JSON: {e}")
+
+@app.route('/api/v1/bins/bulk_register', methods=['POST'])
+def bulk_register_bins():
+    """
+    Registers many bins from a streamed CSV (header row, register_bin field names) or NDJSON upload.
+    Format comes from ?format=csv|ndjson or the Content-Type. Valid rows are COPYed into a staging table in
+    chunks and merged into dustbins with one INSERT and one commit; the response lists per-row errors.
+    ?mode=upsert updates bins that already exist (default: report them as errors), ?atomic=1 loads nothing
+    if any row fails, ?dry_run=1 only validates.
+    """
+    content_type = (request.content_type or '').split(';')[0].strip().lower()
+    upload_format = request.args.get('format') or ('csv' if content_type in ('text/csv', 'application/csv') else 'ndjson')
+    mode = request.args.get('mode', 'insert')
+    atomic = request.args.get('atomic') == '1'
+    dry_run = request.args.get('dry_run') == '1'
+    if upload_format not in ('csv', 'ndjson') or mode not in ('insert', 'upsert'):
+        return jsonify({"success": False, "message": "format must be csv or ndjson and mode insert or upsert."}), 400
+
+    started = time.perf_counter()
+    errors = []
+    error_count = 0
+
+    def reject(number, bin_id, message):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < BULK_REGISTER_MAX_ERRORS:
+            errors.append({"row": number, "bin_id": bin_id, "message": message})
 
-@app.route('/api/v1/bins/registered', methods=['GET'])
-def get_registered_bins():
-    """Fetches all static information for all registered bins from PostgreSQL."""
     conn = get_db_connection()
     if conn is None:
         return jsonify({"success": False, "message": "Database connection failed. Check DB variables."}), 500
-    
+
     try:
         cursor = conn.cursor()
-        select_query = "SELECT bin_id, latitude, longitude, supervisor_name, location_name, bin_type, max_capacity_cm, installation_date FROM dustbins;"
-        cursor.execute(select_query)
-        
-        # Fetch column names manually for dict output
-        columns = [desc[0] for desc in cursor.description]
-        bins = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        cursor.execute("""
+        CREATE TEMP TABLE dustbins_import (
+          row_number INTEGER NOT NULL,
+          bin_id VARCHAR(10) NOT NULL,
+          latitude DECIMAL(9, 6) NOT NULL,
+          longitude DECIMAL(9, 6) NOT NULL,
+          supervisor_name VARCHAR(100),
+          location_name VARCHAR(255),
+          bin_type VARCHAR(50),
+          max_capacity_cm INTEGER NOT NULL,
+          installation_date DATE
+        ) ON COMMIT DROP;
+        """)
 
-        # --- FIX: Convert datetime.date object to ISO string for JSON serialization ---
-        for bin_data in bins:
-            if isinstance(bin_data.get('installation_date'), date):
-                bin_data['installation_date'] = bin_data['installation_date'].isoformat()
-        # -----------------------------------------------------------------------------
+        received = staged = 0
+        seen = set()
+        chunk = io.StringIO()
+        chunk_rows = 0
 
-        return jsonify({"success": True, "bins": bins}), 200
+        def flush_chunk():
+            nonlocal chunk, chunk_rows
+            if chunk_rows:
+                chunk.seek(0)
+                cursor.copy_expert(f"COPY dustbins_import (row_number, {', '.join(BULK_REGISTER_COLUMNS)}) FROM STDIN", chunk)
+                chunk, chunk_rows = io.StringIO(), 0
+
+        try:
+            for number, row in _iter_upload_rows(request.stream, upload_format):
+                received += 1
+                if received > BULK_REGISTER_MAX_ROWS:
+                    return jsonify({"success": False, "message": f"Uploads are limited to {BULK_REGISTER_MAX_ROWS} rows."}), 413
+                bin_id = row.get('bin_id') if isinstance(row, dict) else None
+                if isinstance(row, Exception):
+                    reject(number, None, str(row))
+                    continue
+                try:
+                    values = validate_bin_row(row)
+                except ValueError as e:
+                    reject(number, bin_id, str(e))
+                    continue
+                if values[0] in seen:
+                    reject(number, values[0], "Duplicate bin_id in upload.")
+                    continue
+                seen.add(values[0])
+                chunk.write('\t'.join(_copy_field(v) for v in (number,) + values))
+                chunk.write('\n')
+                chunk_rows += 1
+                staged += 1
+                if chunk_rows >= BULK_REGISTER_CHUNK_ROWS:
+                    flush_chunk()
+            flush_chunk()
+        except (UnicodeDecodeError, csv.Error) as e:
+            conn.rollback()
+            return jsonify({"success": False, "message": f"Could not read upload: {e}"}), 400
+
+        registered = updated = 0
+        if staged and not dry_run:
+            if mode == 'insert':
+                cursor.execute(f"""
+                WITH inserted AS (
+                  INSERT INTO dustbins ({', '.join(BULK_REGISTER_COLUMNS)})
+                  SELECT {', '.join(BULK_REGISTER_COLUMNS)} FROM dustbins_import ORDER BY bin_id
+                  ON CONFLICT (bin_id) DO NOTHING
+                  RETURNING bin_id
+                )
+                SELECT i.row_number, i.bin_id FROM dustbins_import i
+                WHERE NOT EXISTS (SELECT 1 FROM inserted WHERE inserted.bin_id = i.bin_id)
+                ORDER BY i.row_number;
+                """)
+                conflicts = cursor.fetchall()
+                for number, bin_id in conflicts:
+                    reject(number, bin_id, "Bin ID already registered.")
+                registered = staged - len(conflicts)
+            else:
+                cursor.execute(f"""
+                INSERT INTO dustbins ({', '.join(BULK_REGISTER_COLUMNS)})
+                SELECT {', '.join(BULK_REGISTER_COLUMNS)} FROM dustbins_import ORDER BY bin_id
+                ON CONFLICT (bin_id) DO UPDATE SET
+                  latitude = excluded.latitude, longitude = excluded.longitude,
+                  supervisor_name = excluded.supervisor_name, location_name = excluded.location_name,
+                  bin_type = excluded.bin_type, max_capacity_cm = excluded.max_capacity_cm
+                RETURNING (xmax = 0);
+                """)
+                outcomes = [row[0] for row in cursor.fetchall()]
+                registered = sum(outcomes)
+                updated = len(outcomes) - registered
+
+        loaded = (registered or updated) and not dry_run and not (atomic and error_count)
+        if loaded:
+            cursor.execute(f"NOTIFY {REGISTRY_CHANNEL};") # Delivered to the other workers on commit
+            conn.commit()
+            get_bin_registry().invalidate()
+        else:
+            conn.rollback()
+            if atomic and error_count:
+                registered = updated = 0
+
+        return jsonify({
+            "success": error_count == 0,
+            "received": received,
+            "registered": registered,
+            "updated": updated,
+            "failed": error_count,
+            "dry_run": dry_run,
+            "errors": errors,
+            "errors_truncated": error_count > len(errors),
+            "seconds": round(time.perf_counter() - started, 3)
+        }), 200
 
     except Exception as e:
-        return jsonify({"success": False, "message": f"Error fetching bins: {e}"}), 500
+        conn.rollback()
+        return jsonify({"success": False, "message": f"Bulk registration failed: {e}"}), 500
     finally:
-        if conn and not conn.closed:
+        if conn and not conn.closed and 'cursor' in locals():
             cursor.close()
-            conn.close()
+        release_db_connection(conn)
+
+def registered_bins_payload(version, registry, since=None):
+    """Response body of /api/v1/bins/registered: every bin, or those changed after cursor `since`."""
+    bins = []
+    for bin_info in registry.values():
+        if since is not None and bin_info['change_seq'] <= since:
+            continue
+        bin_data = {k: v for k, v in bin_info.items() if k != 'change_seq'}
+        if isinstance(bin_data.get('installation_date'), date):
+            bin_data['installation_date'] = bin_data['installation_date'].isoformat()
+        bins.append(bin_data)
+    return {"success": True, "bins": bins, "cursor": version, "delta": since is not None}
+
+def registered_bins_columns(version, registry, since=None):
+    """Columnar body of /api/v1/bins/registered: one array per registry column, in bin_id order."""
+    rows = [b for b in registry.values() if since is None or b['change_seq'] > since]
+    columns = {column: [b[column] for b in rows] for column in REGISTRY_COLUMNS if column != 'change_seq'}
+    columns['latitude'] = [float(v) for v in columns['latitude']]
+    columns['longitude'] = [float(v) for v in columns['longitude']]
+    return {"success": True, "format": "columnar", "count": len(rows), "columns": columns,
+            "cursor": version, "delta": since is not None}
+
+@app.route('/api/v1/bins/registered', methods=['GET'])
+def get_registered_bins():
+    """
+    Fetches all static information for all registered bins (served from the in-memory registry cache).
+    With ?since=<cursor> only bins added/changed after that cursor are returned; unchanged versions get a 304.
+    ?format=columnar (or Accept: application/vnd.smartbin.columnar+json) returns column arrays instead.
+    """
+    try:
+        since = parse_since_cursor(request.args.get('since'))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    columnar = wants_columnar(request.args.get('format'), request.headers.get('Accept'))
+
+    try:
+        version, registry = get_bin_registry().snapshot()
+        etag = f"bins-{version}-columnar" if columnar else f"bins-{version}"
+        held = held_etag(request.if_none_match, etag)
+        if held or (since is not None and since >= version):
+            return not_modified(held or etag)
+        if columnar:
+            return columnar_response(etag, lambda: registered_bins_columns(version, registry, since), cache=since is None)
+        return conditional_json(registered_bins_payload(version, registry, since), etag)
+
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error fetching bins: {e}"}), 500
+
+def _spatial_response(bin_ids, registry, extra, include_status):
+    """Registry rows (plus live status with ?include=status) for the given bins, in the given order."""
+    bins = []
+    for position, bin_id in enumerate(bin_ids):
+        bin_data = {k: v for k, v in registry[bin_id].items() if k != 'change_seq'}
+        if isinstance(bin_data.get('installation_date'), date):
+            bin_data['installation_date'] = bin_data['installation_date'].isoformat()
+        bin_data.update(extra[position] if extra else {})
+        bins.append(bin_data)
+
+    if include_status and bins:
+        conn = get_db_connection()
+        if conn is None:
+            raise psycopg2.OperationalError("Database connection failed. Check DB variables.")
+        try:
+            cursor = conn.cursor()
+            status = {bin_id: record for bin_id, _, _, record in fetch_fleet_status(cursor, int(time.time() * 1000), bin_ids=bin_ids)}
+            cursor.close()
+        finally:
+            release_db_connection(conn)
+        for bin_data in bins:
+            bin_data['status'] = status.get(bin_data['bin_id'])
+    return bins
+
+@app.route('/api/v1/bins/within', methods=['GET'])
+def get_bins_within():
+    """
+    Bins inside a map viewport: ?bbox=<min_lon>,<min_lat>,<max_lon>,<max_lat> (GeoJSON order).
+    Optional ?limit= (max SPATIAL_MAX_RESULTS) and ?include=status to attach each bin's live status.
+    """
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in request.args.get('bbox', '').split(','))
+        limit = min(int(request.args.get('limit', SPATIAL_MAX_RESULTS)), SPATIAL_MAX_RESULTS)
+        if not (-180 <= min_lon <= max_lon <= 180 and -90 <= min_lat <= max_lat <= 90) or limit <= 0:
+            raise ValueError # Also rejects nan, which fails every comparison
+    except ValueError:
+        return jsonify({"success": False, "message": "bbox must be '<min_lon>,<min_lat>,<max_lon>,<max_lat>' within "
+                                                     "-180..180 / -90..90 and limit positive."}), 400
+
+    try:
+        registry, grid = get_spatial_index()
+        positions, truncated = grid.within(min_lat, min_lon, max_lat, max_lon, limit)
+        bin_ids = sorted(grid.bin_ids[i] for i in positions.tolist())
+        bins = _spatial_response(bin_ids, registry, None, request.args.get('include') == 'status')
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error querying bins in viewport: {e}"}), 500
+    return jsonify({"success": True, "bins": bins, "count": len(bins), "truncated": truncated}), 200
+
+@app.route('/api/v1/bins/nearest', methods=['GET'])
+def get_nearest_bins():
+    """
+    The k bins nearest to ?lat=&lon= (default k=10, max 500), closest first with distance_km.
+    Optional ?radius_km= caps the search and ?include=status attaches each bin's live status.
+    """
+    try:
+        lat, lon = float(request.args['lat']), float(request.args['lon'])
+        k = min(int(request.args.get('k', 10)), 500)
+        radius_km = float(request.args['radius_km']) if 'radius_km' in request.args else None
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180) or k <= 0 or (radius_km is not None and not (math.isfinite(radius_km) and radius_km > 0)):
+            raise ValueError
+    except (KeyError, ValueError):
+        return jsonify({"success": False, "message": "lat and lon are required; k and radius_km must be positive."}), 400
+
+    try:
+        registry, grid = get_spatial_index()
+        positions, distances = grid.nearest(lat, lon, k, radius_km)
+        bin_ids = [grid.bin_ids[i] for i in positions.tolist()]
+        extra = [{"distance_km": round(d, 3)} for d in distances.tolist()]
+        bins = _spatial_response(bin_ids, registry, extra, request.args.get('include') == 'status')
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error querying nearest bins: {e}"}), 500
+    return jsonify({"success": True, "bins": bins, "count": len(bins)}), 200
+
+@app.route('/api/v1/bins/registry/cache', methods=['GET'])
+def get_registry_cache_stats():
+    """Hit/miss/invalidation counters of this worker's bin registry cache."""
+    return jsonify({"success": True, "cache": get_bin_registry().metrics(), "listening": REGISTRY_CACHE_LISTEN}), 200
 
 @app.route('/api/v1/telemetry/latest', methods=['GET'])
 def get_latest_telemetry():
     """
-    SIMULATION: Fetches registered bins from PostgreSQL and generates dynamic fill data.
+    Latest status per registered bin, read from bin_latest_state (simulated for bins that never reported).
+    The cursor is "<registry version>.<5-second tick>.<state snapshot xmin>"; with ?since=<cursor> only bins that
+    were registered, received readings, or (if simulated) changed fill/lock/alert state after it are returned.
+    ?format=columnar (or Accept: application/vnd.smartbin.columnar+json) returns column arrays instead.
     """
+    try:
+        since = parse_since_cursor(request.args.get('since'), parts=3)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    columnar = wants_columnar(request.args.get('format'), request.headers.get('Accept'))
+
     pg_conn = get_db_connection()
     if pg_conn is None:
         return jsonify({"success": False, "message": "Database connection failed."}), 500
         
+    current_time_ms = int(time.time() * 1000)
     try:
-        cursor = pg_conn.cursor(cursor_factory=psycopg2.extras.DictCursor) 
-        cursor.execute("SELECT bin_id FROM dustbins;")
-        registered_bins = cursor.fetchall()
+        cursor = pg_conn.cursor() 
+        state_cursor = read_state_cursor(cursor)
+        if columnar:
+            _, registry = get_bin_registry().snapshot()
+            bins, query, params = fleet_state_query(registry)
+            cursor.execute(query, params)
+            state_rows = cursor.fetchall()
+        else:
+            fleet = fetch_fleet_status(cursor, current_time_ms)
     except Exception as e:
-        print(f"Error fetching registered bins from PostgreSQL: {e}")
+        print(f"Error fetching fleet status from PostgreSQL: {e}")
         return jsonify({"success": False, "message": "Could not retrieve registered bin list."}), 500
     finally:
-        if 'cursor' in locals() and cursor and cursor.connection and not cursor.connection.closed:
+        if 'cursor' in locals() and cursor and not cursor.closed:
             cursor.close()
-            pg_conn.close()
+        release_db_connection(pg_conn)
 
-    latest_data = []
-    current_time_ms = int(time.time() * 1000)
+    if columnar:
+        etag, build = latest_telemetry_columns(bins, state_rows, current_time_ms, since, state_cursor)
+        if since is None or held_etag(request.if_none_match, etag):
+            return columnar_response(etag, build)
+        payload = build()
+        return columnar_response(etag, lambda: payload, cache=False) if payload is not None else not_modified(etag)
 
-    # 2. Generate Simulated Live Status for each bin
-    for bin_info in registered_bins:
-        bin_id = bin_info['bin_id']
-        
-        # Use bin_id hash and time for a simulated dynamic percentage (0-100)
-        # This simulates change over a 60 second cycle, updating every 5 seconds.
-        bin_hash = sum(ord(c) for c in bin_id)
-        
-        # Calculation: (Time + Hash) % 100 
-        # Cycles based on time (current_time_ms // 5000 is updated every 5 seconds)
-        fill_percentage_raw = (current_time_ms // 5000 + bin_hash) % 100 
-        
-        # Smooth and constrain the percentage (10% to 90%)
-        fill_percentage = (fill_percentage_raw % 80) + 10
-        fill_percentage = min(fill_percentage, 95) # Cap max fill at 95%
-        
-        # Determine lock status based on simulation
-        is_locked = 1 if fill_percentage >= 90 else 0
-        alert_triggered = 1 if fill_percentage >= 95 else 0
+    payload, etag = latest_telemetry_payload(fleet, current_time_ms, since, state_cursor)
+    if payload is None:
+        return not_modified(etag)
+    return conditional_json(payload, etag)
 
-        telemetry_record = {
-            "bin_id": bin_id,
-            "timestamp": datetime.now().isoformat(),
-            "fill_level_cm": 15 * (100 - fill_percentage) / 100, # Simulated CM value
-            "fill_percentage": fill_percentage,
-            "alert_triggered": alert_triggered,
-            "is_lid_locked": is_locked, 
-            "collection_time": None, 
-            "delay_minutes": 0,
+def latest_telemetry_payload(fleet, current_time_ms, since=None, state_cursor=0):
+    """
+    (response body, etag) of /api/v1/telemetry/latest for a fetch_fleet_status() result and the read_state_cursor()
+    taken before it; the body is None when nothing changed after cursor `since`.
+    """
+    version = max((registry_seq for _, registry_seq, _, _ in fleet), default=0)
+    tick = current_time_ms // SIMULATION_TICK_MS
+    cursor_value = telemetry_cursor(version, tick, state_cursor)
+    etag = f"telemetry-{cursor_value}"
+
+    if since is None:
+        latest_data = [record for _, _, _, record in fleet]
+    else:
+        since_version, since_tick, since_state_cursor = since
+        since_time_ms = min(since_tick, tick) * SIMULATION_TICK_MS
+        latest_data = []
+        for bin_id, registry_seq, state_seq, record in fleet:
+            if registry_seq > since_version or (state_seq and state_seq >= since_state_cursor):
+                latest_data.append(record)
+            elif state_seq == 0:
+                previous = simulate_bin_telemetry(bin_id, since_time_ms)
+                if any(record[key] != previous[key] for key in ('fill_percentage', 'is_lid_locked', 'alert_triggered')):
+                    latest_data.append(record)
+        if not latest_data:
+            return None, etag
+
+    return {"success": True, "latest_data": latest_data, "cursor": cursor_value, "delta": since is not None}, etag
+
+def telemetry_cursor(version, tick, state_cursor):
+    """?since= cursor of /api/v1/telemetry/latest: registry version, simulation tick and state snapshot xmin."""
+    return f"{version}.{tick}.{state_cursor}"
+
+def latest_telemetry_columns(bins, state_rows, current_time_ms, since=None, state_cursor=0):
+    """
+    Columnar counterpart of latest_telemetry_payload(), built from the registry rows and their LATEST_STATE_QUERY
+    rows without a per-bin record; simulated bins are computed for the whole fleet at once. Returns (etag, build):
+    the ETag is known before any column is built, and build() returns the body, or None when nothing changed
+    after cursor `since`.
+    """
+    states = {row[0]: row for row in state_rows}
+    rows = [states.get(b['bin_id']) for b in bins]
+    count = len(bins)
+    registry_seq = np.fromiter((b['change_seq'] for b in bins), dtype=np.int64, count=count)
+    state_seq = np.fromiter((row[1] if row is not None else 0 for row in rows), dtype=np.int64, count=count)
+    tick = current_time_ms // SIMULATION_TICK_MS
+    cursor_value = telemetry_cursor(int(registry_seq.max(initial=0)), tick, state_cursor)
+    etag = f"telemetry-{cursor_value}-columnar"
+
+    def build():
+        bin_hash = np.fromiter((sum(map(ord, b['bin_id'])) for b in bins), dtype=np.int64, count=count)
+        fill, locked, alert = simulated_fill_states(bin_hash, tick)
+        simulated = state_seq == 0
+        if since is None:
+            selected = np.arange(count)
+        else:
+            since_version, since_tick, since_state_cursor = since
+            previous = simulated_fill_states(bin_hash, min(since_tick, tick))
+            changed = (fill != previous[0]) | (locked != previous[1]) | (alert != previous[2])
+            state_changed = ~simulated & (state_seq >= since_state_cursor)
+            selected = np.flatnonzero((registry_seq > since_version) | state_changed | (simulated & changed))
+            if not selected.size:
+                return None
+
+        selected = selected.tolist()
+        is_simulated = simulated.tolist()
+        fill, locked, alert = fill.tolist(), locked.tolist(), alert.tolist()
+        now = datetime.now().isoformat()
+        # rows[i] is a LATEST_STATE_QUERY row: datetimes are left to the encoder
+        columns = {
+            "bin_id": [bins[i]['bin_id'] for i in selected],
+            "timestamp": [now if is_simulated[i] else rows[i][2] for i in selected],
+            "fill_level_cm": [15 * (100 - fill[i]) / 100 if is_simulated[i] else rows[i][3] for i in selected],
+            "fill_percentage": [fill[i] if is_simulated[i] else rows[i][4] for i in selected],
+            "alert_triggered": [alert[i] if is_simulated[i] else int(bool(rows[i][6])) for i in selected],
+            "is_lid_locked": [locked[i] if is_simulated[i] else int(bool(rows[i][5])) for i in selected],
+            "collection_time": [None] * len(selected),
+            "delay_minutes": [0] * len(selected),
+            "last_alert_at": [None if is_simulated[i] else rows[i][7] for i in selected],
+            "source": ["simulated" if is_simulated[i] else "device" for i in selected],
         }
-        latest_data.append(telemetry_record)
+        return {"success": True, "format": "columnar", "count": len(selected), "columns": columns,
+                "cursor": cursor_value, "delta": since is not None}
+
+    return etag, build
+
 
-    return jsonify({"success": True, "latest_data": latest_data}), 200
+SIMULATION_TICK_MS = 5000 # Simulated readings change once per tick
+
+def simulated_fill_states(bin_hashes, tick):
+    """simulate_bin_telemetry()'s (fill_percentage, is_lid_locked, alert_triggered) for arrays of bin hashes."""
+    fill = np.minimum((tick + bin_hashes) % 100 % 80 + 10, 95)
+    return fill, (fill >= 90).astype(np.int64), (fill >= 95).astype(np.int64)
+
+def simulate_bin_telemetry(bin_id, current_time_ms):
+    """SIMULATION: Builds the live telemetry record for one bin from its ID hash and the current time."""
+    # Use bin_id hash and time for a simulated dynamic percentage (0-100)
+    # This simulates change over a 60 second cycle, updating every 5 seconds.
+    bin_hash = sum(ord(c) for c in bin_id)
+    
+    # Calculation: (Time + Hash) % 100 
+    # Cycles based on time (current_time_ms // SIMULATION_TICK_MS is updated every 5 seconds)
+    fill_percentage_raw = (current_time_ms // SIMULATION_TICK_MS + bin_hash) % 100 
+    
+    # Smooth and constrain the percentage (10% to 90%)
+    fill_percentage = (fill_percentage_raw % 80) + 10
+    fill_percentage = min(fill_percentage, 95) # Cap max fill at 95%
+    
+    # Determine lock status based on simulation
+    is_locked = 1 if fill_percentage >= 90 else 0
+    alert_triggered = 1 if fill_percentage >= 95 else 0
+
+    return {
+        "bin_id": bin_id,
+        "timestamp": datetime.now().isoformat(),
+        "fill_level_cm": 15 * (100 - fill_percentage) / 100, # Simulated CM value
+        "fill_percentage": fill_percentage,
+        "alert_triggered": alert_triggered,
+        "is_lid_locked": is_locked, 
+        "collection_time": None, 
+        "delay_minutes": 0,
+        "last_alert_at": None,
+        "source": "simulated"
+    }
+
+
+def build_analysis_report(bin_id, fill_percentage, history, forecast=None, totals=None):
+    """Classifies urgency for a bin, adds its fill forecast and summarises its collection history (newest first)."""
+    # NOTE: This uses hardcoded urgency for demo purposes
+    if fill_percentage > 90:
+        urgency = "CRITICAL"
+        issue = f"High fill level ({fill_percentage}%) detected. Requires immediate collection."
+        precautions = [
+            "Issue a high-priority alert to Collector Team A.",
+            "Remotely lock the lid mechanism to prevent spillage."
+        ]
+    elif fill_percentage > 60:
+        urgency = "HIGH"
+        issue = f"Warning: Bin approaching capacity ({fill_percentage}%)."
+        precautions = ["Verify collection schedule for this route."]
+    else:
+        urgency = "ROUTINE"
+        issue = "Normal Fill Rate."
+        precautions = ["Maintain current collection schedule."]
+
+    hours_to_90 = forecast.get("hours_to_90") if forecast else None
+    if urgency != "CRITICAL" and hours_to_90 is not None and hours_to_90 <= FORECAST_URGENT_HOURS:
+        urgency = "HIGH"
+        issue = f"Predicted to reach {ALERT_OPEN_PERCENT}% within {hours_to_90:.1f} h (currently {fill_percentage}%)."
+        precautions = ["Schedule collection before the predicted alert time."]
+
+    return {
+        "bin_id": bin_id,
+        "urgency": urgency,
+        "core_issue": issue,
+        "precautions": precautions,
+        "forecast": forecast,
+        "collection_history": [
+            {
+                "time": item['collection_time'].isoformat() if item.get('collection_time') else None,
+                "delay": item['time_to_collect_min'],
+                "on_time": item['is_on_time'],
+                "reward": item['reward_issued']
+            } for item in history
+        ],
+        "total_collections": totals[0] if totals else len(history),
+        "on_time_collections": totals[1] if totals else len([h for h in history if h.get('is_on_time')]),
+        "analysis_timestamp": datetime.now().isoformat()
+    }
 
 
 @app.route('/api/v1/bin/analysis/<bin_id>', methods=['GET'])
@@ -400,106 +2752,152 @@ def get_bin_analysis(bin_id):
         return jsonify({"success": False, "message": "Database connection failed. Check DB variables."}), 500
     
     try:
+        cursor = conn.cursor()
+        fleet = fetch_fleet_status(cursor, int(time.time() * 1000), bin_ids=[bin_id])
+        if not fleet:
+            return jsonify({"success": False, "message": f"Telemetry data not found for bin {bin_id}."}), 404
+        current_fill = fleet[0][3]['fill_percentage']
+
         # Fetch collection history (from PostgreSQL) to provide detailed performance data
         history = get_collection_history(conn, bin_id)
+        totals = get_collection_totals(cursor, [bin_id]).get(bin_id, (0, 0))
+
+        _, forecasts = get_fill_forecaster().forecasts()
+        analysis_report = build_analysis_report(bin_id, current_fill, history, forecasts.get(bin_id), totals)
+        return jsonify({"success": True, "analysis": analysis_report}), 200
         
-        # --- FIX: Retrieve ALL simulated telemetry data ---
-        telemetry_response = get_latest_telemetry().get_json(silent=True)
-        all_simulated_data = telemetry_response.get('latest_data', [])
-        
-        # Filter for the specific bin_id
-        current_bin_data = next((item for item in all_simulated_data if item['bin_id'] == bin_id), None)
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error generating analysis: {e}"}), 500
+    finally:
+        if conn and not conn.closed and 'cursor' in locals():
+            cursor.close()
+        release_db_connection(conn)
 
-        if not current_bin_data:
-            return jsonify({"success": False, "message": f"Simulated telemetry data not found for bin {bin_id}."}), 404
+@app.route('/api/v1/bins/analysis', methods=['GET'])
+def get_fleet_analysis():
+    """
+    Bulk version of /api/v1/bin/analysis/<bin_id> for the whole fleet, or for ?bin_ids=BIN-001,BIN-002.
+    Recent collection history for every requested bin is read with a single query over collection_log.
+    """
+    bin_ids_param = request.args.get('bin_ids', '').strip()
+    requested_ids = [b.strip() for b in bin_ids_param.split(',') if b.strip()] if bin_ids_param else None
 
-        simulated_fill = current_bin_data['fill_percentage']
-        # --------------------------------------------------------------------------
-        
-        # Placeholder for dynamic analysis report
-        # NOTE: This uses hardcoded urgency for demo purposes
-        
-        if simulated_fill > 90:
-            urgency = "CRITICAL"
-            issue = f"High fill level ({simulated_fill}%) detected. Requires immediate collection."
-            precautions = [
-                "Issue a high-priority alert to Collector Team A.",
-                "Remotely lock the lid mechanism to prevent spillage."
-            ]
-        elif simulated_fill > 60:
-            urgency = "HIGH"
-            issue = f"Warning: Bin approaching capacity ({simulated_fill}%)."
-            precautions = ["Verify collection schedule for this route."]
-        else:
-            urgency = "ROUTINE"
-            issue = "Normal Fill Rate."
-            precautions = ["Maintain current collection schedule."]
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({"success": False, "message": "Database connection failed. Check DB variables."}), 500
 
-        analysis_report = {
-            "bin_id": bin_id,
-            "urgency": urgency,
-            "core_issue": issue,
-            "precautions": precautions,
-            "collection_history": [
-                {
-                    "time": item['collection_time'].isoformat() if item.get('collection_time') else None,
-                    "delay": item['time_to_collect_min'],
-                    "on_time": item['is_on_time'],
-                    "reward": item['reward_issued']
-                } for item in history
-            ],
-            "total_collections": len(history),
-            "on_time_collections": len([h for h in history if h.get('is_on_time')]),
-            "analysis_timestamp": datetime.now().isoformat()
-        }
+    try:
+        cursor = conn.cursor()
+        fleet = fetch_fleet_status(cursor, int(time.time() * 1000), bin_ids=requested_ids)
+        current_fill = {bin_id: record['fill_percentage'] for bin_id, _, _, record in fleet}
+        bin_ids = sorted(current_fill)
+
+        history_by_bin = {bin_id: [] for bin_id in bin_ids}
+        if bin_ids:
+            cursor.execute("""
+            SELECT b.bin_id, c.collection_time, c.time_to_collect_min, c.is_on_time, c.reward_issued
+            FROM unnest(%s::varchar[]) AS b (bin_id)
+            CROSS JOIN LATERAL (
+              SELECT collection_time, time_to_collect_min, is_on_time, reward_issued
+              FROM collection_log WHERE collection_log.bin_id = b.bin_id
+              ORDER BY collection_time DESC
+              LIMIT %s
+            ) c
+            ORDER BY b.bin_id, c.collection_time DESC;
+            """, (bin_ids, COLLECTION_HISTORY_LIMIT))
+            for bin_id, collection_time, time_to_collect_min, is_on_time, reward_issued in cursor.fetchall():
+                history_by_bin[bin_id].append({
+                    "collection_time": collection_time,
+                    "time_to_collect_min": time_to_collect_min,
+                    "is_on_time": is_on_time,
+                    "reward_issued": reward_issued
+                })
+
+        totals = get_collection_totals(cursor, bin_ids) if bin_ids else {}
+        _, forecasts = get_fill_forecaster().forecasts()
+        analyses = [build_analysis_report(bin_id, current_fill[bin_id], history_by_bin[bin_id], forecasts.get(bin_id),
+                                          totals.get(bin_id, (0, 0)))
+                    for bin_id in bin_ids]
+
+        response = {"success": True, "analyses": analyses}
+        if requested_ids is not None:
+            response["not_found"] = sorted(set(requested_ids) - set(bin_ids))
+        return jsonify(response), 200
 
-        return jsonify({"success": True, "analysis": analysis_report}), 200
-        
     except Exception as e:
-        return jsonify({"success": False, "message": f"Error generating analysis: {e}"}), 500
+        return jsonify({"success": False, "message": f"Error generating fleet analysis: {e}"}), 500
     finally:
-        if conn and not conn.closed:
-            conn.close()
+        if conn and not conn.closed and 'cursor' in locals():
+            cursor.close()
+        release_db_connection(conn)
+
+@app.route('/api/v1/bins/forecast', methods=['GET'])
+def get_fleet_forecast():
+    """
+    Predicted time to 90% and to full for every bin with recent readings (or ?bin_ids=...), soonest first.
+    Bins that are not filling or have too few readings since their last emptying sort last with null ETAs.
+    """
+    bin_ids_param = request.args.get('bin_ids', '').strip()
+    requested_ids = [b.strip() for b in bin_ids_param.split(',') if b.strip()] if bin_ids_param else None
+
+    try:
+        refreshed_at, forecasts = get_fill_forecaster().forecasts()
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error computing forecasts: {e}"}), 500
+
+    bin_ids = forecasts.keys() if requested_ids is None else [b for b in requested_ids if b in forecasts]
+    results = [{"bin_id": bin_id, **forecasts[bin_id]} for bin_id in bin_ids]
+    results.sort(key=lambda f: (f["hours_to_90"] is None, f["hours_to_90"] or 0, f["bin_id"]))
+
+    response = {"success": True, "forecasts": results, "refreshed_at": refreshed_at.isoformat(),
+                "window_hours": FORECAST_WINDOW_HOURS}
+    if requested_ids is not None:
+        response["no_forecast"] = sorted(set(requested_ids) - set(forecasts))
+    return jsonify(response), 200
+
+MAX_DELAY_MINUTES = 180 # Collections within this long of the alert are on time (and rewarded)
+DEFAULT_COLLECTOR_ID = "COL-A01" # Credited when a collection is logged without a collector_id
+
+COLLECTION_INSERT_QUERY = """
+INSERT INTO collection_log 
+(bin_id, collection_time, alert_time, time_to_collect_min, is_on_time, reward_issued, collector_id)
+VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+
+def collection_outcome(collection_time, alert_time):
+    """(time_to_collect_min, is_on_time, reward_issued) for a collection answering `alert_time` (if any)."""
+    if not alert_time:
+        return 0, False, False
+    time_to_collect_min = int((collection_time - alert_time).total_seconds() / 60)
+    is_on_time = time_to_collect_min <= MAX_DELAY_MINUTES
+    return time_to_collect_min, is_on_time, is_on_time
 
 @app.route('/api/v1/log_collection', methods=['POST'])
 def log_collection():
-    """Logs a successful collection event and calculates performance (PostgreSQL)."""
+    """
+    Logs a successful collection event (optionally with the collector_id who made it) and calculates performance
+    (PostgreSQL). The bin's open alert is resolved, and collection_stats updated, in the same transaction;
+    time to collect is measured from when that alert opened.
+    """
     data = request.json
     bin_id = data.get('bin_id')
+    collector_id = data.get('collector_id') or DEFAULT_COLLECTOR_ID
     
     if not bin_id:
         return jsonify({"success": False, "message": "Missing bin_id."}), 400
+    if not isinstance(collector_id, str) or len(collector_id) > 10:
+        return jsonify({"success": False, "message": "collector_id must be a string of at most 10 characters."}), 400
 
     conn = get_db_connection()
     if conn is None:
         return jsonify({"success": False, "message": "Database connection failed. Check DB variables."}), 500
     
     collection_time = datetime.now()
-    alert_time = get_latest_alert_time(conn, bin_id)
-    
-    MAX_DELAY_MINUTES = 180 
-    
-    time_to_collect_min = 0
-    is_on_time = False
-    reward_issued = False
-    
-    if alert_time:
-        time_difference = collection_time - alert_time
-        time_to_collect_min = int(time_difference.total_seconds() / 60)
-        
-        is_on_time = time_to_collect_min <= MAX_DELAY_MINUTES
-        reward_issued = is_on_time
     
     try:
         cursor = conn.cursor()
-        
-        insert_query = """
-        INSERT INTO collection_log 
-        (bin_id, collection_time, alert_time, time_to_collect_min, is_on_time, reward_issued, collector_id)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """
-        
-        collector_id = "COL-A01" 
+        alert_time = resolve_open_alert(cursor, bin_id, collection_time)
+        time_to_collect_min, is_on_time, reward_issued = collection_outcome(collection_time, alert_time)
         
         log_data = (
             bin_id,
@@ -511,7 +2909,7 @@ def log_collection():
             collector_id
         )
         
-        cursor.execute(insert_query, log_data)
+        cursor.execute(COLLECTION_INSERT_QUERY, log_data)
         conn.commit()
         
         return jsonify({
@@ -524,49 +2922,1542 @@ def log_collection():
         conn.rollback()
         return jsonify({"success": False, "message": f"Error logging collection: {e}"}), 500
     finally:
-        if conn and not conn.closed:
+        if conn and not conn.closed and 'cursor' in locals():
             cursor.close()
+        release_db_connection(conn)
+
+
+# --- 5a. TELEMETRY INGESTION (Devices / Gateways -> PostgreSQL) ---
+# Readings are validated against the registry cache, buffered in memory and written with COPY in large
+# batches by a background flusher, so one INSERT + COMMIT per reading never sits on the request path.
+
+TELEMETRY_FLUSH_SIZE = int(os.environ.get('TELEMETRY_FLUSH_SIZE', '5000')) # Flush as soon as this many readings are buffered
+TELEMETRY_FLUSH_INTERVAL = float(os.environ.get('TELEMETRY_FLUSH_INTERVAL', '1.0')) # ...or at least this often (seconds)
+TELEMETRY_BUFFER_MAX = int(os.environ.get('TELEMETRY_BUFFER_MAX', '200000')) # Reject new readings (503) above this backlog
+TELEMETRY_BATCH_MAX = int(os.environ.get('TELEMETRY_BATCH_MAX', '10000')) # Max readings per POST
+
+LOCK_THRESHOLD_PERCENT = 90 # Lid locks at this fill (matches the bridge)
+SEGREGATOR_THRESHOLD_PERCENT = 98 # Edge alert threshold used by the ESP32 / simulator
+
+TELEMETRY_COPY_COLUMNS = ('bin_id', 'timestamp', 'fill_level_cm', 'fill_percentage', 'is_lid_locked', 'alert_triggered', 'delay_minutes')
+
+def _as_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+def _finite_int(value, name):
+    """int(value) for a finite number, else ValueError (int(float('inf')) would raise OverflowError)."""
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"{name} must be a finite number.")
+    return int(number)
+
+def validate_reading(reading, capacities):
+    """
+    Normalises one posted reading into a TELEMETRY_COPY_COLUMNS tuple.
+    Raises ValueError with a client-facing message when the reading is unusable.
+    """
+    if not isinstance(reading, dict):
+        raise ValueError("Reading must be a JSON object.")
+    bin_id = reading.get('bin_id')
+    if not isinstance(bin_id, str):
+        raise ValueError("bin_id must be a string.")
+    if bin_id not in capacities:
+        raise ValueError(f"Unknown bin_id '{bin_id}'.")
+
+    timestamp = reading.get('timestamp')
+    if timestamp is None:
+        timestamp = datetime.now()
+    else:
+        timestamp = datetime.fromisoformat(str(timestamp).replace('Z', '+00:00'))
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone().replace(tzinfo=None) # Column is TIMESTAMP WITHOUT TIME ZONE (server local time)
+
+    fill_level_cm = reading.get('fill_level_cm', reading.get('garbage_level_cm'))
+    if fill_level_cm is not None:
+        fill_level_cm = _finite_int(fill_level_cm, "fill_level_cm")
+        if not 0 <= fill_level_cm <= PG_INTEGER_MAX:
+            raise ValueError(f"fill_level_cm must be between 0 and {PG_INTEGER_MAX}.")
+    fill_percentage = reading.get('fill_percentage')
+    if fill_percentage is None:
+        if fill_level_cm is None:
+            raise ValueError("Reading needs fill_percentage or fill_level_cm.")
+        # Ultrasonic sensor measures the empty space above the garbage
+        max_capacity_cm = capacities[bin_id]
+        if not max_capacity_cm or max_capacity_cm <= 0:
+            raise ValueError(f"Bin '{bin_id}' has no max_capacity_cm; send fill_percentage instead.")
+        fill_percentage = int((max_capacity_cm - min(fill_level_cm, max_capacity_cm)) / max_capacity_cm * 100)
+    fill_percentage = _finite_int(fill_percentage, "fill_percentage")
+    if not 0 <= fill_percentage <= 100:
+        raise ValueError("fill_percentage must be between 0 and 100.")
+
+    is_lid_locked = _as_bool(reading['is_lid_locked']) if 'is_lid_locked' in reading else fill_percentage >= LOCK_THRESHOLD_PERCENT
+    if 'alert_triggered' in reading:
+        alert_triggered = _as_bool(reading['alert_triggered'])
+    else:
+        alert_triggered = _as_bool(reading.get('segregator_required', fill_percentage >= SEGREGATOR_THRESHOLD_PERCENT))
+
+    return (bin_id, timestamp, fill_level_cm, fill_percentage, is_lid_locked, alert_triggered, 0)
+
+
+def _copy_field(value):
+    """Encodes one value for COPY ... FROM STDIN (text format)."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def copy_telemetry_rows(cursor, rows):
+    """Bulk-loads TELEMETRY_COPY_COLUMNS tuples into telemetry with a single COPY."""
+    payload = io.StringIO()
+    for row in rows:
+        payload.write('\t'.join(_copy_field(v) for v in row))
+        payload.write('\n')
+    payload.seek(0)
+    cursor.copy_expert(f"COPY telemetry ({', '.join(TELEMETRY_COPY_COLUMNS)}) FROM STDIN", payload)
+
+
+class TelemetryIngestBuffer:
+    """In-memory buffer of validated readings, drained to PostgreSQL in batches by a background thread."""
+
+    def __init__(self, flush_size, flush_interval, max_buffered):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self._rows = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock() # One flush at a time keeps batches in arrival order
+        self._wakeup = threading.Event()
+        self.stats = {"received": 0, "flushed": 0, "batches": 0, "failed_batches": 0, "dropped": 0,
+                      "rejected_rows": 0, "last_flush_ms": 0.0}
+        threading.Thread(target=self._run, name="telemetry-flusher", daemon=True).start()
+
+    def add(self, rows):
+        """Queues rows for the next flush. Returns False (nothing queued) when the backlog is full."""
+        with self._lock:
+            if len(self._rows) + len(rows) > self.max_buffered:
+                return False
+            self._rows.extend(rows)
+            self.stats["received"] += len(rows)
+            if len(self._rows) >= self.flush_size:
+                self._wakeup.set()
+        return True
+
+    def pending(self):
+        with self._lock:
+            return len(self._rows)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error in telemetry flusher: {e}")
+
+    def flush(self):
+        """Writes everything buffered so far, flush_size rows per COPY. Returns the number of rows written."""
+        written = 0
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+
+            alert_engine = get_alert_engine()
+            conn = get_db_connection()
+            if conn is None:
+                self._requeue(rows)
+                return 0
+            try:
+                cursor = conn.cursor()
+                try:
+                    ensure_telemetry_partitions(cursor, {row[1] for row in rows})
+                    conn.commit()
+                except psycopg2.Error as e:
+                    conn.rollback() # Rows still land in telemetry_default
+                    print(f"Error creating telemetry partitions: {e}")
+                # Stack of batches still to write, next one on top. A batch the database rejects for its data
+                # is split in halves until the offending rows are alone; only those are dropped.
+                pending = [rows[start:start + self.flush_size] for start in range(0, len(rows), self.flush_size)][::-1]
+                while pending:
+                    batch = pending.pop()
+                    started = time.perf_counter()
+                    try:
+                        alerts = alert_engine.evaluate(cursor, batch)
+                        copy_telemetry_rows(cursor, batch)
+                        alert_engine.write(cursor, alerts)
+                        conn.commit()
+                    except psycopg2.Error as e:
+                        conn.rollback()
+                        print(f"❌ Telemetry batch of {len(batch)} rows failed: {e}")
+                        self.stats["failed_batches"] += 1
+                        if isinstance(e, psycopg2.OperationalError):
+                            # Connection trouble: retry everything not yet written
+                            self._requeue(batch + [row for part in reversed(pending) for row in part])
+                            break
+                        if len(batch) == 1:
+                            self.stats["dropped"] += 1 # Bad data: retrying this row would fail again
+                            self.stats["rejected_rows"] += 1
+                        else:
+                            middle = len(batch) // 2
+                            pending += [batch[middle:], batch[:middle]]
+                        continue
+                    alert_engine.apply(alerts)
+                    written += len(batch)
+                    self.stats["flushed"] += len(batch)
+                    self.stats["batches"] += 1
+                    self.stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 2)
+                cursor.close()
+            finally:
+                release_db_connection(conn)
+        return written
+
+    def _requeue(self, rows):
+        """Puts unwritten rows back at the front of the buffer, dropping what no longer fits."""
+        with self._lock:
+            room = max(0, self.max_buffered - len(self._rows))
+            self.stats["dropped"] += max(0, len(rows) - room)
+            self._rows = rows[:room] + self._rows
+
+    def metrics(self):
+        with self._lock:
+            return {"pending": len(self._rows), "flush_size": self.flush_size, "flush_interval": self.flush_interval, **self.stats}
+
+
+_INGEST_BUFFER = None
+_INGEST_PID = None
+_INGEST_LOCK = threading.Lock()
+
+def get_ingest_buffer():
+    """Returns this worker's ingestion buffer, starting its flusher thread on first use."""
+    global _INGEST_BUFFER, _INGEST_PID
+    if _INGEST_BUFFER is not None and _INGEST_PID == os.getpid():
+        return _INGEST_BUFFER
+    with _INGEST_LOCK:
+        if _INGEST_BUFFER is None or _INGEST_PID != os.getpid():
+            _INGEST_BUFFER = TelemetryIngestBuffer(TELEMETRY_FLUSH_SIZE, TELEMETRY_FLUSH_INTERVAL, TELEMETRY_BUFFER_MAX)
+            _INGEST_PID = os.getpid()
+            atexit.register(_INGEST_BUFFER.flush) # Don't lose acknowledged readings on a graceful worker shutdown
+    return _INGEST_BUFFER
+
+@app.route('/api/v1/telemetry/batch', methods=['POST'])
+def ingest_telemetry_batch():
+    """
+    Accepts a JSON array of readings (or {"readings": [...]}) from devices or gateways.
+    Valid readings are acknowledged with 202 and written asynchronously; invalid ones are reported by index.
+    """
+    data = request.get_json(silent=True)
+    readings = data.get('readings') if isinstance(data, dict) else data
+    if not isinstance(readings, list):
+        return jsonify({"success": False, "message": "Body must be a JSON array of readings or {\"readings\": [...]}."}), 400
+    if len(readings) > TELEMETRY_BATCH_MAX:
+        return jsonify({"success": False, "message": f"At most {TELEMETRY_BATCH_MAX} readings per request."}), 413
+
+    registry = get_bin_registry()
+    capacities = registry.capacities()
+    if any(isinstance(r, dict) and isinstance(r.get('bin_id'), str) and r['bin_id'] not in capacities for r in readings):
+        capacities = registry.capacities(force_reload=True) # Pick up bins registered since the last reload
+
+    rows = []
+    errors = []
+    for index, reading in enumerate(readings):
+        try:
+            rows.append(validate_reading(reading, capacities))
+        except (ValueError, TypeError, ArithmeticError) as e:
+            errors.append({"index": index, "message": str(e)})
+
+    if rows and not get_ingest_buffer().add(rows):
+        response = jsonify({"success": False, "message": "Ingestion backlog is full. Retry shortly."})
+        response.headers['Retry-After'] = str(max(1, int(TELEMETRY_FLUSH_INTERVAL)))
+        return response, 503
+
+    return jsonify({
+        "success": bool(rows),
+        "accepted": len(rows),
+        "rejected": len(errors),
+        "errors": errors
+    }), 202 if rows else 400
+
+@app.route('/api/v1/telemetry/ingest/stats', methods=['GET'])
+def get_ingest_stats():
+    """Reports buffered/flushed reading counts for this worker process."""
+    return jsonify({"success": True, "pid": os.getpid(), "ingest": get_ingest_buffer().metrics()}), 200
+
+# --- 5b. TELEMETRY HISTORY (Rollups & Downsampling) ---
+# Chart history for one bin over [start, end] in at most `points` points. Short ranges are served from raw
+# telemetry (LTTB-downsampled when needed); longer ranges from telemetry_rollups at the finest resolution
+# that fits. Minute/hour rollups are purged after ROLLUP_RETENTION_DAYS by the maintenance endpoint.
+
+ROLLUP_RETENTION_DAYS = {
+    'minute': int(os.environ.get('ROLLUP_MINUTE_RETENTION_DAYS', '14')),
+    'hour': int(os.environ.get('ROLLUP_HOUR_RETENTION_DAYS', '400')),
+    'day': 0, # Kept forever
+}
+ROLLUP_SECONDS = {'minute': 60, 'hour': 3600, 'day': 86400}
+HISTORY_DEFAULT_POINTS = 500
+HISTORY_MAX_POINTS = 5000
+HISTORY_RAW_MAX_ROWS = 200000 # Larger raw ranges must use a rollup resolution
+HISTORY_AUTO_RAW_ROWS = 20000 # resolution=auto downsamples raw readings up to this many, else uses rollups
+HISTORY_MAX_COLLECTIONS = 1000
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: indexes of `threshold` points of (x, y) that keep the visual shape of the
+    series. First and last points are always kept; one point is chosen per bucket in between.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    every = (n - 2) / (threshold - 2)
+    edges = (np.floor(np.arange(threshold - 1) * every) + 1).astype(np.int64)
+    edges[-1] = n - 1
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+def purge_expired_rollups(cursor):
+    """Deletes minute/hour rollups older than their retention. Returns {resolution: rows deleted}."""
+    purged = {}
+    for resolution, retention_days in ROLLUP_RETENTION_DAYS.items():
+        if retention_days > 0:
+            cursor.execute("DELETE FROM telemetry_rollups WHERE resolution = %s AND bucket < %s;",
+                           (resolution, datetime.now() - timedelta(days=retention_days)))
+            purged[resolution] = cursor.rowcount
+    return purged
+
+def _parse_history_time(raw, default):
+    if not raw:
+        return default
+    parsed = datetime.fromisoformat(raw.replace('Z', '+00:00'))
+    return parsed.astimezone().replace(tzinfo=None) if parsed.tzinfo else parsed # Stored as naive local time
+
+@app.route('/api/v1/bin/<bin_id>/history', methods=['GET'])
+def get_bin_history(bin_id):
+    """
+    Telemetry and collection history for one bin: ?start=&end= (ISO 8601, default the last 24 h),
+    ?points= (default 500, max 5000) and ?resolution=auto|raw|minute|hour|day (default auto).
+    Raw points are {t, fill, alert}; rollup points are {t, min, max, avg, readings, alerts}.
+    """
+    try:
+        end = _parse_history_time(request.args.get('end'), datetime.now())
+        start = _parse_history_time(request.args.get('start'), end - timedelta(hours=24))
+        points = min(int(request.args.get('points', HISTORY_DEFAULT_POINTS)), HISTORY_MAX_POINTS)
+        resolution = request.args.get('resolution', 'auto')
+        if start >= end or points < 3 or resolution not in ('auto', 'raw', *ROLLUP_SECONDS):
+            raise ValueError
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid start/end (ISO 8601, start < end), points (>= 3) or resolution (auto|raw|minute|hour|day)."}), 400
+
+    _, registry = get_bin_registry().snapshot()
+    if bin_id not in registry:
+        return jsonify({"success": False, "message": f"Bin {bin_id} is not registered."}), 404
+
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({"success": False, "message": "Database connection failed. Check DB variables."}), 500
+
+    try:
+        cursor = conn.cursor()
+        span_seconds = (end - start).total_seconds()
+
+        if resolution in ('auto', 'raw'):
+            # Raw reading count estimated from the day rollups (one short index range scan)
+            cursor.execute("""
+            SELECT COALESCE(sum(readings), 0) FROM telemetry_rollups
+            WHERE bin_id = %s AND resolution = 'day' AND bucket >= date_trunc('day', %s::timestamp) AND bucket <= %s;
+            """, (bin_id, start, end))
+            estimated_raw = cursor.fetchone()[0]
+            if resolution == 'auto':
+                # Raw (LTTB) while that stays cheap, else the finest retained rollup that fits in `points`
+                fitting = [r for r in ROLLUP_SECONDS if span_seconds / ROLLUP_SECONDS[r] <= points
+                           and (ROLLUP_RETENTION_DAYS[r] <= 0 or start >= datetime.now() - timedelta(days=ROLLUP_RETENTION_DAYS[r]))]
+                resolution = 'raw' if estimated_raw <= HISTORY_AUTO_RAW_ROWS else (fitting[0] if fitting else 'day')
+            elif estimated_raw > HISTORY_RAW_MAX_ROWS:
+                return jsonify({"success": False, "message": f"About {estimated_raw} raw readings in range; use a rollup resolution."}), 400
+
+        if resolution == 'raw':
+            cursor.execute("""
+            SELECT timestamp, fill_percentage, alert_triggered FROM telemetry
+            WHERE bin_id = %s AND timestamp >= %s AND timestamp <= %s AND fill_percentage IS NOT NULL
+            ORDER BY timestamp;
+            """, (bin_id, start, end))
+            rows = cursor.fetchall()
+            keep = range(len(rows))
+            if len(rows) > points:
+                x = np.fromiter(((r[0] - start).total_seconds() for r in rows), dtype=np.float64, count=len(rows))
+                y = np.fromiter((r[1] for r in rows), dtype=np.float64, count=len(rows))
+                keep = lttb_indices(x, y, points).tolist()
+            series = [{"t": rows[i][0].isoformat(), "fill": rows[i][1], "alert": bool(rows[i][2])} for i in keep]
+        else:
+            cursor.execute("""
+            SELECT bucket, fill_min, fill_max, fill_sum::float8 / NULLIF(fill_count, 0), readings, alert_count
+            FROM telemetry_rollups
+            WHERE bin_id = %s AND resolution = %s AND bucket >= date_trunc(%s, %s::timestamp) AND bucket <= %s
+            ORDER BY bucket;
+            """, (bin_id, resolution, resolution, start, end))
+            rows = cursor.fetchall()
+            keep = range(len(rows))
+            if len(rows) > points:
+                x = np.fromiter(((r[0] - start).total_seconds() for r in rows), dtype=np.float64, count=len(rows))
+                y = np.array([r[3] if r[3] is not None else np.nan for r in rows], dtype=np.float64)
+                keep = lttb_indices(x, np.nan_to_num(y), points).tolist()
+            series = [{"t": rows[i][0].isoformat(), "min": rows[i][1], "max": rows[i][2],
+                       "avg": round(rows[i][3], 2) if rows[i][3] is not None else None,
+                       "readings": rows[i][4], "alerts": rows[i][5]} for i in keep]
+
+        cursor.execute("""
+        SELECT collection_time, alert_time, time_to_collect_min, is_on_time, reward_issued, collector_id
+        FROM collection_log
+        WHERE bin_id = %s AND collection_time >= %s AND collection_time <= %s
+        ORDER BY collection_time DESC
+        LIMIT %s;
+        """, (bin_id, start, end, HISTORY_MAX_COLLECTIONS + 1))
+        collection_rows = cursor.fetchall()
+        collections = [{
+            "time": collection_time.isoformat(),
+            "alert_time": alert_time.isoformat() if alert_time else None,
+            "delay": time_to_collect_min,
+            "on_time": is_on_time,
+            "reward": reward_issued,
+            "collector_id": collector_id
+        } for collection_time, alert_time, time_to_collect_min, is_on_time, reward_issued, collector_id in reversed(collection_rows[:HISTORY_MAX_COLLECTIONS])]
+
+        return jsonify({
+            "success": True,
+            "bin_id": bin_id,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "resolution": resolution,
+            "source_points": len(rows),
+            "downsampled": len(series) < len(rows),
+            "points": series,
+            "collections": collections,
+            "collections_truncated": len(collection_rows) > HISTORY_MAX_COLLECTIONS
+        }), 200
+
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error fetching history: {e}"}), 500
+    finally:
+        if conn and not conn.closed and 'cursor' in locals():
+            cursor.close()
+        release_db_connection(conn)
+
+# --- 5c. DATA EXPORT (Streaming CSV / NDJSON / Parquet) ---
+# Exports read through server-side (named) cursors EXPORT_FETCH_ROWS at a time and are encoded chunk by chunk,
+# so memory stays flat however many rows match. They run on their own read-only connection rather than a pooled
+# one, and telemetry is read one partition per transaction: locks and snapshots are only held on the partition
+# being read, so partition maintenance and ingest are never queued behind a long export.
+
+EXPORT_FETCH_ROWS = int(os.environ.get('EXPORT_FETCH_ROWS', '10000')) # Rows per FETCH from the server-side cursor
+EXPORT_PARQUET_ROW_GROUP = 100000 # Rows buffered per Parquet row group
+EXPORT_MAX_CONCURRENT = int(os.environ.get('EXPORT_MAX_CONCURRENT', '2')) # Per worker; further exports get 429
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson', 'parquet': 'application/vnd.apache.parquet'}
+
+# Column name -> Parquet type name (pyarrow factory), per dataset
+EXPORT_DATASETS = {
+    'telemetry': {
+        'table': 'telemetry',
+        'columns': [('record_id', 'int64'), ('bin_id', 'string'), ('timestamp', 'timestamp'), ('fill_level_cm', 'int32'),
+                    ('fill_percentage', 'int32'), ('is_lid_locked', 'bool_'), ('alert_triggered', 'bool_'),
+                    ('collection_time', 'timestamp'), ('delay_minutes', 'int32')],
+        'time_column': 'timestamp',
+        'alert_filter': 'alert_triggered = %s',
+        'order_by': None, # Storage order within each partition; partitions are read oldest first
+    },
+    'collections': {
+        'table': 'collection_log',
+        'columns': [('log_id', 'int32'), ('bin_id', 'string'), ('collection_time', 'timestamp'), ('alert_time', 'timestamp'),
+                    ('time_to_collect_min', 'int32'), ('is_on_time', 'bool_'), ('reward_issued', 'bool_'),
+                    ('collector_id', 'string')],
+        'time_column': 'collection_time',
+        'alert_filter': '(alert_time IS NOT NULL) = %s', # Collections that answered an alert
+        'order_by': 'log_id',
+    },
+}
+
+_EXPORT_SLOTS = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+def _telemetry_export_sources(cursor, start, end):
+    """Telemetry partitions overlapping [start, end), oldest first (the default partition last)."""
+    cursor.execute("""
+    SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) FROM pg_inherits
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE pg_inherits.inhparent = 'telemetry'::regclass;
+    """)
+    partitions = []
+    for name, bound in cursor.fetchall():
+        match = re.search(r"FROM \((.+?)\) TO \((.+?)\)", bound or '')
+        if not match: # DEFAULT partition: may hold any timestamp
+            partitions.append((datetime.max, name))
+            continue
+        lower, upper = (datetime.min if value == 'MINVALUE' else datetime.max if value == 'MAXVALUE'
+                        else datetime.fromisoformat(value.strip("'")) for value in match.groups())
+        if (end is None or lower < end) and (start is None or upper > start):
+            partitions.append((lower, name))
+    return [name for _, name in sorted(partitions)] or ['telemetry'] # Unpartitioned table
+
+def iter_export_chunks(conn, dataset, bin_ids=None, start=None, end=None, alert=None):
+    """
+    Yields lists of row tuples (EXPORT_DATASETS[dataset]['columns'] order) matching the filters, at most
+    EXPORT_FETCH_ROWS per list. `start` is inclusive, `end` exclusive. Commits after each source table.
+    """
+    spec = EXPORT_DATASETS[dataset]
+    conditions, params = [], []
+    if bin_ids:
+        conditions.append("bin_id = ANY(%s)")
+        params.append(list(bin_ids))
+    if start is not None:
+        conditions.append(f"{spec['time_column']} >= %s")
+        params.append(start)
+    if end is not None:
+        conditions.append(f"{spec['time_column']} < %s")
+        params.append(end)
+    if alert is not None:
+        conditions.append(spec['alert_filter'])
+        params.append(alert)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    order_by = f" ORDER BY {spec['order_by']}" if spec['order_by'] else ""
+    columns = ', '.join(name for name, _ in spec['columns'])
+
+    if dataset == 'telemetry':
+        catalog = conn.cursor()
+        sources = _telemetry_export_sources(catalog, start, end)
+        catalog.close()
+        conn.commit()
+    else:
+        sources = [spec['table']]
+
+    for source in sources:
+        cursor = conn.cursor(name=f"export_{uuid.uuid4().hex}")
+        try:
+            cursor.execute(f"SELECT {columns} FROM {source}{where}{order_by};", params)
+            while True:
+                rows = cursor.fetchmany(EXPORT_FETCH_ROWS)
+                if not rows:
+                    break
+                METRICS.inc('smartbin_export_rows_total', (('dataset', dataset),), len(rows))
+                yield rows
+        finally:
+            cursor.close()
+            conn.commit() # Ends the snapshot and releases this source's locks before the next one
+
+def _export_json_value(value):
+    return value.isoformat() if isinstance(value, (datetime, date)) else str(value)
+
+class _ChunkSink:
+    """Write-only file object for pyarrow that hands written bytes back to a generator via take()."""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+def encode_export(chunks, dataset, fmt):
+    """Encodes row chunks from iter_export_chunks() as CSV (with header), NDJSON or Parquet; yields bytes."""
+    names = [name for name, _ in EXPORT_DATASETS[dataset]['columns']]
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(names)
+        for rows in chunks:
+            writer.writerows(rows)
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue().encode('utf-8') # Header only, if nothing matched
+    elif fmt == 'ndjson':
+        for rows in chunks:
+            yield ''.join(json.dumps(dict(zip(names, row)), default=_export_json_value) + '\n' for row in rows).encode('utf-8')
+    else:
+        types = [pa.timestamp('us') if kind == 'timestamp' else getattr(pa, kind)() for _, kind in EXPORT_DATASETS[dataset]['columns']]
+        schema = pa.schema(list(zip(names, types)))
+        sink = _ChunkSink()
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema, compression='zstd')
+        pending, pending_rows = [], 0
+        for rows in itertools.chain(chunks, [None]):
+            if rows:
+                pending.extend(rows)
+                pending_rows += len(rows)
+            if pending and (rows is None or pending_rows >= EXPORT_PARQUET_ROW_GROUP):
+                columns = list(zip(*pending))
+                writer.write_table(pa.table([pa.array(column, type=kind) for column, kind in zip(columns, types)], schema=schema))
+                pending, pending_rows = [], 0
+                yield sink.take()
+        writer.close()
+        yield sink.take() # Footer
+
+def open_export_connection():
+    """A dedicated read-only connection for one export (outside the pool, so exports never starve the API)."""
+    conn = _open_raw_connection()
+    conn.set_session(readonly=True)
+    return conn
+
+def _parse_export_bool(raw):
+    if raw is None or raw == '':
+        return None
+    if raw.lower() in ('1', 'true', 'yes'):
+        return True
+    if raw.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError("alert must be true or false.")
+
+@app.route('/api/v1/export/<dataset>', methods=['GET'])
+def export_dataset(dataset):
+    """
+    Streams `telemetry` or `collections` as ?format=csv (default), ndjson or parquet. Filters: ?bin_id= (repeat
+    or comma-separate), ?start= / ?end= (ISO timestamps, end exclusive) and ?alert=true|false (telemetry:
+    alert_triggered; collections: answered an alert). Telemetry rows come partition by partition, unsorted within
+    a partition; collections in log_id order.
+    """
+    fmt = request.args.get('format', 'csv')
+    if dataset not in EXPORT_DATASETS or fmt not in EXPORT_FORMATS:
+        return jsonify({"success": False, "message": f"Unknown dataset or format. Datasets: {', '.join(EXPORT_DATASETS)}; formats: {', '.join(EXPORT_FORMATS)}."}), 400
+    if fmt == 'parquet' and pq is None:
+        return jsonify({"success": False, "message": "Parquet export requires pyarrow on the server."}), 501
+    try:
+        bin_ids = [b.strip() for raw in request.args.getlist('bin_id') for b in raw.split(',') if b.strip()]
+        start = _parse_history_time(request.args.get('start'), None)
+        end = _parse_history_time(request.args.get('end'), None)
+        alert = _parse_export_bool(request.args.get('alert'))
+    except ValueError as e:
+        return jsonify({"success": False, "message": f"Invalid filter: {e}"}), 400
+
+    if not _EXPORT_SLOTS.acquire(blocking=False):
+        return jsonify({"success": False, "message": "Too many exports running; retry later."}), 429
+    try:
+        conn = open_export_connection()
+    except psycopg2.Error as e:
+        _EXPORT_SLOTS.release()
+        print(f"❌ Export connection failed: {e}")
+        return jsonify({"success": False, "message": "Database connection failed. Check DB variables."}), 500
+
+    closed = []
+    def cleanup():
+        if not closed: # Runs once, whether the download finished or the client went away
+            closed.append(True)
             conn.close()
+            _EXPORT_SLOTS.release()
 
+    chunks = iter_export_chunks(conn, dataset, bin_ids, start, end, alert)
+    response = Response(encode_export(chunks, dataset, fmt), mimetype=EXPORT_FORMATS[fmt], headers={
+        'Content-Disposition': f'attachment; filename="{dataset}-{datetime.now():%Y%m%d-%H%M%S}.{fmt}"',
+        'X-Accel-Buffering': 'no'
+    })
+    response.call_on_close(cleanup)
+    return response
 
-# --- 6. VEHICLE SIMULATION LOGIC (RETAINED) ---
+# --- 5d. ALERT ENGINE (Hysteresis & Debounce -> alert_events) ---
+# Telemetry writers run each batch through the AlertEngine in the batch's transaction. Per bin, alert_state holds
+# whether an alert is open and how many consecutive readings crossed the opposite threshold, so a sensor flapping
+# around the threshold opens one alert instead of a storm of them. The engine locks the batch's alert_state rows,
+# and writes them back with the opens and closes for alert_events before the commit. Every worker and the bridge
+# therefore continue the same state, and a rolled-back batch leaves it untouched.
 
-SIMULATED_ROUTE = [
-    (17.4300, 78.4100), 
-    (17.4000, 78.4500), 
-    (17.4450, 78.3950), 
-    (17.3850, 78.4867), 
-    (17.3900, 78.5000) 
-]
+ALERT_OPEN_PERCENT = int(os.environ.get('ALERT_OPEN_PERCENT', str(LOCK_THRESHOLD_PERCENT))) # An alert opens at or above this fill...
+ALERT_CLEAR_PERCENT = int(os.environ.get('ALERT_CLEAR_PERCENT', '75')) # ...and only closes below this one (hysteresis)
+ALERT_DEBOUNCE_READINGS = int(os.environ.get('ALERT_DEBOUNCE_READINGS', '3')) # Consecutive readings needed to open or close
+ALERT_LIST_LIMIT = 1000 # Max alerts per /api/v1/alerts response
+
+# Result of AlertEngine.evaluate(): new per-bin states, [(event, bin_id, moment, fill, peak)] changes and counters
+AlertBatch = collections.namedtuple('AlertBatch', 'states changes readings late suppressed')
+
+# Creates missing rows, then locks the batch's rows in bin_id order (the order every writer uses)
+LOCK_ALERT_STATE_QUERY = """
+INSERT INTO alert_state (bin_id) SELECT unnest(%(bin_ids)s::varchar[]) ORDER BY 1 ON CONFLICT DO NOTHING;
+SELECT bin_id, alerting, streak, streak_started_at, streak_start_fill, last_reading_at, peak_fill
+FROM alert_state WHERE bin_id = ANY(%(bin_ids)s::varchar[]) ORDER BY bin_id FOR UPDATE;
+"""
+
+SAVE_ALERT_STATE_QUERY = """
+UPDATE alert_state AS a SET alerting = v.alerting, streak = v.streak, streak_started_at = v.streak_started_at,
+       streak_start_fill = v.streak_start_fill, last_reading_at = v.last_reading_at, peak_fill = v.peak_fill
+FROM unnest(%s::varchar[], %s::boolean[], %s::integer[], %s::timestamp[], %s::integer[], %s::timestamp[], %s::integer[])
+  AS v (bin_id, alerting, streak, streak_started_at, streak_start_fill, last_reading_at, peak_fill)
+WHERE a.bin_id = v.bin_id;
+"""
+
+class AlertEngine:
+    """
+    Per-bin alert state machine over alert_state rows: (alerting, streak, streak_started_at, streak_start_fill,
+    last_reading_at, peak_fill). An alert opens after `debounce` consecutive readings at or above `open_percent` and
+    closes after as many below `clear_percent`; both are dated from the first reading of the run, and an opened alert
+    records that reading's fill and the run's peak. Readings older than the bin's last evaluated one are ignored.
+    """
+
+    def __init__(self, open_percent, clear_percent, debounce):
+        self.open_percent = open_percent
+        self.clear_percent = min(clear_percent, open_percent)
+        self.debounce = max(1, debounce)
+        self._lock = threading.Lock()
+        self.stats = {"readings": 0, "late": 0, "suppressed": 0, "opened": 0, "closed": 0}
+
+    def evaluate(self, cursor, rows):
+        """
+        Locks the alert_state of the bins in TELEMETRY_COPY_COLUMNS `rows` and runs the rows through the state
+        machine, in the caller's transaction (until it ends, other batches for these bins wait). Returns an
+        AlertBatch for write().
+        """
+        bin_ids = sorted({row[0] for row in rows if row[3] is not None})
+        stored = {}
+        if bin_ids:
+            cursor.execute(LOCK_ALERT_STATE_QUERY, {"bin_ids": bin_ids})
+            stored = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+        states = {}
+        changes = []
+        readings = late = suppressed = 0
+        for bin_id, timestamp, _, fill_percentage, *_ in sorted(rows, key=lambda row: row[1]):
+            if fill_percentage is None:
+                continue
+            readings += 1
+            state = states.get(bin_id) or stored.get(bin_id) or (False, 0, None, None, None, 0)
+            alerting, streak, streak_started_at, streak_start_fill, last_reading_at, peak_fill = state
+            if last_reading_at is not None and timestamp <= last_reading_at:
+                late += 1
+                continue
+            if alerting:
+                peak_fill = max(peak_fill, fill_percentage)
+                crossing = fill_percentage < self.clear_percent
+            else:
+                crossing = fill_percentage >= self.open_percent
+            if not crossing:
+                suppressed += 1 if streak else 0 # A run too short to change state: a flap
+                streak, streak_started_at, streak_start_fill = 0, None, None
+                peak_fill = peak_fill if alerting else 0
+            else:
+                streak += 1
+                if streak_started_at is None:
+                    streak_started_at, streak_start_fill = timestamp, fill_percentage
+                if not alerting:
+                    peak_fill = max(peak_fill, fill_percentage) # Peak of the run that may open an alert
+                if streak >= self.debounce:
+                    if alerting:
+                        changes.append(('close', bin_id, streak_started_at, None, peak_fill))
+                        peak_fill = 0
+                    else:
+                        changes.append(('open', bin_id, streak_started_at, streak_start_fill, peak_fill))
+                    alerting, streak, streak_started_at, streak_start_fill = not alerting, 0, None, None
+            states[bin_id] = (alerting, streak, streak_started_at, streak_start_fill, timestamp, peak_fill)
+        return AlertBatch(states, changes, readings, late, suppressed)
+
+    def write(self, cursor, batch):
+        """Writes the batch's states to alert_state and its opens and closes to alert_events, in the caller's transaction."""
+        if batch.states:
+            columns = zip(*((bin_id,) + state for bin_id, state in batch.states.items()))
+            cursor.execute(SAVE_ALERT_STATE_QUERY, [list(column) for column in columns])
+        for event, bin_id, moment, fill_percentage, peak_fill in batch.changes:
+            if event == 'open':
+                cursor.execute("""
+                INSERT INTO alert_events (bin_id, opened_at, open_fill_percentage, peak_fill_percentage)
+                VALUES (%s, %s, %s, %s) ON CONFLICT (bin_id) WHERE closed_at IS NULL DO NOTHING;
+                """, (bin_id, moment, fill_percentage, peak_fill))
+            else:
+                cursor.execute("""
+                UPDATE alert_events SET closed_at = %s, close_reason = 'recovered',
+                       peak_fill_percentage = GREATEST(peak_fill_percentage, %s)
+                WHERE bin_id = %s AND closed_at IS NULL;
+                """, (moment, peak_fill, bin_id))
+
+    def apply(self, batch):
+        """Counts the batch once its transaction has committed."""
+        with self._lock:
+            self.stats["readings"] += batch.readings
+            self.stats["late"] += batch.late
+            self.stats["suppressed"] += batch.suppressed
+            self.stats["opened"] += sum(1 for change in batch.changes if change[0] == 'open')
+            self.stats["closed"] += sum(1 for change in batch.changes if change[0] == 'close')
+
+    def metrics(self):
+        with self._lock:
+            return {"open_percent": self.open_percent, "clear_percent": self.clear_percent, "debounce": self.debounce,
+                    **self.stats}
+
+
+_ALERT_ENGINE = None
+_ALERT_ENGINE_PID = None
+_ALERT_ENGINE_LOCK = threading.Lock()
+
+def get_alert_engine():
+    """
+    Returns this process's alert engine. On first use (after gunicorn forks) it stores ALERT_OPEN_PERCENT in
+    alert_settings, so the telemetry triggers count with the same threshold.
+    """
+    global _ALERT_ENGINE, _ALERT_ENGINE_PID
+    if _ALERT_ENGINE is not None and _ALERT_ENGINE_PID == os.getpid():
+        return _ALERT_ENGINE
+    with _ALERT_ENGINE_LOCK:
+        if _ALERT_ENGINE is None or _ALERT_ENGINE_PID != os.getpid():
+            engine = AlertEngine(ALERT_OPEN_PERCENT, ALERT_CLEAR_PERCENT, ALERT_DEBOUNCE_READINGS)
+            conn = get_db_connection()
+            if conn is not None:
+                try:
+                    cursor = conn.cursor()
+                    cursor.execute(STORE_ALERT_SETTINGS_QUERY, (engine.open_percent,))
+                    conn.commit()
+                    cursor.close()
+                except psycopg2.Error as e:
+                    conn.rollback()
+                    print(f"⚠️ Warning: Could not store the alert threshold in alert_settings. {e}")
+                finally:
+                    release_db_connection(conn)
+            _ALERT_ENGINE, _ALERT_ENGINE_PID = engine, os.getpid()
+    return _ALERT_ENGINE
+
+@app.route('/api/v1/alerts', methods=['GET'])
+def get_alerts():
+    """
+    Alert episodes from alert_events, newest first: ?status=open (default), closed or all, optional ?bin_id=
+    (repeatable) and ?limit= (max ALERT_LIST_LIMIT).
+    """
+    status = request.args.get('status', 'open')
+    bin_ids = request.args.getlist('bin_id')
+    try:
+        limit = min(int(request.args.get('limit', ALERT_LIST_LIMIT)), ALERT_LIST_LIMIT)
+        if status not in ('open', 'closed', 'all') or limit <= 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({"success": False, "message": "status must be open, closed or all, and limit positive."}), 400
+
+    conditions = {"open": "closed_at IS NULL", "closed": "closed_at IS NOT NULL", "all": "TRUE"}[status]
+    params = []
+    if bin_ids:
+        conditions += " AND bin_id = ANY(%s)"
+        params.append(bin_ids)
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({"success": False, "message": "Database connection failed. Check DB variables."}), 500
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+        SELECT event_id, bin_id, opened_at, open_fill_percentage, peak_fill_percentage, closed_at, close_reason
+        FROM alert_events WHERE {conditions} ORDER BY opened_at DESC LIMIT %s;
+        """, params + [limit])
+        columns = [desc[0] for desc in cursor.description]
+        alerts = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        cursor.close()
+    except psycopg2.Error as e:
+        conn.rollback()
+        return jsonify({"success": False, "message": f"Error fetching alerts: {e}"}), 500
+    finally:
+        release_db_connection(conn)
+    for alert in alerts:
+        for key in ('opened_at', 'closed_at'):
+            alert[key] = alert[key].isoformat() if alert[key] else None
+    return jsonify({"success": True, "alerts": alerts, "count": len(alerts)}), 200
+
+# --- 5e. COLLECTION PERFORMANCE STATS (collection_stats -> Leaderboards) ---
+# collection_stats holds one row per bin / collector and day, kept up to date by a trigger in each collection's
+# transaction. Delays are kept as fixed-bucket histograms (COLLECTION_DELAY_BOUNDS, next to migration 8), which add
+# up across days and rows, so percentiles for any window come from a few small arrays instead of the raw log
+# (accurate to within a bucket).
+
+COLLECTION_STATS_WINDOW_DAYS = int(os.environ.get('COLLECTION_STATS_WINDOW_DAYS', '30')) # Rolling window for ratios and percentiles
+COLLECTION_STATS_LIMIT = 500 # Max rows per /api/v1/collection/stats response
+COLLECTION_STATS_QUANTILES = (0.5, 0.9, 0.99)
+
+# Leaderboard orderings: ?sort= -> (window field, best first when descending)
+COLLECTION_STATS_SORTS = {
+    "on_time_ratio": ("on_time_ratio", True),
+    "collections": ("collections", True),
+    "rewards": ("rewards", True),
+    "delay_p50": ("delay_p50", False),
+    "delay_p90": ("delay_p90", False),
+}
+
+COLLECTION_STATS_QUERY = """
+SELECT subject, sum(collections), sum(on_time), sum(rewards), max(last_collection_at),
+       COALESCE(sum(collections) FILTER (WHERE day >= %(since)s), 0), COALESCE(sum(on_time) FILTER (WHERE day >= %(since)s), 0),
+       COALESCE(sum(rewards) FILTER (WHERE day >= %(since)s), 0), COALESCE(sum(alerted) FILTER (WHERE day >= %(since)s), 0),
+       COALESCE(sum(delay_sum) FILTER (WHERE day >= %(since)s), 0)::BIGINT, max(delay_max) FILTER (WHERE day >= %(since)s),
+       array_agg(delay_buckets) FILTER (WHERE day >= %(since)s)
+FROM collection_stats
+WHERE scope = %(scope)s AND (%(subjects)s::varchar[] IS NULL OR subject = ANY(%(subjects)s))
+GROUP BY subject;
+"""
+
+def histogram_quantiles(counts, quantiles, maximum=None):
+    """
+    Quantiles of a COLLECTION_DELAY_BOUNDS histogram, interpolated linearly inside the bucket that holds them.
+    The open-ended last bucket ends at `maximum` (the largest delay seen). None for an empty histogram.
+    """
+    total = sum(counts)
+    if not total:
+        return [None] * len(quantiles)
+    cumulative = list(itertools.accumulate(counts))
+    uppers = list(COLLECTION_DELAY_BOUNDS[1:]) + [max(maximum or 0, COLLECTION_DELAY_BOUNDS[-1])]
+    results = []
+    for q in quantiles:
+        rank = q * total
+        i = min(bisect.bisect_left(cumulative, rank), len(counts) - 1)
+        below = cumulative[i] - counts[i]
+        fraction = (rank - below) / counts[i] if counts[i] else 0.0
+        value = COLLECTION_DELAY_BOUNDS[i] + fraction * (uppers[i] - COLLECTION_DELAY_BOUNDS[i])
+        results.append(round(min(value, maximum) if maximum is not None else value, 1))
+    return results
+
+def collection_stats_entry(scope, row):
+    """One /api/v1/collection/stats entry: all-time totals plus rolling-window ratios and delay percentiles."""
+    (subject, collections, on_time, rewards, last_collection_at,
+     window_collections, window_on_time, window_rewards, alerted, delay_sum, delay_max, bucket_rows) = row
+    counts = [sum(column) for column in zip(*bucket_rows)] if bucket_rows else [0] * len(COLLECTION_DELAY_BOUNDS)
+    window = {
+        "collections": window_collections,
+        "on_time": window_on_time,
+        "rewards": window_rewards,
+        "on_time_ratio": round(window_on_time / window_collections, 4) if window_collections else None,
+        "alerted": alerted,
+        "delay_mean": round(delay_sum / alerted, 1) if alerted else None,
+        "delay_max": delay_max,
+    }
+    for q, value in zip(COLLECTION_STATS_QUANTILES, histogram_quantiles(counts, COLLECTION_STATS_QUANTILES, delay_max)):
+        window[f"delay_p{int(q * 100)}"] = value
+    return {
+        f"{scope}_id": subject,
+        "collections": collections,
+        "on_time": on_time,
+        "rewards": rewards,
+        "on_time_ratio": round(on_time / collections, 4) if collections else None,
+        "last_collection_at": last_collection_at.isoformat() if last_collection_at else None,
+        "window": window,
+    }
+
+@app.route('/api/v1/collection/stats', methods=['GET'])
+def get_collection_stats():
+    """
+    Collection performance leaderboard from collection_stats (never the raw log). ?scope=collector (default) or
+    bin, optional ?ids=A,B, ?sort= (see COLLECTION_STATS_SORTS), ?window_days= and ?limit=. Ranked on the
+    rolling window; subjects without collections in it sort last.
+    """
+    scope = request.args.get('scope', 'collector')
+    sort = request.args.get('sort', 'on_time_ratio')
+    ids_param = request.args.get('ids', '').strip()
+    subjects = [s.strip() for s in ids_param.split(',') if s.strip()] if ids_param else None
+    try:
+        window_days = int(request.args.get('window_days', COLLECTION_STATS_WINDOW_DAYS))
+        limit = min(int(request.args.get('limit', COLLECTION_STATS_LIMIT)), COLLECTION_STATS_LIMIT)
+        if scope not in ('collector', 'bin') or sort not in COLLECTION_STATS_SORTS or window_days <= 0 or limit <= 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({"success": False, "message": f"scope must be collector or bin, sort one of {sorted(COLLECTION_STATS_SORTS)}, "
+                                                     "and window_days and limit positive."}), 400
+
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({"success": False, "message": "Database connection failed. Check DB variables."}), 500
+    since = date.today() - timedelta(days=window_days - 1)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(COLLECTION_STATS_QUERY, {"scope": scope, "subjects": subjects, "since": since})
+        entries = [collection_stats_entry(scope, row) for row in cursor.fetchall()]
+        cursor.close()
+    except psycopg2.Error as e:
+        conn.rollback()
+        return jsonify({"success": False, "message": f"Error fetching collection stats: {e}"}), 500
+    finally:
+        release_db_connection(conn)
+
+    field, descending = COLLECTION_STATS_SORTS[sort]
+    def sort_key(entry):
+        value = entry["window"][field]
+        return (value is None, -value if descending and value is not None else value or 0, -entry["collections"], entry[f"{scope}_id"])
+    entries.sort(key=sort_key)
+    for rank, entry in enumerate(entries, start=1):
+        entry["rank"] = rank
+    return jsonify({"success": True, "scope": scope, "sort": sort, "window_days": window_days, "since": since.isoformat(),
+                    "stats": entries[:limit], "count": len(entries)}), 200
+
+# --- 6. COLLECTION ROUTE PLANNING ---
+# Bins that are HIGH/CRITICAL now, or predicted to reach 90% within ROUTE_HORIZON_HOURS, are split into
+# capacity-constrained vehicle trips from the depot: nearest-neighbour construction over a precomputed
+# haversine distance matrix, then 2-opt and Or-opt improvement of each trip. The plan is cached per worker.
+
+DEPOT_LATITUDE = float(os.environ.get('DEPOT_LATITUDE', '17.4300'))
+DEPOT_LONGITUDE = float(os.environ.get('DEPOT_LONGITUDE', '78.4100'))
+VEHICLE_CAPACITY = float(os.environ.get('VEHICLE_CAPACITY', '40')) # In full-bin equivalents (a bin at 50% loads 0.5)
+ROUTE_MIN_FILL_PERCENT = 60 # HIGH and CRITICAL bins (see build_analysis_report)
+ROUTE_HORIZON_HOURS = float(os.environ.get('ROUTE_HORIZON_HOURS', '4')) # Also collect bins predicted to hit 90% by then
+ROUTE_REFRESH_SECONDS = float(os.environ.get('ROUTE_REFRESH_SECONDS', '60'))
+ROUTE_TIME_LIMIT = float(os.environ.get('ROUTE_TIME_LIMIT', '3')) # Seconds of improvement per plan
+ROUTE_MAX_STOPS = int(os.environ.get('ROUTE_MAX_STOPS', '1500')) # Most urgent stops planned; bounds the distance matrix
+VEHICLE_STEP_SECONDS = 10 # The simulated vehicle advances one stop this often
+ROUTE_WHATIF_CONCURRENCY = int(os.environ.get('ROUTE_WHATIF_CONCURRENCY', '1')) # Uncached what-if plans at once per worker; more get 429
+
+def haversine_matrix(lats, lons):
+    """Great-circle distances (km) between every pair of points."""
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lon = np.radians(np.asarray(lons, dtype=np.float64))
+    a = (np.sin((lat[:, None] - lat[None, :]) / 2) ** 2
+         + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin((lon[:, None] - lon[None, :]) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def tour_length(dist, tour):
+    tour = np.asarray(tour)
+    return float(dist[tour[:-1], tour[1:]].sum())
+
+def nearest_neighbour_trips(dist, loads, capacity):
+    """
+    Capacity-constrained nearest neighbour. Node 0 is the depot, node i the stop with load loads[i - 1].
+    Returns trips as lists of stop nodes (depot excluded).
+    """
+    unvisited = np.ones(len(loads) + 1, dtype=bool)
+    unvisited[0] = False
+    node_loads = np.concatenate(([0.0], loads))
+    trips = []
+    while unvisited.any():
+        trip, remaining, current = [], capacity, 0
+        while True:
+            candidates = unvisited & (node_loads <= remaining + 1e-9)
+            if not candidates.any():
+                break
+            nxt = int(np.argmin(np.where(candidates, dist[current], np.inf)))
+            trip.append(nxt)
+            unvisited[nxt] = False
+            remaining -= node_loads[nxt]
+            current = nxt
+        if not trip: # A single stop heavier than the vehicle: serve it on its own trip
+            nxt = int(np.flatnonzero(unvisited)[0])
+            trip.append(nxt)
+            unvisited[nxt] = False
+        trips.append(trip)
+    return trips
+
+def two_opt(dist, tour, deadline):
+    """Reverses segments of a closed tour (depot at both ends) while that shortens it. Returns (tour, improved)."""
+    tour = np.array(tour)
+    improved_any = False
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        for i in range(1, len(tour) - 2):
+            js = np.arange(i + 1, len(tour) - 1)
+            a, b = tour[i - 1], tour[i]
+            delta = dist[a, tour[js]] + dist[b, tour[js + 1]] - dist[a, b] - dist[tour[js], tour[js + 1]]
+            best = int(np.argmin(delta))
+            if delta[best] < -1e-9:
+                j = js[best]
+                tour[i:j + 1] = tour[i:j + 1][::-1]
+                improved = improved_any = True
+    return tour, improved_any
+
+def or_opt(dist, tour, deadline, max_segment=3):
+    """Moves segments of 1..max_segment stops (optionally reversed) to their best position in the tour."""
+    tour = np.array(tour)
+    improved_any = False
+    for length in range(1, max_segment + 1):
+        i = 1
+        while i + length <= len(tour) - 1 and time.monotonic() < deadline:
+            segment = tour[i:i + length]
+            first, last = segment[0], segment[-1]
+            before, after = tour[i - 1], tour[i + length]
+            removal_gain = dist[before, first] + dist[last, after] - dist[before, after]
+            rest = np.concatenate((tour[:i], tour[i + length:]))
+            u, v = rest[:-1], rest[1:]
+            forward = dist[u, first] + dist[last, v] - dist[u, v]
+            backward = dist[u, last] + dist[first, v] - dist[u, v]
+            k = int(np.argmin(np.minimum(forward, backward)))
+            if min(forward[k], backward[k]) - removal_gain < -1e-9:
+                moved = segment if forward[k] <= backward[k] else segment[::-1]
+                tour = np.concatenate((rest[:k + 1], moved, rest[k + 1:]))
+                improved_any = True
+            else:
+                i += 1
+    return tour, improved_any
+
+def plan_routes(stops, depot, capacity, time_limit):
+    """
+    Plans capacity-constrained trips. `stops` are dicts with bin_id, latitude, longitude and load;
+    `depot` is (latitude, longitude). Returns (trips as lists of stop indexes, distance matrix, stats).
+    """
+    start = time.monotonic()
+    deadline = start + time_limit
+    dist = haversine_matrix([depot[0]] + [s['latitude'] for s in stops], [depot[1]] + [s['longitude'] for s in stops])
+    loads = np.array([s['load'] for s in stops], dtype=np.float64)
+
+    tours = [np.array([0] + trip + [0]) for trip in nearest_neighbour_trips(dist, loads, capacity)]
+    constructed_km = sum(tour_length(dist, tour) for tour in tours)
+    for index, tour in enumerate(tours):
+        improved = True
+        while improved and time.monotonic() < deadline:
+            tour, improved_2opt = two_opt(dist, tour, deadline)
+            tour, improved_oropt = or_opt(dist, tour, deadline)
+            improved = improved_oropt # 2-opt already ran to a local optimum; repeat only if Or-opt changed the tour
+        tours[index] = tour
+
+    stats = {
+        "constructed_km": round(constructed_km, 3),
+        "optimized_km": round(sum(tour_length(dist, tour) for tour in tours), 3),
+        "compute_seconds": round(time.monotonic() - start, 3),
+        "time_limit_hit": time.monotonic() >= deadline,
+    }
+    return [[int(node) - 1 for node in tour[1:-1]] for tour in tours], dist, stats
+
+def select_collection_stops(fleet, registry, forecasts):
+    """Bins to collect now: fill >= ROUTE_MIN_FILL_PERCENT, or predicted to reach 90% within ROUTE_HORIZON_HOURS."""
+    stops = []
+    for bin_id, _, _, record in fleet:
+        forecast = forecasts.get(bin_id) or {}
+        hours_to_90 = forecast.get("hours_to_90")
+        fill = record['fill_percentage'] or 0
+        if fill < ROUTE_MIN_FILL_PERCENT and (hours_to_90 is None or hours_to_90 > ROUTE_HORIZON_HOURS):
+            continue
+        bin_info = registry[bin_id]
+        stops.append({
+            "bin_id": bin_id,
+            "latitude": float(bin_info['latitude']),
+            "longitude": float(bin_info['longitude']),
+            "fill_percentage": fill,
+            "hours_to_90": hours_to_90,
+            "load": round(min(max(fill, 1), 100) / 100, 3),
+        })
+    # Fullest first, then soonest predicted; only the ROUTE_MAX_STOPS most urgent are planned
+    stops.sort(key=lambda s: (-s['fill_percentage'], s['hours_to_90'] if s['hours_to_90'] is not None else float('inf')))
+    return stops
+
+def compute_collection_plan(depot=None, capacity=None):
+    """Builds a fresh collection plan from the current fleet status and forecasts."""
+    depot = depot or (DEPOT_LATITUDE, DEPOT_LONGITUDE)
+    capacity = capacity or VEHICLE_CAPACITY
+
+    conn = get_db_connection()
+    if conn is None:
+        raise psycopg2.OperationalError("Database connection failed while planning routes.")
+    try:
+        cursor = conn.cursor()
+        fleet = fetch_fleet_status(cursor, int(time.time() * 1000))
+        cursor.close()
+    finally:
+        release_db_connection(conn)
+    _, registry = get_bin_registry().snapshot()
+    try:
+        _, forecasts = get_fill_forecaster().forecasts()
+    except Exception as e:
+        print(f"Route planning without forecasts: {e}")
+        forecasts = {}
+
+    due = select_collection_stops(fleet, registry, forecasts)
+    stops = due[:ROUTE_MAX_STOPS]
+    trips, dist, stats = plan_routes(stops, depot, capacity, ROUTE_TIME_LIMIT) if stops else ([], None, {})
+
+    routes = []
+    for number, trip in enumerate(trips, start=1):
+        nodes = [0] + [index + 1 for index in trip] + [0]
+        legs = dist[nodes[:-1], nodes[1:]]
+        cumulative = np.cumsum(legs).tolist()
+        routes.append({
+            "vehicle_id": f"TRK-A{number:02d}",
+            "stops": [{**stops[index], "cumulative_km": round(cumulative[position], 3)}
+                      for position, index in enumerate(trip)],
+            "load": round(sum(stops[index]['load'] for index in trip), 3),
+            "distance_km": round(float(legs.sum()), 3),
+        })
+
+    return {
+        "depot": {"latitude": depot[0], "longitude": depot[1]},
+        "vehicle_capacity": capacity,
+        "routes": routes,
+        "total_stops": len(stops),
+        "deferred_stops": len(due) - len(stops),
+        "total_distance_km": round(sum(r['distance_km'] for r in routes), 3),
+        "stats": stats,
+        "computed_at": datetime.now().isoformat()
+    }
+
+_ROUTE_PLAN = None
+_ROUTE_PLAN_AT = 0.0
+_ROUTE_PLAN_LOCK = threading.Lock() # Guards the two globals above; never held while planning
+_ROUTE_PLAN_COMPUTE_LOCK = threading.Lock() # One plan computation per worker at a time
+_ROUTE_WHATIF_SLOTS = threading.BoundedSemaphore(max(1, ROUTE_WHATIF_CONCURRENCY))
+
+def get_collection_plan(force_refresh=False):
+    """
+    This worker's cached collection plan, recomputed every ROUTE_REFRESH_SECONDS. One thread computes the new
+    plan outside the cache lock and swaps it in; meanwhile other requests get the previous plan (they only wait
+    when there is none yet, or for ?refresh=1).
+    """
+    global _ROUTE_PLAN, _ROUTE_PLAN_AT
+    requested_at = time.monotonic()
+    with _ROUTE_PLAN_LOCK:
+        plan, plan_at = _ROUTE_PLAN, _ROUTE_PLAN_AT
+    if plan is not None and not force_refresh and requested_at - plan_at < ROUTE_REFRESH_SECONDS:
+        return plan
+    if not _ROUTE_PLAN_COMPUTE_LOCK.acquire(blocking=plan is None or force_refresh):
+        return plan # Another thread is already refreshing it
+    try:
+        with _ROUTE_PLAN_LOCK:
+            if _ROUTE_PLAN is not None and _ROUTE_PLAN_AT >= requested_at:
+                return _ROUTE_PLAN # Computed by another thread while this one waited
+        plan = compute_collection_plan()
+        with _ROUTE_PLAN_LOCK:
+            _ROUTE_PLAN, _ROUTE_PLAN_AT = plan, time.monotonic()
+        return plan
+    finally:
+        _ROUTE_PLAN_COMPUTE_LOCK.release()
 
 def get_simulated_vehicle_route():
-    """Simulates a collection vehicle moving along a fixed route over time."""
-    current_time = time.time()
-    route_index = int(current_time // 10) % len(SIMULATED_ROUTE)
-    current_lat, current_lon = SIMULATED_ROUTE[route_index]
-    route_path = SIMULATED_ROUTE[:route_index + 1]
-    
+    """Simulates the first vehicle driving its planned trip: one stop every VEHICLE_STEP_SECONDS, then back to the depot."""
+    plan = get_collection_plan()
+    depot = (plan['depot']['latitude'], plan['depot']['longitude'])
+    if not plan['routes']:
+        return {
+            "vehicle_id": "TRK-A01",
+            "current_position": {"latitude": depot[0], "longitude": depot[1]},
+            "path_history": [{"latitude": depot[0], "longitude": depot[1]}],
+            "status": "Idle at depot (no bins due for collection)",
+            "timestamp": datetime.now().isoformat()
+        }
+
+    route = plan['routes'][0]
+    waypoints = [depot] + [(s['latitude'], s['longitude']) for s in route['stops']] + [depot]
+    route_index = int(time.time() // VEHICLE_STEP_SECONDS) % len(waypoints)
+    current_lat, current_lon = waypoints[route_index]
+    route_path = waypoints[:route_index + 1]
+
     return {
-        "vehicle_id": "TRK-A01",
+        "vehicle_id": route['vehicle_id'],
         "current_position": {"latitude": current_lat, "longitude": current_lon},
         "path_history": [{"latitude": lat, "longitude": lon} for lat, lon in route_path],
-        "status": "In Service, Route R03",
+        "status": f"In Service, {len(route['stops'])} stops, {route['distance_km']} km",
         "timestamp": datetime.now().isoformat()
     }
 
 @app.route('/api/v1/collection/route', methods=['GET'])
 def get_collection_route():
     """API endpoint to serve the simulated collection vehicle data."""
-    route_data = get_simulated_vehicle_route()
+    try:
+        route_data = get_simulated_vehicle_route()
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error planning collection route: {e}"}), 500
     return jsonify({"success": True, "route": route_data}), 200
 
-# --- 7. RUN SERVER ---
+@app.route('/api/v1/collection/plan', methods=['GET'])
+def get_collection_plan_api():
+    """
+    Full collection plan: one trip per vehicle load, stops in driving order.
+    ?capacity=<bins> and ?depot=<lat>,<lon> compute an uncached what-if plan (at most ROUTE_WHATIF_CONCURRENCY
+    per worker at once, 429 beyond that); ?refresh=1 recomputes the cached one.
+    """
+    try:
+        capacity = float(request.args['capacity']) if 'capacity' in request.args else None
+        depot = tuple(float(v) for v in request.args['depot'].split(',')) if 'depot' in request.args else None
+        if capacity is not None and not (math.isfinite(capacity) and capacity > 0):
+            raise ValueError
+        if depot is not None and (len(depot) != 2 or not all(math.isfinite(v) for v in depot)
+                                  or not (-90 <= depot[0] <= 90 and -180 <= depot[1] <= 180)):
+            raise ValueError
+    except ValueError:
+        return jsonify({"success": False, "message": "capacity must be a positive number and depot '<lat>,<lon>' "
+                                                     "with -90 <= lat <= 90 and -180 <= lon <= 180."}), 400
+
+    try:
+        if capacity is not None or depot is not None:
+            if not _ROUTE_WHATIF_SLOTS.acquire(blocking=False):
+                response = jsonify({"success": False, "message": "A what-if plan is already being computed. Retry shortly."})
+                response.headers['Retry-After'] = str(max(1, math.ceil(ROUTE_TIME_LIMIT)))
+                return response, 429
+            try:
+                plan = compute_collection_plan(depot, capacity)
+            finally:
+                _ROUTE_WHATIF_SLOTS.release()
+        else:
+            plan = get_collection_plan(force_refresh=request.args.get('refresh') == '1')
+    except Exception as e:
+        return jsonify({"success": False, "message": f"Error planning collection routes: {e}"}), 500
+    return jsonify({"success": True, "plan": plan}), 200
+
+# --- 7. LIVE PUSH STREAM (Server-Sent Events) ---
+# One producer thread per worker reads the database once per tick and fans the changes out to every
+# connected dashboard, so the DB cost no longer grows with the number of open operator screens.
+# Under gunicorn gthread every open stream holds one of the worker's --threads for as long as it is open, so
+# each worker accepts at most SSE_MAX_SUBSCRIBERS streams and answers 503 above that (dashboards fall back to
+# polling). For hundreds of viewers serve the stream from asgi.py, where a stream costs no thread.
+
+SSE_HISTORY_SIZE = int(os.environ.get('SSE_HISTORY_SIZE', '1000')) # Events kept for Last-Event-ID resume
+SSE_CLIENT_QUEUE_SIZE = int(os.environ.get('SSE_CLIENT_QUEUE_SIZE', '100')) # Unsent events allowed per client
+SSE_HEARTBEAT_SECONDS = 15
+SSE_MAX_SUBSCRIBERS = int(os.environ.get('SSE_MAX_SUBSCRIBERS', '32')) # Streams per worker; keep well below gunicorn --threads
+SSE_REJECT_RETRY_SECONDS = 30 # Retry-After for streams refused at the cap
+
+def _json_default(value):
+    """json.dumps fallback: ISO strings for dates/datetimes, str() for everything else (e.g. Decimal)."""
+    return value.isoformat() if isinstance(value, (date, datetime)) else str(value)
+
+class StreamSubscriber:
+    """One connected client: a bounded queue of pending events."""
+
+    def __init__(self, max_size):
+        self.events = queue.Queue(maxsize=max_size)
+        self.dropped = 0
+
+    def offer(self, event):
+        """Queues an event without blocking the producer. A client that falls too far behind is told to resync."""
+        try:
+            self.events.put_nowait(event)
+            return True
+        except queue.Full:
+            pass
+        # Slow consumer: throw away its backlog and replace it with a single resync instruction
+        while True:
+            try:
+                self.events.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                break
+        self.events.put_nowait((event[0], "resync", json.dumps({"reason": "client_lagging"})))
+        return False
+
+
+class EventBroker:
+    """Fans published events out to all subscribers and keeps a short history for resuming clients."""
+
+    def __init__(self, history_size, client_queue_size):
+        # Event IDs are "<epoch>-<n>"; the epoch changes per worker process so IDs from another
+        # worker (or from before a restart) are recognised and answered with a resync.
+        self.epoch = f"{os.getpid():x}{int(time.time()):x}"
+        self.client_queue_size = client_queue_size
+        self._history = collections.deque(maxlen=history_size)
+        self._subscribers = set()
+        self._next_seq = 1
+        self._lock = threading.Lock()
+        self.stats = {"published": 0, "lagging_clients": 0, "rejected": 0}
+
+    def publish(self, event_type, data):
+        with self._lock:
+            event = (f"{self.epoch}-{self._next_seq}", event_type, json.dumps(data, default=_json_default))
+            self._next_seq += 1
+            self._history.append(event)
+            self.stats["published"] += 1
+            for subscriber in self._subscribers:
+                if not subscriber.offer(event):
+                    self.stats["lagging_clients"] += 1
+
+    def subscribe(self, last_event_id=None, max_subscribers=None, subscriber=None):
+        """
+        Registers a client (a new StreamSubscriber unless one is passed), replaying anything it missed since
+        `last_event_id` (or asking it to resync). Returns None when `max_subscribers` are already connected.
+        """
+        subscriber = subscriber or StreamSubscriber(self.client_queue_size)
+        with self._lock:
+            if max_subscribers is not None and len(self._subscribers) >= max_subscribers:
+                self.stats["rejected"] += 1
+                return None
+            if last_event_id:
+                missed = self._events_after(last_event_id)
+                if missed is None or len(missed) >= self.client_queue_size:
+                    current_id = self._history[-1][0] if self._history else f"{self.epoch}-0"
+                    subscriber.offer((current_id, "resync", json.dumps({"reason": "history_unavailable"})))
+                else:
+                    for event in missed:
+                        subscriber.offer(event)
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _events_after(self, last_event_id):
+        """Events newer than `last_event_id`, or None if that ID is not from this broker's retained history."""
+        epoch, _, seq = last_event_id.rpartition('-')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        if seq >= self._next_seq:
+            return None
+        oldest_seq = self._next_seq - len(self._history)
+        if seq < oldest_seq - 1:
+            return None
+        return list(self._history)[seq - oldest_seq + 1:]
+
+    def metrics(self):
+        with self._lock:
+            return {"subscribers": len(self._subscribers), "history": len(self._history), **self.stats}
+
+
+class StreamProducer(threading.Thread):
+    """
+    Background thread that detects fill/lock changes, new bins, new collection logs and vehicle moves
+    once per simulation tick and publishes them to the broker. Idle (no DB reads) while nobody is subscribed.
+    """
+
+    def __init__(self, broker):
+        super().__init__(name="sse-producer", daemon=True)
+        self.broker = broker
+        self.last_telemetry = {} # bin_id -> (fill_percentage, is_lid_locked, alert_triggered)
+        self.registry_version = None
+        self.last_log_id = None
+        self.last_vehicle_position = None
+
+    def run(self):
+        while True:
+            time.sleep(SIMULATION_TICK_MS / 1000 - (time.time() * 1000 % SIMULATION_TICK_MS) / 1000)
+            if self.broker.subscriber_count() == 0:
+                continue
+            try:
+                self.poll_once()
+            except Exception as e:
+                print(f"Error in live stream producer: {e}")
+
+    def poll_once(self):
+        conn = get_db_connection()
+        if conn is None:
+            return
+        try:
+            cursor = conn.cursor()
+            current_time_ms = int(time.time() * 1000)
+            state_cursor = read_state_cursor(cursor)
+            fleet = fetch_fleet_status(cursor, current_time_ms)
+            if self.last_log_id is None:
+                cursor.execute("SELECT COALESCE(MAX(log_id), 0) FROM collection_log;")
+                self.last_log_id = cursor.fetchone()[0]
+            cursor.execute("""
+            SELECT log_id, bin_id, collection_time, time_to_collect_min, is_on_time, reward_issued, collector_id
+            FROM collection_log WHERE log_id > %s ORDER BY log_id;
+            """, (self.last_log_id,))
+            columns = [desc[0] for desc in cursor.description]
+            new_logs = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            cursor.close()
+        finally:
+            release_db_connection(conn)
+
+        # 1. Newly registered bins
+        version = max((registry_seq for _, registry_seq, _, _ in fleet), default=0)
+        if self.registry_version is not None and version > self.registry_version:
+            new_bins = [bin_id for bin_id, registry_seq, _, _ in fleet if registry_seq > self.registry_version]
+            self.broker.publish("bins", {"bin_ids": new_bins, "cursor": version})
+        self.registry_version = version
+
+        # 2. Fill / lock / alert changes
+        changed = []
+        current_state = {}
+        for bin_id, _, _, record in fleet:
+            state = (record['fill_percentage'], record['is_lid_locked'], record['alert_triggered'])
+            current_state[bin_id] = state
+            if self.last_telemetry.get(bin_id) != state:
+                changed.append(record)
+        self.last_telemetry = current_state
+        if changed:
+            tick = current_time_ms // SIMULATION_TICK_MS
+            self.broker.publish("telemetry", {"latest_data": changed, "cursor": telemetry_cursor(version, tick, state_cursor)})
+
+        # 3. New collection logs (from any worker)
+        for log in new_logs:
+            self.broker.publish("collection", log)
+            self.last_log_id = log['log_id']
+
+        # 4. Vehicle position
+        route = get_simulated_vehicle_route()
+        if route['current_position'] != self.last_vehicle_position:
+            self.last_vehicle_position = route['current_position']
+            self.broker.publish("vehicle", route)
+
+
+_STREAM_BROKER = None
+_STREAM_PID = None
+_STREAM_LOCK = threading.Lock()
+
+def get_stream_broker():
+    """Returns this worker's broker, starting its producer thread on first use (after gunicorn forks)."""
+    global _STREAM_BROKER, _STREAM_PID
+    if _STREAM_BROKER is not None and _STREAM_PID == os.getpid():
+        return _STREAM_BROKER
+    with _STREAM_LOCK:
+        if _STREAM_BROKER is None or _STREAM_PID != os.getpid():
+            _STREAM_BROKER = EventBroker(SSE_HISTORY_SIZE, SSE_CLIENT_QUEUE_SIZE)
+            _STREAM_PID = os.getpid()
+            StreamProducer(_STREAM_BROKER).start()
+    return _STREAM_BROKER
+
+def format_sse(event):
+    event_id, event_type, data = event
+    return f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n"
+
+@app.route('/api/v1/stream/telemetry', methods=['GET'])
+def stream_telemetry():
+    """
+    Server-Sent Events stream of fill/lock changes ("telemetry"), new bins ("bins"), collection logs
+    ("collection") and vehicle positions ("vehicle"). Reconnecting clients resume from Last-Event-ID;
+    clients that cannot be caught up receive a "resync" event and should refetch the REST snapshot.
+    Above SSE_MAX_SUBSCRIBERS streams in this worker the request gets a 503 with Retry-After.
+    """
+    broker = get_stream_broker()
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    subscriber = broker.subscribe(last_event_id, max_subscribers=SSE_MAX_SUBSCRIBERS)
+    if subscriber is None:
+        return Response(f"retry: {SSE_REJECT_RETRY_SECONDS * 1000}\n\n", status=503, mimetype='text/event-stream',
+                        headers={'Retry-After': str(SSE_REJECT_RETRY_SECONDS), 'Cache-Control': 'no-cache'})
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = subscriber.events.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": heartbeat\n\n" # Keeps proxies from closing idle streams
+                    continue
+                yield format_sse(event)
+        finally:
+            broker.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no' # Disable proxy buffering so events are delivered immediately
+    })
+
+@app.route('/api/v1/stream/stats', methods=['GET'])
+def get_stream_stats():
+    """Reports connected stream clients and event counts for this worker process."""
+    return jsonify({"success": True, "pid": os.getpid(), "stream": get_stream_broker().metrics()}), 200
+
+# --- 8. RUN SERVER ---
 if __name__ == '__main__':
+    # `python app.py migrate` applies pending schema migrations (e.g. as a deploy/release step) and exits
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrate':
+        result, status = initialize_database()
+        print(result)
+        sys.exit(0 if status == 200 else 1)
+
     # NOTE: If running locally, you must have the required DB variables in a .env file
     print("-------------------------------------------------------")
     print("Flask Server running at: http://127.0.0.1:5000/")
-    # You can uncomment this line and run the schema setup locally once:
-    # print(initialize_database()) 
+    # Schema setup: run `python app.py migrate` once, or POST /api/v1/init_db
     print("-------------------------------------------------------")
     # For production deployment (Render), we typically rely on gunicorn
     app.run(debug=True, port=5000)
@@ -0,0 +1,309 @@
+"""
+Async serving mode for the Smart Bin API: the dashboard endpoints of app.py on an event loop with an async
+PostgreSQL pool (psycopg 3), so a slow query or a long-lived client no longer ties up a worker thread.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000 --workers 4
+
+Serves, with the same URLs, JSON bodies, ETags, ?since= cursors, columnar format and compression as app.py:
+
+    GET  /api/v1/bins/registered
+    GET  /api/v1/telemetry/latest
+    GET  /api/v1/bin/analysis/<bin_id>
+    POST /api/v1/log_collection
+    GET  /api/v1/collection/route
+    GET  /api/v1/stream/telemetry   (Server-Sent Events; an open stream costs no thread here)
+
+Every other endpoint stays on the Flask app (gunicorn, see Procfile). Database settings come from the same DB_*
+variables. The bin registry cache, fill forecaster and route planner are app.py's per-process caches: reading them
+is cheap, and when one needs a refresh it runs in a worker thread so the event loop never blocks on psycopg2.
+"""
+import asyncio
+import os
+import queue
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.http import parse_etags
+
+import app as smart_bin
+
+# --- 1. CONFIGURATION ---
+
+ASYNC_DB_POOL_MIN = int(os.environ.get('ASYNC_DB_POOL_MIN', '2'))
+ASYNC_DB_POOL_MAX = int(os.environ.get('ASYNC_DB_POOL_MAX', '20')) # Concurrent queries per process, not concurrent requests
+ASYNC_DB_POOL_TIMEOUT = float(os.environ.get('ASYNC_DB_POOL_TIMEOUT', str(smart_bin.DB_POOL_TIMEOUT)))
+ASGI_SSE_MAX_SUBSCRIBERS = int(os.environ.get('ASGI_SSE_MAX_SUBSCRIBERS', '2000')) # Streams per process (memory, not threads)
+
+POOL = AsyncConnectionPool(
+    make_conninfo(dbname=smart_bin.DB_NAME, user=smart_bin.DB_USER, password=smart_bin.DB_PASSWORD,
+                  host=smart_bin.DB_HOST, port=smart_bin.DB_PORT, sslmode=smart_bin.DB_SSLMODE),
+    min_size=ASYNC_DB_POOL_MIN, max_size=ASYNC_DB_POOL_MAX, timeout=ASYNC_DB_POOL_TIMEOUT,
+    max_lifetime=smart_bin.DB_POOL_MAX_LIFETIME, open=False
+)
+
+# --- 2. RESPONSE HELPERS ---
+# Bodies are encoded by app.py's JSON provider, so both modes return byte-identical JSON.
+
+def encoded_response(request, body, media_type, status=200, etag=None, encoding=None):
+    """
+    Response for an encoded body. Bodies not compressed yet (encoding=None) are compressed as app.py's
+    compress_response() does: 200s above RESPONSE_COMPRESS_MIN_BYTES, with the best encoding the client accepts.
+    """
+    headers = {}
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+        headers['Vary'] = 'Accept-Encoding'
+    elif status == 200 and len(body) >= smart_bin.RESPONSE_COMPRESS_MIN_BYTES:
+        headers['Vary'] = 'Accept-Encoding'
+        encoding = smart_bin.negotiate_encoding(request.headers.get('accept-encoding'))
+        if encoding is not None:
+            body = smart_bin.compress_body(body, encoding)
+            headers['Content-Encoding'] = encoding
+    if etag is not None:
+        headers['ETag'] = f'"{smart_bin.representation_etag(etag, encoding)}"'
+        headers['Cache-Control'] = 'no-cache' # Always revalidate, never serve stale fleet data
+    return Response(body, status_code=status, media_type=media_type, headers=headers)
+
+def json_response(request, payload, status=200, etag=None):
+    body = smart_bin.app.json.dumps(payload, separators=(",", ":")) + "\n" # Compact, as Flask's jsonify
+    return encoded_response(request, body.encode(), 'application/json', status, etag)
+
+async def columnar_response(request, etag, build, cache=True):
+    """Async smart_bin.columnar_response(): encoding (and any compression) runs in a worker thread."""
+    held = client_has(request, etag)
+    if held:
+        return not_modified(held)
+    encoding = smart_bin.negotiate_encoding(request.headers.get('accept-encoding'))
+    body = await run_in_threadpool(smart_bin.encoded_body, etag if cache else None, encoding, build)
+    return encoded_response(request, body, smart_bin.COLUMNAR_MIMETYPE, etag=etag, encoding=encoding)
+
+def wants_columnar(request):
+    return smart_bin.wants_columnar(request.query_params.get('format'), request.headers.get('accept'))
+
+def not_modified(etag):
+    return Response(status_code=304, headers={'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'})
+
+def client_has(request, etag):
+    """The representation of `etag` the client's If-None-Match holds (smart_bin.held_etag()), or None."""
+    return smart_bin.held_etag(parse_etags(request.headers.get('if-none-match')), etag)
+
+async def registry_snapshot():
+    return await run_in_threadpool(smart_bin.get_bin_registry().snapshot)
+
+async def fetch_fleet_state(conn, registry, bin_ids=None):
+    """
+    Async half of smart_bin.fetch_fleet_status(): returns (registry rows, bin_latest_state rows, state cursor),
+    the cursor read first as in smart_bin.read_state_cursor().
+    """
+    bins, query, params = smart_bin.fleet_state_query(registry, bin_ids)
+    async with conn.cursor() as cursor:
+        await cursor.execute(smart_bin.STATE_CURSOR_QUERY)
+        state_cursor = (await cursor.fetchone())[0]
+        await cursor.execute(query, params)
+        return bins, await cursor.fetchall(), state_cursor
+
+# --- 3. ENDPOINTS ---
+
+async def get_registered_bins(request):
+    """Async /api/v1/bins/registered (served from the registry cache)."""
+    try:
+        since = smart_bin.parse_since_cursor(request.query_params.get('since'))
+    except ValueError as e:
+        return json_response(request, {"success": False, "message": str(e)}, 400)
+
+    columnar = wants_columnar(request)
+
+    try:
+        version, registry = await registry_snapshot()
+        etag = f"bins-{version}-columnar" if columnar else f"bins-{version}"
+        held = client_has(request, etag)
+        if held or (since is not None and since >= version):
+            return not_modified(held or etag)
+        if columnar:
+            return await columnar_response(request, etag, lambda: smart_bin.registered_bins_columns(version, registry, since), cache=since is None)
+        payload = await run_in_threadpool(smart_bin.registered_bins_payload, version, registry, since)
+        return json_response(request, payload, etag=etag)
+    except Exception as e:
+        return json_response(request, {"success": False, "message": f"Error fetching bins: {e}"}, 500)
+
+async def get_latest_telemetry(request):
+    """Async /api/v1/telemetry/latest."""
+    try:
+        since = smart_bin.parse_since_cursor(request.query_params.get('since'), parts=3)
+    except ValueError as e:
+        return json_response(request, {"success": False, "message": str(e)}, 400)
+
+    current_time_ms = int(time.time() * 1000)
+    try:
+        _, registry = await registry_snapshot() # Before checking out a connection, so none is held while waiting
+        async with POOL.connection() as conn:
+            bins, rows, state_cursor = await fetch_fleet_state(conn, registry)
+    except Exception as e:
+        print(f"Error fetching fleet status from PostgreSQL: {e}")
+        return json_response(request, {"success": False, "message": "Could not retrieve registered bin list."}, 500)
+
+    if wants_columnar(request):
+        etag, build_columns = await run_in_threadpool(smart_bin.latest_telemetry_columns, bins, rows, current_time_ms, since, state_cursor)
+        if since is None or client_has(request, etag):
+            return await columnar_response(request, etag, build_columns)
+        payload = await run_in_threadpool(build_columns)
+        if payload is None:
+            return not_modified(etag)
+        return await columnar_response(request, etag, lambda: payload, cache=False)
+
+    def build():
+        fleet = smart_bin.build_fleet_status(bins, rows, current_time_ms)
+        return smart_bin.latest_telemetry_payload(fleet, current_time_ms, since, state_cursor)
+
+    payload, etag = await run_in_threadpool(build) # Fleet-sized: keep the CPU work off the event loop
+    held = client_has(request, etag)
+    if payload is None or held:
+        return not_modified(held or etag)
+    return json_response(request, payload, etag=etag)
+
+async def get_bin_analysis(request):
+    """Async /api/v1/bin/analysis/<bin_id>."""
+    bin_id = request.path_params['bin_id']
+    try:
+        _, registry = await registry_snapshot()
+        async with POOL.connection() as conn:
+            current_time_ms = int(time.time() * 1000)
+            bins, rows, _ = await fetch_fleet_state(conn, registry, bin_ids=[bin_id])
+            fleet = smart_bin.build_fleet_status(bins, rows, current_time_ms)
+            if not fleet:
+                return json_response(request, {"success": False, "message": f"Telemetry data not found for bin {bin_id}."}, 404)
+            current_fill = fleet[0][3]['fill_percentage']
+
+            async with conn.cursor() as cursor:
+                await cursor.execute(smart_bin.COLLECTION_HISTORY_QUERY, (bin_id, smart_bin.COLLECTION_HISTORY_LIMIT))
+                columns = [desc[0] for desc in cursor.description]
+                history = [dict(zip(columns, row)) for row in await cursor.fetchall()]
+                await cursor.execute(smart_bin.COLLECTION_TOTALS_QUERY, ([bin_id],))
+                totals = {row[0]: (row[1], row[2]) for row in await cursor.fetchall()}.get(bin_id, (0, 0))
+
+        _, forecasts = await run_in_threadpool(smart_bin.get_fill_forecaster().forecasts)
+        analysis_report = smart_bin.build_analysis_report(bin_id, current_fill, history, forecasts.get(bin_id), totals)
+        return json_response(request, {"success": True, "analysis": analysis_report})
+    except Exception as e:
+        return json_response(request, {"success": False, "message": f"Error generating analysis: {e}"}, 500)
+
+async def log_collection(request):
+    """Async /api/v1/log_collection."""
+    try:
+        data = await request.json()
+    except ValueError:
+        return json_response(request, {"success": False, "message": "Body must be JSON."}, 400)
+    bin_id = data.get('bin_id') if isinstance(data, dict) else None
+    if not bin_id:
+        return json_response(request, {"success": False, "message": "Missing bin_id."}, 400)
+    collector_id = data.get('collector_id') or smart_bin.DEFAULT_COLLECTOR_ID
+    if not isinstance(collector_id, str) or len(collector_id) > 10:
+        return json_response(request, {"success": False, "message": "collector_id must be a string of at most 10 characters."}, 400)
+
+    try:
+        async with POOL.connection() as conn: # Commits on success, rolls back on error
+            async with conn.cursor() as cursor:
+                collection_time = datetime.now()
+                await cursor.execute(smart_bin.RESOLVE_ALERT_QUERY, {"bin_id": bin_id, "collection_time": collection_time})
+                row = await cursor.fetchone()
+                alert_time = row[0] if row else None
+                time_to_collect_min, is_on_time, reward_issued = smart_bin.collection_outcome(collection_time, alert_time)
+                await cursor.execute(smart_bin.COLLECTION_INSERT_QUERY, (
+                    bin_id, collection_time, alert_time, time_to_collect_min, is_on_time, reward_issued, collector_id
+                ))
+    except Exception as e:
+        return json_response(request, {"success": False, "message": f"Error logging collection: {e}"}, 500)
+
+    return json_response(request, {
+        "success": True,
+        "message": f"Collection logged successfully for {bin_id}. Time to clear: {time_to_collect_min} min. Reward issued: {reward_issued}",
+        "reward_issued": reward_issued
+    })
+
+async def get_collection_route(request):
+    """Async /api/v1/collection/route (the plan is recomputed in a worker thread when due)."""
+    try:
+        route_data = await run_in_threadpool(smart_bin.get_simulated_vehicle_route)
+    except Exception as e:
+        return json_response(request, {"success": False, "message": f"Error planning collection route: {e}"}, 500)
+    return json_response(request, {"success": True, "route": route_data})
+
+class AsyncStreamSubscriber(smart_bin.StreamSubscriber):
+    """StreamSubscriber that wakes its event-loop task when an event is queued (offer() runs on the producer thread)."""
+
+    def __init__(self, max_size, loop):
+        super().__init__(max_size)
+        self.loop = loop
+        self.wakeup = asyncio.Event()
+
+    def offer(self, event):
+        queued = super().offer(event)
+        self.loop.call_soon_threadsafe(self.wakeup.set)
+        return queued
+
+async def stream_telemetry(request):
+    """Async /api/v1/stream/telemetry: same events, resume and resync as app.py, fed by this process's producer."""
+    broker = smart_bin.get_stream_broker()
+    last_event_id = request.headers.get('last-event-id') or request.query_params.get('last_event_id')
+    subscriber = broker.subscribe(last_event_id, ASGI_SSE_MAX_SUBSCRIBERS,
+                                  AsyncStreamSubscriber(smart_bin.SSE_CLIENT_QUEUE_SIZE, asyncio.get_running_loop()))
+    if subscriber is None:
+        retry = smart_bin.SSE_REJECT_RETRY_SECONDS
+        return Response(f"retry: {retry * 1000}\n\n", status_code=503, media_type='text/event-stream',
+                        headers={'Retry-After': str(retry), 'Cache-Control': 'no-cache'})
+
+    async def generate():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    await asyncio.wait_for(subscriber.wakeup.wait(), smart_bin.SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n" # Keeps proxies from closing idle streams
+                    continue
+                subscriber.wakeup.clear()
+                while True:
+                    try:
+                        event = subscriber.events.get_nowait()
+                    except queue.Empty:
+                        break
+                    yield smart_bin.format_sse(event)
+        finally:
+            broker.unsubscribe(subscriber)
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no' # Disable proxy buffering so events are delivered immediately
+    })
+
+async def get_stream_stats(request):
+    """Async /api/v1/stream/stats for this process."""
+    return json_response(request, {"success": True, "pid": os.getpid(), "stream": smart_bin.get_stream_broker().metrics()})
+
+# --- 4. APPLICATION ---
+
+@asynccontextmanager
+async def lifespan(application):
+    await POOL.open(wait=False) # Don't refuse to start while the database is briefly unreachable
+    print(f"✅ Async pool opened ({ASYNC_DB_POOL_MIN}-{ASYNC_DB_POOL_MAX} connections, pid {os.getpid()})")
+    try:
+        yield
+    finally:
+        await POOL.close()
+
+app = Starlette(lifespan=lifespan, routes=[
+    Route('/api/v1/bins/registered', get_registered_bins, methods=['GET']),
+    Route('/api/v1/telemetry/latest', get_latest_telemetry, methods=['GET']),
+    Route('/api/v1/bin/analysis/{bin_id}', get_bin_analysis, methods=['GET']),
+    Route('/api/v1/log_collection', log_collection, methods=['POST']),
+    Route('/api/v1/collection/route', get_collection_route, methods=['GET']),
+    Route('/api/v1/stream/telemetry', stream_telemetry, methods=['GET']),
+    Route('/api/v1/stream/stats', get_stream_stats, methods=['GET']),
+])
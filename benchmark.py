@@ -0,0 +1,412 @@
+"""
+Load-test / benchmark harness for the Smart Bin API (app.py) against a local PostgreSQL.
+
+    python benchmark.py seed --bins 1000 --telemetry 500000 --collections 20000
+    python benchmark.py run --requests 2000 --concurrency 16
+    python benchmark.py run --save-baseline          # record benchmarks/baseline.json
+    python benchmark.py run --url http://127.0.0.1:5000 --concurrency 64
+    python benchmark.py clean
+
+Database settings come from the same DB_* variables as app.py (use DB_SSLMODE=disable for a local server).
+By default requests go through Flask's test client in this process; with --url it drives a running server over
+HTTP instead. SQL statements per request are read from the Server-Timing header app.py adds to every response.
+Seeded bins use the "BN-" prefix and bins registered during a run the "BR-" prefix, so `clean` only removes
+benchmark data.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import app as smart_bin
+
+# --- 1. CONFIGURATION ---
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'baseline.json')
+SEED_PREFIX = 'BN-'
+REGISTER_PREFIX = 'BR-'
+COLLECTOR_ID = SEED_PREFIX + 'COL' # Credited with benchmark collections, so they stay off the real leaderboards
+SEED_BATCH_SIZE = 50000 # Rows per COPY while seeding
+
+# Relative mix of the endpoints driven by `run` (weights, not percentages)
+DEFAULT_MIX = {
+    'telemetry_latest': 50,
+    'bin_analysis': 30,
+    'log_collection': 15,
+    'register_bin': 5,
+}
+# Endpoints served by both the Flask app and the async mode (asgi.py), for sync-vs-async comparisons (--mix async)
+ASYNC_MIX = {
+    'telemetry_latest': 40,
+    'bin_analysis': 30,
+    'log_collection': 15,
+    'bins_registered': 10,
+    'collection_route': 5,
+}
+ENDPOINTS = ('telemetry_latest', 'bin_analysis', 'log_collection', 'register_bin', 'bins_registered', 'collection_route')
+
+# A regression is flagged when p95 latency or queries/request grow by more than this fraction over the baseline
+DEFAULT_TOLERANCE = 0.25
+
+# --- 2. QUERY COUNTING ---
+# app.py reports the SQL statements each request ran in its Server-Timing header ('db;desc="N queries";dur=...').
+
+_SERVER_TIMING_QUERIES = re.compile(r'db;desc="(\d+) queries"')
+
+def queries_from_server_timing(header):
+    match = _SERVER_TIMING_QUERIES.search(header or '')
+    return int(match.group(1)) if match else None
+
+# --- 3. SEEDING ---
+
+def seed_bin_id(i):
+    return f"{SEED_PREFIX}{i:06d}"
+
+def _copy(cursor, table, columns, rows):
+    """COPYs an iterable of tuples into `table` (same text encoding as the ingest path)."""
+    payload = io.StringIO()
+    for row in rows:
+        payload.write('\t'.join(smart_bin._copy_field(v) for v in row))
+        payload.write('\n')
+    payload.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", payload)
+
+def seed(bins, telemetry_rows, collection_rows, days, rng):
+    result, status = smart_bin.initialize_database()
+    if status != 200:
+        print(f"❌ Migrations failed: {result['message']}")
+        return False
+
+    conn = smart_bin._open_raw_connection()
+    try:
+        cursor = conn.cursor()
+        clean_benchmark_data(cursor)
+
+        start = time.perf_counter()
+        capacities = {seed_bin_id(i): rng.choice((80, 100, 120, 150)) for i in range(bins)}
+        _copy(cursor, 'dustbins',
+              ('bin_id', 'latitude', 'longitude', 'supervisor_name', 'location_name', 'bin_type', 'max_capacity_cm', 'installation_date'),
+              ((bin_id, round(17.30 + rng.random() * 0.2, 6), round(78.40 + rng.random() * 0.2, 6), 'Benchmark',
+                f"Zone {i % 50}", 'General', capacity, date.today() - timedelta(days=days))
+               for i, (bin_id, capacity) in enumerate(capacities.items())))
+        conn.commit()
+        print(f"✅ Seeded {bins} bins in {time.perf_counter() - start:.2f}s")
+
+        now = datetime.now()
+        oldest = now - timedelta(days=days)
+        smart_bin.ensure_telemetry_partitions(cursor, [oldest + timedelta(days=d) for d in range(days + 1)])
+        conn.commit()
+
+        start = time.perf_counter()
+        bin_ids = list(capacities)
+        span = (now - oldest).total_seconds()
+        written = 0
+        while written < telemetry_rows:
+            batch = min(SEED_BATCH_SIZE, telemetry_rows - written)
+            rows = []
+            for n in range(written, written + batch):
+                bin_id = bin_ids[n % len(bin_ids)]
+                fill_percentage = rng.randint(0, 100)
+                fill_level_cm = round(capacities[bin_id] * (1 - fill_percentage / 100))
+                is_full = fill_percentage >= smart_bin.LOCK_THRESHOLD_PERCENT
+                rows.append((bin_id, oldest + timedelta(seconds=span * n / telemetry_rows), fill_level_cm,
+                             fill_percentage, is_full, is_full, 0))
+            smart_bin.copy_telemetry_rows(cursor, rows)
+            conn.commit()
+            written += batch
+        print(f"✅ Seeded {telemetry_rows} telemetry rows in {time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        rows = []
+        for n in range(collection_rows):
+            collection_time = oldest + timedelta(seconds=span * n / max(collection_rows, 1))
+            delay = rng.randint(5, 300)
+            on_time = delay <= 180
+            rows.append((bin_ids[rng.randrange(len(bin_ids))], collection_time, collection_time - timedelta(minutes=delay),
+                         delay, on_time, on_time, COLLECTOR_ID))
+        _copy(cursor, 'collection_log',
+              ('bin_id', 'collection_time', 'alert_time', 'time_to_collect_min', 'is_on_time', 'reward_issued', 'collector_id'),
+              rows)
+        conn.commit()
+        print(f"✅ Seeded {collection_rows} collection rows in {time.perf_counter() - start:.2f}s")
+
+        cursor.execute("ANALYZE dustbins; ANALYZE telemetry; ANALYZE collection_log; ANALYZE bin_latest_state;")
+        conn.commit()
+        cursor.close()
+        return True
+    finally:
+        conn.close()
+
+def clean_benchmark_data(cursor, prefixes=(SEED_PREFIX, REGISTER_PREFIX)):
+    """
+    Deletes benchmark bins and everything derived from them by bin_id prefix: rollups, alerts, collection stats
+    (per bin and for COLLECTOR_ID), collections, telemetry and latest state, then the bins themselves.
+    """
+    for prefix in prefixes:
+        pattern = prefix + '%'
+        for table in ('telemetry_rollups', 'alert_events', 'alert_state'):
+            cursor.execute(f"DELETE FROM {table} WHERE bin_id LIKE %s;", (pattern,))
+        cursor.execute("DELETE FROM collection_stats WHERE subject LIKE %s;", (pattern,)) # Bins and COLLECTOR_ID
+        for table in ('collection_log', 'telemetry', 'bin_latest_state', 'dustbins'):
+            cursor.execute(f"DELETE FROM {table} WHERE bin_id LIKE %s;", (pattern,))
+    cursor.connection.commit()
+
+# --- 4. LOAD GENERATION ---
+
+class InProcessClient:
+    """Drives app.py through Flask's test client (one per thread)."""
+    mode = 'in-process'
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = smart_bin.app.test_client()
+        response = client.open(path, method=method, json=body)
+        return response.status_code, queries_from_server_timing(response.headers.get('Server-Timing'))
+
+class HTTPClient:
+    """Drives a running server over HTTP (keep-alive session per thread)."""
+    mode = 'http'
+
+    def __init__(self, base_url):
+        import requests
+        self._requests = requests
+        self.base_url = base_url.rstrip('/')
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        response = session.request(method, self.base_url + path, json=body, timeout=60)
+        return response.status_code, queries_from_server_timing(response.headers.get('Server-Timing'))
+
+def build_requests(total, mix, bin_ids, rng):
+    """Pre-generates the (endpoint, method, path, body) sequence so generation cost is not measured."""
+    endpoints = list(mix)
+    weights = [mix[name] for name in endpoints]
+    run_tag = rng.randrange(256) # Two hex digits: "BR-" + 2 + 5 digits fits VARCHAR(10)
+    plan = []
+    for n in range(total):
+        name = rng.choices(endpoints, weights)[0]
+        if name == 'telemetry_latest':
+            plan.append((name, 'GET', '/api/v1/telemetry/latest', None))
+        elif name == 'bin_analysis':
+            plan.append((name, 'GET', f"/api/v1/bin/analysis/{rng.choice(bin_ids)}", None))
+        elif name == 'log_collection':
+            plan.append((name, 'POST', '/api/v1/log_collection', {"bin_id": rng.choice(bin_ids), "collector_id": COLLECTOR_ID}))
+        elif name == 'bins_registered':
+            plan.append((name, 'GET', '/api/v1/bins/registered', None))
+        elif name == 'collection_route':
+            plan.append((name, 'GET', '/api/v1/collection/route', None))
+        elif name == 'register_bin':
+            bin_id = f"{REGISTER_PREFIX}{run_tag:02x}{n:05d}"[:10]
+            plan.append((name, 'POST', '/api/v1/register_bin', {
+                "bin_id": bin_id, "latitude": 17.4, "longitude": 78.5, "supervisor_name": "Benchmark",
+                "location_name": "Benchmark", "max_capacity_cm": 100}))
+    return plan
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+def summarize(samples, elapsed):
+    """samples: [(endpoint, status, latency_s, queries)] -> per-endpoint and overall stats."""
+    groups = {}
+    for sample in samples:
+        groups.setdefault(sample[0], []).append(sample)
+    groups['ALL'] = samples
+
+    report = {}
+    for name, group in groups.items():
+        latencies = sorted(s[2] * 1000 for s in group)
+        queries = [s[3] for s in group if s[3] is not None]
+        report[name] = {
+            "requests": len(group),
+            "errors": sum(1 for s in group if s[1] >= 400 or s[1] == 0),
+            "throughput_rps": round(len(group) / elapsed, 1) if elapsed else None,
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+        }
+    return report
+
+def run(client, total, concurrency, mix, warmup, rng):
+    conn = smart_bin._open_raw_connection()
+    try:
+        cursor = conn.cursor()
+        clean_benchmark_data(cursor, prefixes=(REGISTER_PREFIX,))
+        cursor.execute("SELECT bin_id FROM dustbins WHERE bin_id LIKE %s ORDER BY bin_id;", (SEED_PREFIX + '%',))
+        bin_ids = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+    finally:
+        conn.close()
+    if not bin_ids:
+        print("❌ No benchmark bins found. Run `python benchmark.py seed` first.")
+        return None
+
+    def execute(item):
+        name, method, path, body = item
+        start = time.perf_counter()
+        try:
+            status, queries = client.request(method, path, body)
+        except Exception as e:
+            print(f"❌ {method} {path} failed: {e}")
+            status, queries = 0, None
+        return name, status, time.perf_counter() - start, queries
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # Warm-up: fills the connection pool and caches without being measured
+        list(pool.map(execute, build_requests(warmup, {k: v for k, v in mix.items() if k != 'register_bin'}, bin_ids, rng)))
+        plan = build_requests(total, mix, bin_ids, rng)
+        start = time.perf_counter()
+        samples = list(pool.map(execute, plan))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "recorded_at": datetime.now().isoformat(timespec='seconds'),
+        "mode": client.mode,
+        "bins": len(bin_ids),
+        "requests": total,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "endpoints": summarize(samples, elapsed),
+    }
+
+# --- 5. REPORTING & BASELINES ---
+
+def print_report(result):
+    print(f"\n{result['requests']} requests, concurrency {result['concurrency']}, {result['bins']} bins, "
+          f"{result['mode']} mode, {result['elapsed_s']}s")
+    header = f"{'endpoint':<18}{'reqs':>7}{'errors':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}"
+    print(header)
+    print('-' * len(header))
+    for name, stats in result['endpoints'].items():
+        queries = '-' if stats['queries_per_request'] is None else stats['queries_per_request']
+        print(f"{name:<18}{stats['requests']:>7}{stats['errors']:>8}{stats['throughput_rps']:>9}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}{queries:>9}")
+
+def compare_to_baseline(result, baseline, tolerance):
+    """Returns a list of human-readable regressions (empty when within tolerance)."""
+    regressions = []
+    for name, stats in result['endpoints'].items():
+        base = baseline.get('endpoints', {}).get(name)
+        if not base:
+            continue
+        for metric in ('p95_ms', 'queries_per_request'):
+            old, new = base.get(metric), stats.get(metric)
+            if old is None or new is None:
+                continue
+            if new > old * (1 + tolerance) and new - old > (0.5 if metric == 'queries_per_request' else 1.0):
+                regressions.append(f"{name} {metric}: {old} -> {new} (+{(new / old - 1) * 100 if old else 100:.0f}%)")
+        if stats['errors'] > base.get('errors', 0):
+            regressions.append(f"{name} errors: {base.get('errors', 0)} -> {stats['errors']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Smart Bin API load test")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = sub.add_parser('seed', help="Apply migrations and load benchmark data")
+    seed_parser.add_argument('--bins', type=int, default=1000)
+    seed_parser.add_argument('--telemetry', type=int, default=200000)
+    seed_parser.add_argument('--collections', type=int, default=10000)
+    seed_parser.add_argument('--days', type=int, default=7, help="Spread seeded history over this many days")
+    seed_parser.add_argument('--seed', type=int, default=42)
+
+    run_parser = sub.add_parser('run', help="Drive the endpoints and report latency/throughput")
+    run_parser.add_argument('--requests', type=int, default=2000)
+    run_parser.add_argument('--concurrency', type=int, default=16)
+    run_parser.add_argument('--warmup', type=int, default=100)
+    run_parser.add_argument('--url', help="Benchmark a running server instead of the in-process app")
+    run_parser.add_argument('--mix', help="Endpoint weights, e.g. telemetry_latest=50,bin_analysis=30, or 'async'")
+    run_parser.add_argument('--baseline', default=BASELINE_FILE)
+    run_parser.add_argument('--save-baseline', action='store_true', help="Store this run as the new baseline")
+    run_parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    run_parser.add_argument('--output', help="Also write the full result JSON here")
+    run_parser.add_argument('--seed', type=int, default=42)
+
+    sub.add_parser('clean', help="Delete all benchmark bins and their data")
+
+    args = parser.parse_args()
+    rng = random.Random(getattr(args, 'seed', 42))
+
+    if args.command == 'seed':
+        return 0 if seed(args.bins, args.telemetry, args.collections, args.days, rng) else 1
+
+    if args.command == 'clean':
+        conn = smart_bin._open_raw_connection()
+        try:
+            clean_benchmark_data(conn.cursor())
+        finally:
+            conn.close()
+        print("✅ Benchmark data removed.")
+        return 0
+
+    mix = dict(DEFAULT_MIX)
+    if args.mix == 'async':
+        mix = dict(ASYNC_MIX)
+    elif args.mix:
+        mix = {}
+        for part in args.mix.split(','):
+            name, _, weight = part.partition('=')
+            if name not in ENDPOINTS:
+                parser.error(f"Unknown endpoint '{name}' (choose from {', '.join(ENDPOINTS)})")
+            mix[name] = float(weight or 1)
+
+    if args.url:
+        client = HTTPClient(args.url)
+    else:
+        client = InProcessClient()
+
+    result = run(client, args.requests, args.concurrency, mix, args.warmup, rng)
+    if result is None:
+        return 1
+    print_report(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(result, f, indent=2)
+            f.write('\n')
+        print(f"\n✅ Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to record one.")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if (baseline.get('mode'), baseline.get('concurrency')) != (result['mode'], result['concurrency']):
+        print(f"\nNOTE: baseline was recorded in {baseline.get('mode')} mode at concurrency {baseline.get('concurrency')}.")
+    regressions = compare_to_baseline(result, baseline, args.tolerance)
+    if regressions:
+        print(f"\n❌ Regressions against baseline ({baseline.get('recorded_at')}):")
+        for line in regressions:
+            print(f"   {line}")
+        return 1
+    print(f"\n✅ Within {args.tolerance * 100:.0f}% of baseline ({baseline.get('recorded_at')}).")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
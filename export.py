@@ -0,0 +1,57 @@
+"""
+Command-line export of telemetry and collection logs, streamed from PostgreSQL in constant memory.
+
+    python export.py telemetry --format parquet --start 2026-10-01 --end 2026-11-01 -o october.parquet
+    python export.py telemetry --format ndjson --bin BIN-001 --bin BIN-002 --alert true > alerts.ndjson
+    python export.py collections --format csv -o collections.csv
+
+Database settings come from the same DB_* variables as app.py (point them at a read replica to keep exports off
+the primary). Uses the same server-side cursor streaming as GET /api/v1/export/<dataset>.
+"""
+import argparse
+import sys
+import time
+
+import app as smart_bin
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream Smart Bin data out of PostgreSQL")
+    parser.add_argument('dataset', choices=sorted(smart_bin.EXPORT_DATASETS))
+    parser.add_argument('--format', choices=sorted(smart_bin.EXPORT_FORMATS), default='csv')
+    parser.add_argument('--bin', action='append', dest='bin_ids', help="Only this bin (repeatable)")
+    parser.add_argument('--start', help="ISO timestamp, inclusive")
+    parser.add_argument('--end', help="ISO timestamp, exclusive")
+    parser.add_argument('--alert', help="true/false: only alert (or non-alert) rows")
+    parser.add_argument('-o', '--output', help="Output file (default: stdout)")
+    args = parser.parse_args()
+
+    if args.format == 'parquet' and smart_bin.pq is None:
+        parser.error("Parquet export requires pyarrow (pip install pyarrow).")
+    if args.format == 'parquet' and not args.output:
+        parser.error("Parquet export needs --output.")
+    try:
+        start = smart_bin._parse_history_time(args.start, None)
+        end = smart_bin._parse_history_time(args.end, None)
+        alert = smart_bin._parse_export_bool(args.alert)
+    except ValueError as e:
+        parser.error(str(e))
+
+    conn = smart_bin.open_export_connection()
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    started = time.perf_counter()
+    written = 0
+    try:
+        chunks = smart_bin.iter_export_chunks(conn, args.dataset, args.bin_ids, start, end, alert)
+        for data in smart_bin.encode_export(chunks, args.dataset, args.format):
+            out.write(data)
+            written += len(data)
+    finally:
+        conn.close()
+        if args.output:
+            out.close()
+    print(f"✅ Exported {args.dataset} ({written / 1e6:.1f} MB) in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,25 @@
-import firebase_admin
-from firebase_admin import credentials, db # Use db instead of realtime_db for brevity
-import mysql.connector
+try:
+    import firebase_admin
+    from firebase_admin import credentials, db # Use db instead of realtime_db for brevity
+except ImportError:
+    firebase_admin = None # Only the local RTDB stand-in (--fake) is available
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import argparse
+import copy
+import threading
 import time
 import random
 import json
+import queue
+
+import numpy as np # Vectorized fill calculation for large simulated fleets
+import psycopg2
+import app as smart_bin # Shares app.py's connection pool, registry cache and telemetry COPY path
 
 # --- 1. CONFIGURATION ---
 
-# MySQL Settings (MUST match the config in app.py)
-DB_CONFIG = {
-    "host": "localhost",
-    "user": "root",        
-    "password": "TeChAzSuRe786", # Your specified password
-    "database": "smart_waste_db"
-}
+# PostgreSQL settings come from the same DB_* environment variables as app.py
 
 # Firebase Admin SDK Configuration (Requires a JSON Service Account File)
 # 1. Download your service account JSON file from Firebase Console.
@@ -22,50 +27,204 @@ DB_CONFIG = {
 SERVICE_ACCOUNT_FILE = "service.json" # <--- MUST BE EDITED
 FIREBASE_URL = "https://smart-garbage-b38f0-default-rtdb.asia-southeast1.firebasedatabase.app/" # Replace with your project URL
 
-# Initialize Firebase Admin SDK
-try:
-    CRED = credentials.Certificate(SERVICE_ACCOUNT_FILE)
-    FIREBASE_APP = firebase_admin.initialize_app(CRED, {
-        'databaseURL': FIREBASE_URL
-    })
-    FIREBASE_DB = db
-except Exception as e:
-    print(f"❌ FIREBASE ADMIN SDK SETUP FAILED. Ensure '{SERVICE_ACCOUNT_FILE}' is correct and the URL is set. Error: {e}")
-    pass
-
-# Global variable for MySQL connection
-conn = None
-# Bin IDs to Simulate (MUST be registered in MySQL)
-BIN_IDS_TO_SIMULATE = ["BIN-001", "BIN-002", "BIN-003", "BIN-004", "BIN-005", "BIN-006"]
+BRIDGE_INTERVAL_SECONDS = 5 # One simulate + bridge cycle per interval (the sleep shrinks by the cycle's own duration)
+BRIDGE_READ_MODE = 'parent' # 'parent': one read of the whole device tree; 'parallel': one read per bin, concurrently
+BRIDGE_READ_WORKERS = 16 # Concurrent reads in 'parallel' mode
+FAKE_RTDB_LATENCY = 0.05 # Seconds per call of the local RTDB stand-in (roughly one HTTPS round trip)
 
-# --- 2. MYSQL CONNECTION AND HELPERS ---
+# Listener mode (--listen): RTDB change events instead of polling
+BRIDGE_LISTEN_PATH = '/' # Parent of the dustbin-XXX nodes
+BRIDGE_QUEUE_MAX = 50000 # Changed readings waiting for the writer; the listener blocks when it is full
+BRIDGE_QUEUE_PUT_TIMEOUT = 5 # ...for at most this long per event, then its remaining readings are dropped and a full resync scheduled
+BRIDGE_BATCH_MAX = 5000 # Readings per COPY
+BRIDGE_FLUSH_SECONDS = 0.2 # Writer waits at most this long to fill a batch
+BRIDGE_RECONNECT_MAX_SECONDS = 30 # Reconnect backoff doubles from 1 s up to this
 
-def get_db_connection():
-    """Establishes and returns a new MySQL database connection."""
-    try:
-        conn = mysql.connector.connect(
-            host=DB_CONFIG["host"], user=DB_CONFIG["user"], password=DB_CONFIG["password"],
-            database=DB_CONFIG["database"], auth_plugin='mysql_native_password' 
-        )
-        return conn
-    except mysql.connector.Error as err:
-        print(f"❌ Error connecting to MySQL: {err}")
-        return None
+FIREBASE_DB = None
+# Bin IDs to Simulate (MUST be registered in PostgreSQL); --bins N simulates N registered bins instead
+BIN_IDS_TO_SIMULATE = ["BIN-001", "BIN-002", "BIN-003", "BIN-004", "BIN-005", "BIN-006"]
+DEFAULT_CAPACITY_CM = 200 # Used for simulated bins that are not registered
+SIMULATION_VERBOSE_BINS = 20 # Log every push up to this many bins, otherwise one line per cycle
 
-def get_bin_max_capacity(bin_id, cursor):
-    """Retrieves the bin's max capacity from the Dustbins table (needed for % calculation)."""
-    conn = get_db_connection()
-    if conn is None: return None
+def init_firebase():
+    """Initializes the Firebase Admin SDK. Returns the db module, or None when it is unavailable."""
+    if firebase_admin is None:
+        print("❌ FIREBASE ADMIN SDK NOT INSTALLED. Run with --fake to use the local RTDB stand-in.")
+        return None
     try:
-        cursor = conn.cursor()
-        query = "SELECT max_capacity_cm FROM Dustbins WHERE bin_id = %s;"
-        cursor.execute(query, (bin_id,))
-        result = cursor.fetchone()
-        return result[0] if result else None
-    except Exception:
+        cred = credentials.Certificate(SERVICE_ACCOUNT_FILE)
+        firebase_admin.initialize_app(cred, {
+            'databaseURL': FIREBASE_URL
+        })
+        return db
+    except Exception as e:
+        print(f"❌ FIREBASE ADMIN SDK SETUP FAILED. Ensure '{SERVICE_ACCOUNT_FILE}' is correct and the URL is set. Error: {e}")
         return None
-    finally:
-        if conn and conn.is_connected(): conn.close()
+
+def firebase_node_name(bin_id):
+    """RTDB node of a bin, as written by the ESP32: BIN-003 -> dustbin-003."""
+    return f'dustbin-{bin_id.split("-")[-1]}'
+
+# --- 1a. LOCAL RTDB STAND-IN ---
+
+class FakeEvent:
+    """Same fields as firebase_admin.db.Event."""
+
+    def __init__(self, event_type, path, data):
+        self.event_type = event_type
+        self.path = path
+        self.data = data
+
+
+class FakeListenerRegistration:
+    """Delivers events to a listen() callback on its own thread, like firebase_admin.db.ListenerRegistration."""
+
+    def __init__(self, path, callback):
+        self.path = path
+        self._callback = callback
+        self._events = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="fake-rtdb-listener", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            self._callback(event)
+
+    def deliver(self, event):
+        self._events.put(event)
+
+    def close(self):
+        self._events.put(None)
+
+
+class FakeReference:
+    """The subset of firebase_admin.db.Reference used here: child(), get(), set(), update() and listen()."""
+
+    def __init__(self, database, path):
+        self._database = database
+        self.path = '/' + '/'.join(part for part in path.split('/') if part)
+
+    @property
+    def _parts(self):
+        return [part for part in self.path.split('/') if part]
+
+    def child(self, path):
+        return FakeReference(self._database, f"{self.path}/{path}")
+
+    def get(self, shallow=False):
+        self._database._round_trip()
+        with self._database._lock:
+            node = self._database._lookup(self._parts)
+            if shallow and isinstance(node, dict):
+                return {key: True for key in node}
+            return copy.deepcopy(node)
+
+    def set(self, value):
+        self._database._round_trip()
+        with self._database._lock:
+            self._database._store(self._parts, value)
+        self._database._notify('put', self.path, value)
+
+    def update(self, value):
+        self._database._round_trip()
+        with self._database._lock:
+            for key, child_value in value.items():
+                self._database._store(self._parts + [part for part in key.split('/') if part], child_value)
+        self._database._notify('patch', self.path, value)
+
+    def listen(self, callback):
+        """Calls callback(event) with a 'put' of the current value, then once per change at or below this path."""
+        self._database._round_trip()
+        registration = FakeListenerRegistration(self.path, callback)
+        with self._database._lock:
+            registration.deliver(FakeEvent('put', '/', copy.deepcopy(self._database._lookup(self._parts))))
+            self._database._listeners.append(registration)
+        return registration
+
+
+class FakeRealtimeDatabase:
+    """
+    In-memory stand-in for firebase_admin.db with the same reference() API and a fixed per-call latency,
+    so the bridge can be exercised and timed without a Firebase project.
+    """
+
+    def __init__(self, latency=FAKE_RTDB_LATENCY):
+        self.latency = latency
+        self._root = {}
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.calls = 0
+
+    def _round_trip(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def reference(self, path='/'):
+        return FakeReference(self, path)
+
+    def _lookup(self, parts):
+        node = self._root
+        for part in parts:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def _store(self, parts, value):
+        if not parts:
+            self._root = copy.deepcopy(value) if isinstance(value, dict) else {}
+            return
+        node = self._root
+        for part in parts[:-1]:
+            if not isinstance(node.get(part), dict):
+                node[part] = {}
+            node = node[part]
+        if value is None:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = copy.deepcopy(value)
+
+    def _notify(self, event_type, path, data):
+        """Sends a change at `path` to every listener at or above it (or the listener's subtree if below it)."""
+        with self._lock:
+            listeners = [registration for registration in self._listeners if registration._thread.is_alive()]
+            self._listeners = listeners
+            for registration in listeners:
+                base = registration.path.rstrip('/')
+                if path == base or path.startswith(base + '/'):
+                    registration.deliver(FakeEvent(event_type, path[len(base):] or '/', copy.deepcopy(data)))
+                elif base.startswith(path.rstrip('/') + '/'):
+                    subtree = self._lookup([part for part in base.split('/') if part])
+                    registration.deliver(FakeEvent('put', '/', copy.deepcopy(subtree)))
+
+    def drop_listeners(self):
+        """Simulates a dropped connection: every active listener stops receiving events."""
+        with self._lock:
+            listeners, self._listeners = self._listeners, []
+        for registration in listeners:
+            registration.close()
+
+# --- 2. POSTGRESQL CONNECTION AND HELPERS ---
+
+def get_db_connection():
+    """Checks a connection out of app.py's pool (release it with smart_bin.release_db_connection)."""
+    return smart_bin.get_db_connection()
+
+def get_bin_capacities():
+    """
+    {bin_id: max_capacity_cm} from app.py's registry cache: loaded with one query, then reloaded every
+    REGISTRY_CACHE_TTL seconds or as soon as a bin is registered (LISTEN/NOTIFY), not once per reading.
+    """
+    return smart_bin.get_bin_registry().capacities()
+
+def get_bin_max_capacity(bin_id):
+    """Retrieves the bin's max capacity (needed for % calculation), or None if it is not registered."""
+    return get_bin_capacities().get(bin_id)
 
 def calculate_fill_percentage(max_capacity_cm, fill_level_cm):
     """Calculates the fill percentage (0-100)."""
@@ -76,148 +235,420 @@ def calculate_fill_percentage(max_capacity_cm, fill_level_cm):
     percentage = (fill_amount_cm / max_capacity_cm) * 100
     return min(100, max(0, int(percentage)))
 
+def calculate_fill_percentages(max_capacities_cm, fill_levels_cm):
+    """calculate_fill_percentage() for whole arrays of bins at once (same truncation and clamping)."""
+    max_capacities_cm = np.asarray(max_capacities_cm, dtype=np.float64)
+    fill_levels_cm = np.minimum(np.asarray(fill_levels_cm, dtype=np.float64), max_capacities_cm)
+    percentages = np.divide(max_capacities_cm - fill_levels_cm, max_capacities_cm,
+                            out=np.zeros_like(max_capacities_cm), where=max_capacities_cm > 0) * 100 # No capacity reads as 0%
+    percentages = np.clip(np.trunc(percentages), 0, 100).astype(np.int64)
+    return np.where(fill_levels_cm < 0, 0, percentages)
+
 # --- 3. CORE SIMULATION AND PUSH LOGIC (ESP32 Simulation) ---
 
+_UNREGISTERED_WARNED = set()
+
 def simulate_and_push_to_firebase(bin_levels):
-    """Simulates the ESP32 pushing data directly to Firebase RTDB."""
-    for bin_id, current_level in bin_levels.items():
-        # 1. Simulate changing sensor level
-        new_level = current_level - random.randint(-1, 5)
-        new_level = max(10, min(new_level, 200))
-        bin_levels[bin_id] = new_level
-        
-        # 2. Calculate Edge Logic for Segregator Requirement (98% threshold)
-        
-        # --- FIX FOR NONETYPE ERROR ---
-        max_cap = get_bin_max_capacity(bin_id, None)
-        
-        if max_cap is None:
-            max_cap_safe = 200
-            print(f"⚠️ Warning: Bin {bin_id} not found in MySQL or DB error. Using default capacity of {max_cap_safe}cm for simulation.")
-        else:
-            max_cap_safe = max_cap
-        # --- END FIX ---
-
-        fill_percentage = calculate_fill_percentage(max_cap_safe, new_level)
-        segregator_required = 1 if fill_percentage >= 98 else 0
-
-        # 3. Build Payload (What the ESP32 would send)
-        payload = {
-            "garbage_level_cm": new_level,
-            "fill_percentage": fill_percentage, 
-            "segregator_required": segregator_required,
-            "timestamp": datetime.now().isoformat(),
+    """
+    Simulates the ESP32s pushing data to Firebase RTDB. All bins are stepped and evaluated in one vectorized
+    pass and pushed with a single multi-path update of the device tree.
+    """
+    bin_ids = list(bin_levels)
+    if not bin_ids:
+        return bin_levels
+
+    # 1. Simulate changing sensor levels
+    levels = np.fromiter(bin_levels.values(), dtype=np.int64, count=len(bin_ids))
+    levels = np.clip(levels - np.random.randint(-1, 6, size=len(bin_ids)), 10, 200)
+    bin_levels = dict(zip(bin_ids, levels.tolist()))
+
+    # 2. Calculate Edge Logic for Segregator Requirement (98% threshold)
+    capacities = get_bin_capacities()
+    missing = [bin_id for bin_id in bin_ids if bin_id not in capacities and bin_id not in _UNREGISTERED_WARNED]
+    if missing:
+        _UNREGISTERED_WARNED.update(missing)
+        print(f"⚠️ Warning: {len(missing)} bins not found in PostgreSQL (e.g. {missing[0]}). Using default capacity of {DEFAULT_CAPACITY_CM}cm for simulation.")
+    max_caps = np.fromiter((capacities.get(bin_id, DEFAULT_CAPACITY_CM) for bin_id in bin_ids), dtype=np.int64, count=len(bin_ids))
+    fill_percentages = calculate_fill_percentages(max_caps, levels).tolist()
+
+    # 3. Build Payloads (What the ESP32s would send), keyed by /dustbin-XXX/latest
+    timestamp = datetime.now().isoformat()
+    updates = {}
+    for bin_id, level, fill_percentage in zip(bin_ids, bin_levels.values(), fill_percentages):
+        updates[f"{firebase_node_name(bin_id)}/latest"] = {
+            "garbage_level_cm": level,
+            "fill_percentage": fill_percentage,
+            "segregator_required": 1 if fill_percentage >= 98 else 0,
+            "timestamp": timestamp,
         }
-        
-        # 4. Push to Firebase RTDB under /dustbin-XXX node
-        path = f'dustbin-{bin_id.split("-")[-1]}' 
-        
-        if 'FIREBASE_DB' in globals():
-            try:
-                # firebase-admin syntax: reference().set()
-                FIREBASE_DB.reference(path).child("latest").set(payload)
-                print(f"[FIREBASE PUSH] Bin: {bin_id} | Fill: {fill_percentage}% | Segregator: {segregator_required}")
-            except Exception as e:
-                 print(f"❌ FIREBASE WRITE FAILED for {bin_id}: {e}")
-        else:
-            print("❌ FIREBASE NOT CONNECTED. Skipping data push.")
+
+    # 4. Push to Firebase RTDB in one round trip
+    if FIREBASE_DB is not None:
+        try:
+            # firebase-admin syntax: multi-path reference().update()
+            FIREBASE_DB.reference('/').update(updates)
+            if len(bin_ids) <= SIMULATION_VERBOSE_BINS:
+                for bin_id, payload in zip(bin_ids, updates.values()):
+                    print(f"[FIREBASE PUSH] Bin: {bin_id} | Fill: {payload['fill_percentage']}% | Segregator: {payload['segregator_required']}")
+            else:
+                print(f"[FIREBASE PUSH] {len(bin_ids)} bins | Segregator required: {sum(p['segregator_required'] for p in updates.values())}")
+        except Exception as e:
+             print(f"❌ FIREBASE WRITE FAILED for {len(bin_ids)} bins: {e}")
+    else:
+        print("❌ FIREBASE NOT CONNECTED. Skipping data push.")
 
     return bin_levels
 
-# --- 4. FIREBASE TO MYSQL BRIDGE LOGIC ---
+# --- 4. FIREBASE TO POSTGRESQL BRIDGE LOGIC ---
 
-def bridge_firebase_to_mysql():
-    """Reads all 'latest' data from Firebase and pushes it into the MySQL Telemetry table."""
-    conn = get_db_connection()
-    if conn is None: return
+class FirebaseBridge:
+    """
+    Copies new 'latest' readings from the RTDB device tree into telemetry. Each cycle reads the tree in one call
+    (or every registered bin's node concurrently), skips readings whose timestamp was already bridged, checks
+    bins against app.py's cached registry instead of querying per bin, and writes the batch with one COPY and
+    one commit.
+    """
 
-    for bin_id in BIN_IDS_TO_SIMULATE:
-        path = f'dustbin-{bin_id.split("-")[-1]}/latest'
-        
-        # 1. Read data from Firebase (firebase-admin syntax)
-        if 'FIREBASE_DB' not in globals():
-            print("❌ FIREBASE NOT CONNECTED. Skipping bridge read.")
-            return
+    def __init__(self, rtdb, read_mode=BRIDGE_READ_MODE, workers=BRIDGE_READ_WORKERS):
+        self.rtdb = rtdb
+        self.read_mode = read_mode
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bridge-read") if read_mode == 'parallel' else None
+        self._last_timestamps = {} # bin_id -> timestamp of the last bridged reading
+        self._warned = set() # Nodes already reported as unregistered
+        self.stats = {"cycles": 0, "reads": 0, "inserted": 0, "unchanged": 0, "unregistered": 0, "invalid": 0, "rejected": 0, "failed_cycles": 0}
+
+    def _registered_nodes(self, force_reload=False):
+        """(capacities, {node name: bin_id}) for every registered bin, both built once per registry snapshot."""
+        registry = smart_bin.get_bin_registry()
+        capacities = registry.capacities(force_reload=force_reload)
+        nodes = registry.derived('firebase_nodes', lambda bins: {firebase_node_name(bin_id): bin_id for bin_id in bins})
+        return capacities, nodes
+
+    def read_latest(self, nodes):
+        """Returns {node name: latest payload} for the device tree."""
+        if self.read_mode == 'parallel':
+            names = list(nodes)
+            self.stats["reads"] += len(names)
+            payloads = self._executor.map(lambda name: self.rtdb.reference(f"{name}/latest").get(), names)
+            return {name: payload for name, payload in zip(names, payloads) if payload}
+        self.stats["reads"] += 1
+        return latest_readings(self.rtdb.reference('/').get())
 
+    def run_cycle(self):
+        """Bridges one snapshot of the device tree. Returns the number of readings inserted."""
+        self.stats["cycles"] += 1
+        _, nodes = self._registered_nodes()
         try:
-            # firebase-admin syntax: reference().get()
-            fb_data = FIREBASE_DB.reference(path).get()
+            latest = self.read_latest(nodes)
         except Exception as e:
-            print(f"⚠️ Warning: Failed to read from Firebase for {bin_id}. {e}")
-            continue
+            print(f"⚠️ Warning: Failed to read from Firebase. {e}")
+            return 0
+        return self.commit_rows(self.prepare_rows(latest.items())) or 0
 
-        if not fb_data:
-            print(f"⚠️ Warning: No data found in Firebase for {bin_id}.")
-            continue
+    def prepare_rows(self, readings):
+        """
+        Validates (node name, payload) pairs into telemetry rows, skipping unregistered nodes and readings
+        whose timestamp was already bridged. An invalid reading is reported once and then skipped like a bridged
+        one until the device pushes a new reading.
+        """
+        readings = list(readings)
+        capacities, nodes = self._registered_nodes()
+        if any(name not in nodes and name not in self._warned for name, _ in readings):
+            capacities, nodes = self._registered_nodes(force_reload=True) # Pick up bins registered since the last reload
 
+        rows = []
+        for name, payload in readings:
+            bin_id = nodes.get(name)
+            if bin_id is None:
+                self.stats["unregistered"] += 1
+                if name not in self._warned:
+                    self._warned.add(name)
+                    print(f"❌ FK VIOLATION AVOIDED: Node {name} has no registered bin in dustbins. Skipping insertion.")
+                continue
+            if not isinstance(payload, dict):
+                self.stats["invalid"] += 1
+                continue
+            timestamp = payload.get('timestamp')
+            if timestamp is not None and self._last_timestamps.get(bin_id) == timestamp:
+                self.stats["unchanged"] += 1 # Device has not pushed since the last cycle
+                continue
+            try:
+                rows.append(smart_bin.validate_reading({**payload, 'bin_id': bin_id}, capacities))
+            except (ValueError, TypeError, ArithmeticError) as e:
+                self.stats["invalid"] += 1
+                print(f"⚠️ Warning: Invalid reading for {bin_id}: {e}")
+            if timestamp is None:
+                continue
+            self._last_timestamps[bin_id] = timestamp
+        return rows
+
+    def commit_rows(self, rows):
+        """
+        Writes prepared rows and returns how many were written, or None if the database could not be reached:
+        the unwritten readings are then forgotten so the next read bridges them again.
+        """
+        if not rows:
+            return 0
+        written, unwritten = self.write(rows)
+        for row in unwritten:
+            self._last_timestamps.pop(row[0], None) # Retry these readings next cycle
+        return None if unwritten else written
+
+    def write(self, rows):
+        """
+        Writes validated TELEMETRY_COPY_COLUMNS rows (and the alerts they open or close) with one COPY and one
+        commit. A batch the database rejects for its data is split in halves until the offending rows are alone;
+        only those are dropped. Returns (rows written, rows left unwritten because the connection failed).
+        """
+        alert_engine = smart_bin.get_alert_engine()
+        conn = get_db_connection()
+        if conn is None:
+            self.stats["failed_cycles"] += 1
+            return 0, rows
+        written = 0
+        pending = [rows] # Batches still to write, next one on top
         try:
             cursor = conn.cursor()
-            
-            # --- FOREIGN KEY CHECK (FIX to avoid 1452 error) ---
-            # Verify the bin is registered before attempting INSERT into Telemetry
-            bin_check_query = "SELECT 1 FROM Dustbins WHERE bin_id = %s LIMIT 1;"
-            cursor.execute(bin_check_query, (bin_id,))
-            if cursor.fetchone() is None:
-                print(f"❌ FK VIOLATION AVOIDED: Bin ID {bin_id} is not registered in Dustbins. Skipping insertion.")
-                continue
-            # --- END FOREIGN KEY CHECK ---
-            
-            # 2. Extract and format data for MySQL Telemetry table
-            fill_level_cm = fb_data.get('garbage_level_cm', 0)
-            fill_percentage = fb_data.get('fill_percentage', 0)
-            segregator_required = fb_data.get('segregator_required', 0)
-            
-            # alert_triggered (for MySQL) = segregator_required (1 if >= 98%)
-            alert_triggered = segregator_required
-            is_lid_locked = 1 if fill_percentage >= 90 else 0 
-            
-            timestamp_str = fb_data.get('timestamp', datetime.now().isoformat())
-            
-            insert_query = """
-            INSERT INTO Telemetry 
-            (bin_id, timestamp, fill_level_cm, fill_percentage, is_lid_locked, alert_triggered, delay_minutes)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """
-            
-            data_to_insert = (
-                bin_id, timestamp_str, fill_level_cm, fill_percentage, is_lid_locked, alert_triggered, 0
-            )
-            
-            cursor.execute(insert_query, data_to_insert)
-            conn.commit()
-            
-            print(f"[MYSQL INSERT] Bin: {bin_id} | Fill: {fill_percentage}% | Segregator: {segregator_required}")
+            try:
+                smart_bin.ensure_telemetry_partitions(cursor, {row[1] for row in rows})
+                conn.commit()
+            except psycopg2.Error as e:
+                conn.rollback() # Rows still land in telemetry_default
+                print(f"Error creating telemetry partitions: {e}")
+            while pending:
+                batch = pending.pop()
+                try:
+                    alerts = alert_engine.evaluate(cursor, batch)
+                    smart_bin.copy_telemetry_rows(cursor, batch)
+                    alert_engine.write(cursor, alerts)
+                    conn.commit()
+                except psycopg2.Error as e:
+                    conn.rollback()
+                    self.stats["failed_cycles"] += 1
+                    print(f"PostgreSQL Error during bridge insert of {len(batch)} readings: {e}")
+                    if isinstance(e, psycopg2.OperationalError):
+                        return written, batch + [row for part in reversed(pending) for row in part]
+                    if len(batch) == 1:
+                        self.stats["rejected"] += 1 # Bad data: retrying this reading would fail again
+                    else:
+                        middle = len(batch) // 2
+                        pending += [batch[middle:], batch[:middle]]
+                    continue
+                alert_engine.apply(alerts)
+                written += len(batch)
+            cursor.close()
+        finally:
+            smart_bin.release_db_connection(conn)
+        self.stats["inserted"] += written
+        if written:
+            print(f"[POSTGRES INSERT] {written} readings in one batch" if written == len(rows) else f"[POSTGRES INSERT] {written} of {len(rows)} readings")
+        return written, []
+
+
+def latest_readings(tree):
+    """{node name: latest payload} from a snapshot of the device tree."""
+    if not isinstance(tree, dict):
+        return {}
+    return {name: node['latest'] for name, node in tree.items()
+            if name.startswith('dustbin-') and isinstance(node, dict) and isinstance(node.get('latest'), dict)}
 
+
+class ListenerBridge(FirebaseBridge):
+    """
+    Event-driven bridge: listens for changes under BRIDGE_LISTEN_PATH and queues only the device nodes that
+    changed. A writer thread drains the bounded queue in batches (one COPY + commit each) every
+    BRIDGE_FLUSH_SECONDS. A dropped listener is reopened with exponential backoff; the listener's initial
+    snapshot then resumes the bridge, and timestamp dedup keeps readings that were already written out.
+    A failed writer pass is logged and counted (stats["writer_errors"]) and the writer carries on;
+    stats["writer_alive"] and stats["writer_heartbeat"] show whether it is still draining.
+    """
+
+    def __init__(self, rtdb, queue_max=BRIDGE_QUEUE_MAX):
+        super().__init__(rtdb, read_mode='parent')
+        self._queue = queue.Queue(maxsize=queue_max)
+        self._mirror = {} # Local copy of the device tree, kept current from the events
+        self._mirror_lock = threading.Lock()
+        self._resync = threading.Event() # Set when readings were dropped: next writer pass polls the whole tree
+        self._backoff = 1
+        self._writer = None
+        self._in_flight = [] # Rows the writer is committing; re-bridged if its pass fails
+        self.stats.update({"events": 0, "queued": 0, "dropped": 0, "connects": 0, "reconnects": 0,
+                           "resyncs": 0, "last_latency_ms": 0.0, "max_latency_ms": 0.0,
+                           "writer_errors": 0, "writer_alive": False, "writer_heartbeat": None})
+
+    def _apply_event(self, event):
+        """Applies a put/patch event to the mirror. Returns {node name: latest payload} for the nodes it touched."""
+        parts = [part for part in (event.path or '/').split('/') if part]
+        if event.event_type == 'patch':
+            updates = [(parts + [part for part in key.split('/') if part], value) for key, value in (event.data or {}).items()]
+        else:
+            updates = [(parts, event.data)]
+        touched = set()
+        with self._mirror_lock:
+            for keys, value in updates:
+                if not keys:
+                    self._mirror = copy.deepcopy(value) if isinstance(value, dict) else {}
+                    touched.update(self._mirror)
+                    continue
+                node = self._mirror
+                for key in keys[:-1]:
+                    if not isinstance(node.get(key), dict):
+                        node[key] = {}
+                    node = node[key]
+                if value is None:
+                    node.pop(keys[-1], None)
+                else:
+                    node[keys[-1]] = copy.deepcopy(value)
+                touched.add(keys[0])
+            return latest_readings({name: copy.deepcopy(self._mirror.get(name)) for name in touched})
+
+    def _on_event(self, event):
+        try:
+            self._backoff = 1 # The connection works again
+            self.stats["events"] += 1
+            received = time.monotonic()
+            wait = True # Only the first reading that finds the queue full waits; the rest are dropped at once
+            for name, payload in self._apply_event(event).items():
+                try:
+                    self._queue.put((name, payload, received), block=wait, timeout=BRIDGE_QUEUE_PUT_TIMEOUT)
+                    self.stats["queued"] += 1
+                except queue.Full:
+                    wait = False
+                    self.stats["dropped"] += 1
+                    self._resync.set() # The next writer pass reads the whole tree, dropped nodes included
         except Exception as e:
-            print(f"MySQL Error during bridge insert for {bin_id}: {e}")
-            conn.rollback() 
+            print(f"⚠️ Warning: Could not process RTDB event at {getattr(event, 'path', '?')}: {e}")
+
+    def _drain(self, stop):
+        """Writer thread: batches queued readings into COPYs until stopped, surviving failed passes."""
+        self.stats["writer_alive"] = True
+        try:
+            while not stop.is_set():
+                self.stats["writer_heartbeat"] = time.time()
+                try:
+                    self._drain_once()
+                except Exception as e:
+                    self.stats["writer_errors"] += 1
+                    for row in self._in_flight:
+                        self._last_timestamps.pop(row[0], None) # Not known to be written: bridge them again
+                    self._in_flight = []
+                    self._resync.set() # Queued readings taken by the failed pass are caught up from a full read
+                    print(f"⚠️ Warning: Bridge writer pass failed: {e}")
+                    stop.wait(1)
         finally:
-            if 'cursor' in locals() and cursor:
-                 cursor.close()
-    
-    if conn and conn.is_connected():
-        conn.close()
+            self.stats["writer_alive"] = False
+
+    def _drain_once(self):
+        """One writer pass: waits up to BRIDGE_FLUSH_SECONDS for a batch, then resyncs if needed and writes it."""
+        try:
+            batch = [self._queue.get(timeout=BRIDGE_FLUSH_SECONDS)]
+        except queue.Empty:
+            batch = []
+        deadline = time.monotonic() + BRIDGE_FLUSH_SECONDS
+        while batch and len(batch) < BRIDGE_BATCH_MAX:
+            try:
+                batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        if self._resync.is_set():
+            self._resync.clear()
+            self.stats["resyncs"] += 1
+            self.run_cycle()
+        if not batch:
+            return
+        rows = self.prepare_rows((name, payload) for name, payload, _ in batch)
+        self._in_flight = rows
+        written = self.commit_rows(rows) if rows else 0
+        self._in_flight = []
+        if written is None:
+            self._resync.set() # Write failed: catch up from a full read once the database is back
+            return
+        latency_ms = round((time.monotonic() - batch[0][2]) * 1000, 1)
+        self.stats["last_latency_ms"] = latency_ms
+        self.stats["max_latency_ms"] = max(self.stats["max_latency_ms"], latency_ms)
+
+    def _ensure_writer(self, stop):
+        """Starts the writer thread, or restarts it if it has died."""
+        if self._writer is None or not self._writer.is_alive():
+            if self._writer is not None:
+                print("⚠️ Bridge writer thread stopped; restarting it.")
+            self._writer = threading.Thread(target=self._drain, args=(stop,), name="bridge-writer", daemon=True)
+            self._writer.start()
+
+    def run(self, stop=None):
+        """Listens (and reconnects) until `stop` is set. Blocks; run it on its own thread if needed."""
+        stop = stop or threading.Event()
+        self._ensure_writer(stop)
+        while not stop.is_set():
+            registration = None
+            try:
+                registration = self.rtdb.reference(BRIDGE_LISTEN_PATH).listen(self._on_event)
+                self.stats["connects"] += 1
+                print(f"✅ Listening for RTDB changes under {BRIDGE_LISTEN_PATH}")
+                # firebase_admin ends the listener thread when the event stream fails
+                while not stop.is_set() and getattr(registration, '_thread', None) is not None and registration._thread.is_alive():
+                    stop.wait(1)
+                    self._ensure_writer(stop)
+            except Exception as e:
+                print(f"⚠️ Warning: RTDB listener failed: {e}")
+            finally:
+                if registration is not None:
+                    registration.close()
+            if not stop.is_set():
+                self.stats["reconnects"] += 1
+                print(f"⚠️ RTDB listener disconnected; reconnecting in {self._backoff}s.")
+                stop.wait(self._backoff)
+                self._backoff = min(self._backoff * 2, BRIDGE_RECONNECT_MAX_SECONDS)
+
+
+_BRIDGE = None
+
+def bridge_firebase_to_postgres():
+    """Reads all 'latest' data from Firebase and pushes the new readings into the PostgreSQL telemetry table."""
+    global _BRIDGE
+    if FIREBASE_DB is None:
+        print("❌ FIREBASE NOT CONNECTED. Skipping bridge read.")
+        return 0
+    if _BRIDGE is None or _BRIDGE.rtdb is not FIREBASE_DB:
+        _BRIDGE = FirebaseBridge(FIREBASE_DB)
+    return _BRIDGE.run_cycle()
 
 
 # --- 5. MAIN EXECUTION ---
 
 if __name__ == "__main__":
-    
+    parser = argparse.ArgumentParser(description="ESP32 simulator and Firebase -> PostgreSQL bridge")
+    parser.add_argument('--fake', action='store_true', help="Use the in-memory RTDB stand-in instead of Firebase")
+    parser.add_argument('--read-mode', choices=('parent', 'parallel'), default=BRIDGE_READ_MODE)
+    parser.add_argument('--listen', action='store_true', help="Bridge from RTDB change events instead of polling")
+    parser.add_argument('--bins', type=int, help="Simulate this many registered bins instead of BIN_IDS_TO_SIMULATE")
+    args = parser.parse_args()
+    BRIDGE_READ_MODE = args.read_mode
+    FIREBASE_DB = FakeRealtimeDatabase() if args.fake else init_firebase()
+    _BRIDGE = FirebaseBridge(FIREBASE_DB, args.read_mode) if FIREBASE_DB is not None else None
+    if args.listen and FIREBASE_DB is not None:
+        threading.Thread(target=ListenerBridge(FIREBASE_DB).run, name="bridge-listener", daemon=True).start()
+
     # Initialize random levels
-    bin_levels = {id: random.randint(30, 180) for id in BIN_IDS_TO_SIMULATE}
-    print("--- Starting Firebase Simulation and MySQL Bridge ---")
+    simulated = sorted(get_bin_capacities())[:args.bins] if args.bins else BIN_IDS_TO_SIMULATE
+    bin_levels = {id: random.randint(30, 180) for id in simulated}
+    print("--- Starting Firebase Simulation and PostgreSQL Bridge ---")
 
     try:
         while True:
+            cycle_started = time.monotonic()
+
             # Step A: Simulate ESP32 pushing data to Firebase
             bin_levels = simulate_and_push_to_firebase(bin_levels)
-            
-            # Step B: Bridge reads from Firebase and writes to MySQL
-            bridge_firebase_to_mysql()
-            
-            time.sleep(5)
+
+            # Step B: Bridge reads from Firebase and writes to PostgreSQL (the listener does this continuously)
+            if not args.listen:
+                bridge_firebase_to_postgres()
+
+            time.sleep(max(0, BRIDGE_INTERVAL_SECONDS - (time.monotonic() - cycle_started)))
 
     except KeyboardInterrupt:
         print("\nSimulator service stopped by user.")
     except Exception as e:
-        print(f"An error occurred: {e}")
\ No newline at end of file
+        print(f"An error occurred: {e}")
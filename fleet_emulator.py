@@ -0,0 +1,434 @@
+"""
+Device fleet emulator: a pool of processes emulating thousands of ESP32 bins (Firebase_interface.ino) as the load
+source for capacity tests.
+
+    python fleet_emulator.py http --url http://127.0.0.1:5000 --devices 20000 --interval 5 --duration 300
+    python fleet_emulator.py rtdb --devices 100000 --processes 8 --bridge
+    python fleet_emulator.py http --url http://127.0.0.1:5000 --devices 5000 --time-scale 720 --log-collections
+
+Each device reports the firmware's reading (garbage_level_cm, fill_percentage, segregator_required, timestamp)
+every --interval seconds, with staggered phases. Between readings a bin fills at its own rate (log-normal across
+the fleet, swinging over the day, in bursts), the ultrasonic sensor adds jitter and occasionally loses its echo,
+and full bins are emptied by a collection some hours after they reach COLLECTION_TRIGGER_PERCENT. --time-scale
+speeds up that physics (720: one simulated day per two minutes); reading timestamps stay real time.
+
+Targets:
+    http  POSTs readings to /api/v1/telemetry/batch, --batch-size per request (1: one request per device)
+    rtdb  writes /dustbin-XXX/latest nodes to a local RTDB stand-in per process (firebase_simulator.py), with one
+          multi-path update per batch; --bridge also runs the Firebase -> PostgreSQL bridge on each stand-in
+
+Devices are the first --devices registered bins (from GET /api/v1/bins/registered for http, from the DB_*
+database for rtdb); `python benchmark.py seed --bins 100000` registers enough of them. Achieved throughput is
+reported against the target (devices / interval) every --report-every seconds and at the end.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import firebase_simulator
+import app as smart_bin
+
+# --- 1. CONFIGURATION ---
+
+EMULATOR_INTERVAL_SECONDS = 5 # pushInterval of Firebase_interface.ino
+EMULATOR_BATCH_SIZE = 100 # Readings per POST / multi-path update
+EMULATOR_CONNECTIONS = 8 # Concurrent requests per process
+EMULATOR_STATS_SECONDS = 1.0 # Processes send their counters to the parent this often
+
+# Device model (distances are from the sensor down to the garbage, as the firmware measures them)
+MIN_DISTANCE_CM = 10 # Closest the sensor can read: a full bin (MIN_DISTANCE_CM in the firmware)
+FILL_HOURS_MEDIAN = 36 # Median time for a bin to fill from empty
+FILL_HOURS_SIGMA = 0.6 # Log-normal spread of that time across the fleet
+DIURNAL_AMPLITUDE = 0.6 # Fill rate swings +/-60% over the day...
+DIURNAL_PEAK_HOUR = 14 # ...peaking at this local hour
+SENSOR_NOISE_CM = 1.5 # Standard deviation of the ultrasonic jitter
+SENSOR_GLITCH_RATE = 0.002 # Share of readings where the echo is lost and the sensor reports an empty bin
+COLLECTION_TRIGGER_PERCENT = smart_bin.LOCK_THRESHOLD_PERCENT # A collection is dispatched once a bin is this full
+COLLECTION_DELAY_HOURS = 3 # Mean time from dispatch to the bin being emptied (exponential)
+COLLECTION_RESIDUE_CM = 5 # Up to this much garbage is left behind
+
+COUNTERS = ('generated', 'sent', 'accepted', 'rejected', 'throttled', 'failed', 'missed', 'collections', 'bridged')
+
+# --- 2. DEVICE MODEL ---
+
+def diurnal_factor(moment):
+    """Fill-rate multiplier at epoch time `moment` (local time of day)."""
+    local = time.localtime(moment)
+    hour = local.tm_hour + local.tm_min / 60
+    return max(0.0, 1 + DIURNAL_AMPLITUDE * np.cos(2 * np.pi * (hour - DIURNAL_PEAK_HOUR) / 24))
+
+
+class DeviceShard:
+    """State of one process's share of the fleet. Due devices are stepped together in one vectorized pass."""
+
+    def __init__(self, bin_ids, capacities, rng, time_scale, started):
+        count = len(bin_ids)
+        self.bin_ids = bin_ids
+        self.nodes = [firebase_simulator.firebase_node_name(bin_id) for bin_id in bin_ids]
+        self.capacity = np.asarray(capacities, dtype=np.float64)
+        self.rng = rng
+        self.time_scale = time_scale
+        self.started = started
+        fill_hours = FILL_HOURS_MEDIAN * rng.lognormal(0, FILL_HOURS_SIGMA, count)
+        self.rate = (self.capacity - MIN_DISTANCE_CM) / fill_hours # cm per simulated hour
+        self.level = self.capacity - rng.uniform(0, 0.8, count) * (self.capacity - MIN_DISTANCE_CM)
+        self.collect_at = np.full(count, np.inf) # Simulated time the dispatched collection empties the bin
+        self.last_step = np.full(count, started)
+
+    def step(self, due, now):
+        """
+        Advances devices `due` (index array) to wall-clock time `now` and takes their readings.
+        Returns (reported distance cm, fill percentage, indices emptied by a collection since the last reading).
+        """
+        sim_now = self.started + (now - self.started) * self.time_scale
+        collected = due[self.collect_at[due] <= sim_now]
+        if collected.size:
+            self.level[collected] = self.capacity[collected] - self.rng.uniform(0, COLLECTION_RESIDUE_CM, collected.size)
+            self.collect_at[collected] = np.inf
+
+        hours = (now - self.last_step[due]) * self.time_scale / 3600
+        self.last_step[due] = now
+        growth = self.rate[due] * hours * diurnal_factor(sim_now) * self.rng.exponential(1.0, due.size) # Bursty
+        self.level[due] = np.maximum(self.level[due] - growth, MIN_DISTANCE_CM)
+
+        capacity = self.capacity[due]
+        reported = np.rint(self.level[due] + self.rng.normal(0, SENSOR_NOISE_CM, due.size))
+        reported = np.where(self.rng.random(due.size) < SENSOR_GLITCH_RATE, capacity, reported)
+        reported = np.clip(reported, MIN_DISTANCE_CM, capacity).astype(np.int64) # constrain() in the firmware
+        fill = firebase_simulator.calculate_fill_percentages(capacity, reported)
+
+        # Dispatch on the true level: the dashboard would see the lid lock, not one noisy reading
+        true_fill = (capacity - self.level[due]) / capacity * 100
+        dispatched = due[(true_fill >= COLLECTION_TRIGGER_PERCENT) & np.isinf(self.collect_at[due])]
+        if dispatched.size:
+            self.collect_at[dispatched] = sim_now + self.rng.exponential(COLLECTION_DELAY_HOURS * 3600, dispatched.size)
+        return reported, fill, collected
+
+# --- 3. TARGETS ---
+
+class ShardStats:
+    """Counters and request latencies of one process, handed to the parent as deltas."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(COUNTERS, 0)
+        self._latencies = []
+
+    def add(self, latency=None, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self._counts[key] += value
+            if latency is not None:
+                self._latencies.append(latency)
+
+    def take(self):
+        with self._lock:
+            counts, self._counts = self._counts, dict.fromkeys(COUNTERS, 0)
+            latencies, self._latencies = self._latencies, []
+        return counts, latencies
+
+
+class HttpTarget:
+    """Posts readings to the ingestion API (keep-alive session per sender thread)."""
+
+    def __init__(self, url, stats):
+        import requests
+        self._requests = requests
+        self.url = url.rstrip('/')
+        self.stats = stats
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        return session
+
+    def send(self, shard, indices, reported, fill, timestamp):
+        readings = [{
+            "bin_id": shard.bin_ids[i],
+            "garbage_level_cm": level,
+            "fill_percentage": percent,
+            "segregator_required": 1 if percent >= smart_bin.SEGREGATOR_THRESHOLD_PERCENT else 0,
+            "timestamp": timestamp,
+        } for i, level, percent in zip(indices.tolist(), reported.tolist(), fill.tolist())]
+        started = time.perf_counter()
+        try:
+            response = self._session().post(f"{self.url}/api/v1/telemetry/batch", data=json.dumps(readings),
+                                            headers={'Content-Type': 'application/json'}, timeout=60)
+        except self._requests.RequestException:
+            self.stats.add(sent=len(readings), failed=len(readings))
+            return
+        latency = time.perf_counter() - started
+        if response.status_code in (202, 400) and response.headers.get('Content-Type', '').startswith('application/json'):
+            body = response.json()
+            self.stats.add(latency, sent=len(readings), accepted=body.get('accepted', 0), rejected=body.get('rejected', len(readings)))
+        elif response.status_code == 503:
+            self.stats.add(latency, sent=len(readings), throttled=len(readings)) # Ingest backlog full
+        else:
+            self.stats.add(latency, sent=len(readings), failed=len(readings))
+
+    def log_collection(self, bin_id):
+        try:
+            self._session().post(f"{self.url}/api/v1/log_collection", json={"bin_id": bin_id}, timeout=60)
+        except self._requests.RequestException:
+            pass
+
+
+class RtdbTarget:
+    """Writes readings to this process's local RTDB stand-in, like the devices write to Firebase."""
+
+    def __init__(self, stats, latency=firebase_simulator.FAKE_RTDB_LATENCY):
+        self.rtdb = firebase_simulator.FakeRealtimeDatabase(latency)
+        self.stats = stats
+
+    def send(self, shard, indices, reported, fill, timestamp):
+        updates = {f"{shard.nodes[i]}/latest": {
+            "garbage_level_cm": level,
+            "fill_percentage": percent,
+            "segregator_required": 1 if percent >= smart_bin.SEGREGATOR_THRESHOLD_PERCENT else 0,
+            "timestamp": timestamp,
+        } for i, level, percent in zip(indices.tolist(), reported.tolist(), fill.tolist())}
+        started = time.perf_counter()
+        try:
+            self.rtdb.reference('/').update(updates)
+        except Exception:
+            self.stats.add(sent=len(updates), failed=len(updates))
+            return
+        self.stats.add(time.perf_counter() - started, sent=len(updates), accepted=len(updates))
+
+    def run_bridge(self, stop):
+        """Polls this stand-in into PostgreSQL every BRIDGE_INTERVAL_SECONDS until `stop` is set."""
+        bridge = firebase_simulator.FirebaseBridge(self.rtdb)
+        while not stop.wait(firebase_simulator.BRIDGE_INTERVAL_SECONDS):
+            self.stats.add(bridged=bridge.run_cycle())
+
+# --- 4. EMULATOR PROCESSES ---
+
+def run_shard(index, devices, options, reports, go, stop):
+    """Process entry point: emulates `devices` [(bin_id, capacity_cm)] from `go` until `stop` is set."""
+    try:
+        stats = ShardStats()
+        if options['target'] == 'http':
+            target = HttpTarget(options['url'], stats)
+        else:
+            target = RtdbTarget(stats)
+        interval = options['interval']
+        batch_size = options['batch_size']
+        senders = ThreadPoolExecutor(max_workers=options['connections'], thread_name_prefix=f"emulator-{index}")
+        in_flight = threading.BoundedSemaphore(options['connections'] * 2) # Beyond this, the shard falls behind
+
+        def send(*batch):
+            try:
+                target.send(*batch)
+            finally:
+                in_flight.release()
+
+        reports.put(('ready', index, None))
+        go.wait()
+        if options['bridge']:
+            threading.Thread(target=target.run_bridge, args=(stop,), name="emulator-bridge", daemon=True).start()
+
+        rng = np.random.default_rng(options['seed'] + index)
+        started = time.time()
+        shard = DeviceShard([bin_id for bin_id, _ in devices], [capacity for _, capacity in devices], rng, options['time_scale'], started)
+        next_due = started + rng.uniform(0, interval, len(devices)) # Devices don't boot in lockstep
+        last_report = time.monotonic()
+
+        while not stop.is_set():
+            now = time.time()
+            due = np.flatnonzero(next_due <= now)
+            if due.size:
+                behind = np.floor((now - next_due[due]) / interval) # Whole intervals this device is late by
+                next_due[due] += (behind + 1) * interval
+                reported, fill, collected = shard.step(due, now)
+                stats.add(generated=due.size, missed=int(behind.sum()), collections=collected.size)
+                if options['log_collections'] and options['target'] == 'http':
+                    for i in collected.tolist():
+                        senders.submit(target.log_collection, shard.bin_ids[i])
+                timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now)) # Firmware's format
+                for start in range(0, due.size, batch_size):
+                    in_flight.acquire()
+                    batch = slice(start, start + batch_size)
+                    senders.submit(send, shard, due[batch], reported[batch], fill[batch], timestamp)
+
+            if time.monotonic() - last_report >= EMULATOR_STATS_SECONDS:
+                last_report = time.monotonic()
+                reports.put(('stats', index, stats.take()))
+            time.sleep(min(0.05, max(0.0, next_due.min() - time.time())))
+
+        senders.shutdown(wait=True)
+        reports.put(('stats', index, stats.take()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reports.put(('done', index, None))
+
+
+def load_devices(target, url, count):
+    """[(bin_id, max_capacity_cm)] of the first `count` registered bins."""
+    if target == 'http':
+        import requests
+        response = requests.get(f"{url.rstrip('/')}/api/v1/bins/registered", timeout=60)
+        response.raise_for_status()
+        capacities = {b['bin_id']: b.get('max_capacity_cm') for b in response.json()['bins']}
+    else:
+        capacities = firebase_simulator.get_bin_capacities()
+    return [(bin_id, capacities[bin_id] or firebase_simulator.DEFAULT_CAPACITY_CM) for bin_id in sorted(capacities)[:count]]
+
+
+def latency_summary(latencies):
+    if not latencies:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+    return {"p50": round(float(p50), 1), "p95": round(float(p95), 1), "p99": round(float(p99), 1)}
+
+
+def print_interval(elapsed, counts, latencies, seconds, target_rate):
+    achieved = counts['accepted'] / seconds
+    p95 = latency_summary(latencies)['p95']
+    print(f"[EMULATOR] {elapsed:6.0f}s | target {target_rate:,.0f}/s | accepted {achieved:,.0f}/s "
+          f"({achieved / target_rate * 100:.1f}%) | rejected {counts['rejected']} | throttled {counts['throttled']} | "
+          f"failed {counts['failed']} | missed {counts['missed']} | collections {counts['collections']} | "
+          f"bridged {counts['bridged']} | p95 {p95 if p95 is not None else '-'} ms")
+
+
+def emulate(devices, options):
+    """Runs the fleet for options['duration'] seconds across options['processes'] processes. Returns the summary."""
+    context = multiprocessing.get_context('spawn') # Don't fork app.py's pool and listener threads
+    reports, go, stop = context.Queue(), context.Event(), context.Event()
+    shards = [devices[i::options['processes']] for i in range(options['processes'])]
+    shards = [shard for shard in shards if shard]
+    processes = [context.Process(target=run_shard, args=(index, shard, options, reports, go, stop), daemon=True)
+                 for index, shard in enumerate(shards)]
+    for process in processes:
+        process.start()
+
+    pending = len(processes)
+    while pending:
+        kind, index, _ = reports.get()
+        if kind == 'ready':
+            pending -= 1
+        elif kind == 'done':
+            raise RuntimeError(f"Emulator process {index} exited during startup.")
+
+    target_rate = len(devices) / options['interval']
+    print(f"--- Emulating {len(devices):,} devices in {len(processes)} processes: target {target_rate:,.0f} readings/s ({options['target']}) ---")
+    totals = dict.fromkeys(COUNTERS, 0)
+    window = dict.fromkeys(COUNTERS, 0)
+    latencies, window_latencies = [], []
+    go.set()
+    started = last_print = time.monotonic()
+    stopped = None
+    running = len(processes)
+    try:
+        while running:
+            if stopped is None and time.monotonic() - started >= options['duration']:
+                stop.set()
+                stopped = time.monotonic()
+            try:
+                kind, index, payload = reports.get(timeout=0.5)
+            except queue.Empty:
+                kind = None
+            if kind == 'stats':
+                counts, samples = payload
+                for key, value in counts.items():
+                    totals[key] += value
+                    window[key] += value
+                latencies.extend(samples)
+                window_latencies.extend(samples)
+            elif kind == 'done':
+                running -= 1
+            if stopped is None and time.monotonic() - last_print >= options['report_every']:
+                print_interval(time.monotonic() - started, window, window_latencies, time.monotonic() - last_print, target_rate)
+                window, window_latencies, last_print = dict.fromkeys(COUNTERS, 0), [], time.monotonic()
+    except KeyboardInterrupt:
+        stop.set()
+        print("\nEmulator stopped by user.")
+    elapsed = (stopped or time.monotonic()) - started
+    for process in processes:
+        process.join(timeout=10)
+
+    achieved = totals['accepted'] / elapsed if elapsed else 0.0
+    return {
+        "target": options['target'],
+        "devices": len(devices),
+        "processes": len(processes),
+        "interval_s": options['interval'],
+        "batch_size": options['batch_size'],
+        "time_scale": options['time_scale'],
+        "elapsed_s": round(elapsed, 1),
+        "target_rps": round(target_rate, 1),
+        "achieved_rps": round(achieved, 1),
+        "achieved_ratio": round(achieved / target_rate, 4) if target_rate else None,
+        **totals,
+        "latency_ms": latency_summary(latencies),
+    }
+
+
+def print_summary(summary):
+    latency = summary['latency_ms']
+    print(f"\n--- Fleet emulation: {summary['devices']:,} devices, {summary['elapsed_s']}s ({summary['target']}) ---")
+    print(f"Target:    {summary['target_rps']:,.1f} readings/s")
+    print(f"Achieved:  {summary['achieved_rps']:,.1f} readings/s ({(summary['achieved_ratio'] or 0) * 100:.1f}%)")
+    print(f"Readings:  {summary['generated']:,} generated, {summary['sent']:,} sent, {summary['accepted']:,} accepted, "
+          f"{summary['rejected']:,} rejected, {summary['throttled']:,} throttled, {summary['failed']:,} failed, {summary['missed']:,} missed")
+    print(f"Requests:  p50 {latency['p50']} ms, p95 {latency['p95']} ms, p99 {latency['p99']} ms")
+    print(f"Fleet:     {summary['collections']:,} collections, {summary['bridged']:,} readings bridged to PostgreSQL")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-process ESP32 fleet emulator (load source for capacity tests)")
+    parser.add_argument('target', choices=('http', 'rtdb'), help="Ingestion API over HTTP, or a local RTDB stand-in")
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help="Server for the http target")
+    parser.add_argument('--devices', type=int, default=10000)
+    parser.add_argument('--interval', type=float, default=EMULATOR_INTERVAL_SECONDS, help="Seconds between a device's readings")
+    parser.add_argument('--duration', type=float, default=60, help="Seconds to run")
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--connections', type=int, default=EMULATOR_CONNECTIONS, help="Concurrent requests per process")
+    parser.add_argument('--batch-size', type=int, default=EMULATOR_BATCH_SIZE, help="Readings per request (1: one per device)")
+    parser.add_argument('--time-scale', type=float, default=1.0, help="Simulated seconds of filling per real second")
+    parser.add_argument('--log-collections', action='store_true', help="Also POST /api/v1/log_collection for emptied bins (http)")
+    parser.add_argument('--bridge', action='store_true', help="Bridge each RTDB stand-in to PostgreSQL (rtdb)")
+    parser.add_argument('--report-every', type=float, default=5)
+    parser.add_argument('--fail-below', type=float, help="Exit non-zero if achieved/target throughput is below this ratio")
+    parser.add_argument('--output', help="Also write the summary JSON here")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    if args.bridge and args.target != 'rtdb':
+        parser.error("--bridge needs the rtdb target.")
+    if min(args.devices, args.processes, args.connections, args.batch_size) < 1 or args.interval <= 0:
+        parser.error("--devices, --processes, --connections, --batch-size and --interval must be positive.")
+
+    try:
+        devices = load_devices(args.target, args.url, args.devices)
+    except Exception as e:
+        print(f"❌ Could not load registered bins: {e}")
+        return 1
+    if not devices:
+        print("❌ No registered bins to emulate. Register some first (python benchmark.py seed --bins N).")
+        return 1
+    if len(devices) < args.devices:
+        print(f"⚠️ Warning: only {len(devices):,} bins are registered; emulating those instead of {args.devices:,}.")
+
+    summary = emulate(devices, vars(args))
+    print_summary(summary)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    if args.fail_below is not None and (summary['achieved_ratio'] or 0) < args.fail_below:
+        print(f"\n❌ Achieved {summary['achieved_ratio'] * 100:.1f}% of the target throughput (minimum {args.fail_below * 100:.0f}%).")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())